@@ -0,0 +1,118 @@
+"""
+Process-wide AsyncAnthropic client.
+
+The app creates one client on startup and closes it on shutdown, so every
+description reuses the same keep-alive connection pool instead of paying a
+TCP + TLS handshake per image. Connection timings are captured through
+httpx's trace extension so we can tell connect time apart from time to
+first token.
+"""
+
+import contextvars
+import os
+import time
+
+import httpx
+from anthropic import AsyncAnthropic
+
+ANTHROPIC_API_KEY = os.getenv('ANTHROPIC_API_KEY')
+# Override to point at a proxy or at benchmarks/stub_backends.py
+ANTHROPIC_BASE_URL = os.getenv("ANTHROPIC_BASE_URL") or None
+ANTHROPIC_MAX_CONNECTIONS = int(os.getenv("ANTHROPIC_MAX_CONNECTIONS", "20"))
+ANTHROPIC_MAX_KEEPALIVE = int(os.getenv("ANTHROPIC_MAX_KEEPALIVE", "10"))
+ANTHROPIC_KEEPALIVE_EXPIRY = float(os.getenv("ANTHROPIC_KEEPALIVE_EXPIRY", "60"))
+ANTHROPIC_TIMEOUT = float(os.getenv("ANTHROPIC_TIMEOUT", "60"))
+ANTHROPIC_CONNECT_TIMEOUT = float(os.getenv("ANTHROPIC_CONNECT_TIMEOUT", "10"))
+ANTHROPIC_MAX_RETRIES = int(os.getenv("ANTHROPIC_MAX_RETRIES", "2"))
+
+_client = None
+_http_client = None
+_request_timing = contextvars.ContextVar("anthropic_request_timing", default=None)
+
+
+async def _on_request(request):
+    """Attach an httpcore trace callback for requests made under begin_request_timing()."""
+    timing = _request_timing.get()
+    if timing is None:
+        return
+    timing["request_start"] = time.perf_counter()
+
+    async def trace(event_name, info):
+        timing[event_name] = time.perf_counter()
+
+    request.extensions["trace"] = trace
+
+
+def begin_request_timing():
+    """Start collecting connection timings for requests made in the current task."""
+    timing = {}
+    _request_timing.set(timing)
+    return timing
+
+
+def summarise_request_timing(timing):
+    """Reduce raw trace events to connect/TLS/response-header durations in seconds."""
+    summary = {"reused_connection": "connection.connect_tcp.started" not in timing}
+    start = timing.get("request_start")
+    tcp_start = timing.get("connection.connect_tcp.started")
+    tcp_done = timing.get("connection.connect_tcp.complete")
+    tls_done = timing.get("connection.start_tls.complete")
+    if tcp_start is not None and tcp_done is not None:
+        summary["tcp"] = tcp_done - tcp_start
+    if tcp_start is not None and tls_done is not None:
+        summary["connect"] = tls_done - tcp_start
+    else:
+        summary["connect"] = summary.get("tcp", 0.0)
+    for event in ("http11.receive_response_headers.complete", "http2.receive_response_headers.complete"):
+        if start is not None and event in timing:
+            summary["response_headers"] = timing[event] - start
+            break
+    return summary
+
+
+def _create_client():
+    global _http_client
+    _http_client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=ANTHROPIC_MAX_CONNECTIONS,
+            max_keepalive_connections=ANTHROPIC_MAX_KEEPALIVE,
+            keepalive_expiry=ANTHROPIC_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(ANTHROPIC_TIMEOUT, connect=ANTHROPIC_CONNECT_TIMEOUT),
+        event_hooks={"request": [_on_request]},
+    )
+    return AsyncAnthropic(
+        api_key=ANTHROPIC_API_KEY,
+        base_url=ANTHROPIC_BASE_URL,
+        http_client=_http_client,
+        max_retries=ANTHROPIC_MAX_RETRIES,
+    )
+
+
+async def start_anthropic_client():
+    """Create the shared client (called from app startup)."""
+    global _client
+    if _client is None:
+        _client = _create_client()
+        print(f"Anthropic client ready (pool: {ANTHROPIC_MAX_CONNECTIONS} connections, {ANTHROPIC_MAX_KEEPALIVE} keep-alive)")
+    return _client
+
+
+async def close_anthropic_client():
+    """Close the shared client and its connection pool (called from app shutdown)."""
+    global _client, _http_client
+    client, http_client = _client, _http_client
+    _client = None
+    _http_client = None
+    if client is not None:
+        await client.close()
+    if http_client is not None and not http_client.is_closed:
+        await http_client.aclose()
+
+
+def get_anthropic_client():
+    """Return the shared client, creating it lazily outside the app lifecycle."""
+    global _client
+    if _client is None:
+        _client = _create_client()
+    return _client
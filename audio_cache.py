@@ -0,0 +1,233 @@
+"""
+Content-addressed cache for synthesised audio.
+
+Results are keyed on a hash of the voice embedding, text, language and
+synthesis settings, and stored as the list of (format, payload) chunks the
+TTS pipeline produced. Two tiers:
+
+- memory: LRU bounded by a byte budget
+- disk: one file per key under AUDIO_CACHE_DIR, evicted oldest-first by size
+"""
+
+import hashlib
+import json
+import os
+import struct
+import threading
+from collections import OrderedDict
+
+AUDIO_CACHE_ENABLED = os.getenv("AUDIO_CACHE_ENABLED", "1") == "1"
+AUDIO_CACHE_MEMORY_MB = float(os.getenv("AUDIO_CACHE_MEMORY_MB", "64"))
+AUDIO_CACHE_DISK_MB = float(os.getenv("AUDIO_CACHE_DISK_MB", "512"))
+AUDIO_CACHE_DIR = os.getenv("AUDIO_CACHE_DIR", "audio_cache")
+
+_CHUNK_HEADER = struct.Struct("<BI")
+
+
+def make_cache_key(voice_fingerprint, text, language="en", params=None):
+    """Stable hash of everything that determines the synthesised audio."""
+    material = json.dumps({
+        "voice": voice_fingerprint,
+        "text": text,
+        "language": language,
+        "params": params or {},
+    }, sort_keys=True)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def _encode_chunks(chunks):
+    return b"".join(_CHUNK_HEADER.pack(fmt, len(payload)) + payload for fmt, payload in chunks)
+
+
+def _decode_chunks(data):
+    chunks = []
+    offset = 0
+    while offset < len(data):
+        fmt, length = _CHUNK_HEADER.unpack_from(data, offset)
+        offset += _CHUNK_HEADER.size
+        chunks.append((fmt, data[offset:offset + length]))
+        offset += length
+    return chunks
+
+
+def _size_of(chunks):
+    return sum(len(payload) for _, payload in chunks)
+
+
+class AudioCache:
+    """Two-tier (memory LRU + disk) store of synthesised audio chunks."""
+
+    def __init__(self, memory_bytes, disk_bytes, directory):
+        self.memory_bytes = int(memory_bytes)
+        self.disk_bytes = int(disk_bytes)
+        self.directory = directory
+        self._memory = OrderedDict()
+        self._memory_used = 0
+        self._disk_used = None
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    # -- public API -------------------------------------------------------
+
+    def get(self, key):
+        """Return cached chunks for key, or None."""
+        with self._lock:
+            chunks = self._memory.get(key)
+            if chunks is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return chunks
+
+        chunks = self._read_disk(key)
+        with self._lock:
+            if chunks is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, chunks)
+        return chunks
+
+    def put(self, key, chunks):
+        """Store chunks in both tiers."""
+        chunks = [(fmt, bytes(payload)) for fmt, payload in chunks]
+        if not chunks:
+            return
+        with self._lock:
+            self._remember(key, chunks)
+            self.stores += 1
+        self._write_disk(key, chunks)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            hits = self.memory_hits + self.disk_hits
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_used,
+                "disk_bytes": self._disk_used or 0,
+            }
+
+    # -- memory tier ------------------------------------------------------
+
+    def _remember(self, key, chunks):
+        size = _size_of(chunks)
+        if size > self.memory_bytes:
+            return
+        if key in self._memory:
+            self._memory_used -= _size_of(self._memory.pop(key))
+        self._memory[key] = chunks
+        self._memory_used += size
+        while self._memory_used > self.memory_bytes and self._memory:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_used -= _size_of(evicted)
+            self.evictions += 1
+
+    # -- disk tier --------------------------------------------------------
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".bin")
+
+    def _read_disk(self, key):
+        if self.disk_bytes <= 0:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # Touch so eviction treats this entry as recently used
+            os.utime(path, None)
+            return _decode_chunks(data)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"  ⚠️  Audio cache read failed ({key[:8]}): {e}")
+            return None
+
+    def _write_disk(self, key, chunks):
+        if self.disk_bytes <= 0:
+            return
+        path = self._path(key)
+        data = _encode_chunks(chunks)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"  ⚠️  Audio cache write failed ({key[:8]}): {e}")
+            return
+        with self._lock:
+            if self._disk_used is None:
+                self._disk_used = self._scan_disk_usage()
+            else:
+                self._disk_used += len(data)
+            if self._disk_used > self.disk_bytes:
+                self._evict_disk()
+
+    def _disk_entries(self):
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".bin"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _scan_disk_usage(self):
+        return sum(size for _, size, _ in self._disk_entries())
+
+    def _evict_disk(self):
+        entries = sorted(self._disk_entries())
+        used = sum(size for _, size, _ in entries)
+        # Evict down to 90% of the budget so we don't rescan on every write
+        target = self.disk_bytes * 0.9
+        for _, size, path in entries:
+            if used <= target:
+                break
+            try:
+                os.remove(path)
+                used -= size
+                self.evictions += 1
+            except FileNotFoundError:
+                pass
+        self._disk_used = used
+
+
+_audio_cache = None
+
+
+def get_audio_cache():
+    """Process-wide cache instance, or None when caching is disabled."""
+    global _audio_cache
+    if not AUDIO_CACHE_ENABLED:
+        return None
+    if _audio_cache is None:
+        _audio_cache = AudioCache(
+            AUDIO_CACHE_MEMORY_MB * 1024 * 1024,
+            AUDIO_CACHE_DISK_MB * 1024 * 1024,
+            AUDIO_CACHE_DIR,
+        )
+    return _audio_cache
+
+
+def get_audio_cache_stats():
+    cache = get_audio_cache()
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **cache.stats()}
@@ -0,0 +1,229 @@
+"""
+Encoder stage between synthesis and the /narrate WebSocket.
+
+Synthesis yields raw audio: PCM16 chunks from the local engine, or a WAV/MP3
+file from the GPU worker. A per-utterance UtteranceEncoder turns that into
+the format the client negotiated, on a small thread pool so encoding never
+runs on the event loop:
+
+    "pcm16"  raw 24 kHz PCM16, passed through (files are passed through too)
+    "opus"   one WebM/Opus stream per utterance, emitted incrementally so the
+             browser can start playback through MediaSource straight away
+
+Opus needs PyAV (`av`). Without it the server only offers "pcm16".
+"""
+
+import asyncio
+import io
+import os
+import threading
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from audio_protocol import FORMAT_OPUS, FORMAT_PCM16, FORMAT_WAV, SAMPLE_RATE
+from tracing import record_stage
+
+AUDIO_ENCODE_WORKERS = int(os.getenv("AUDIO_ENCODE_WORKERS", "2"))
+OPUS_BITRATE = int(os.getenv("OPUS_BITRATE", "32000"))
+# Milliseconds of audio per WebM cluster; smaller clusters reach the client sooner
+OPUS_CLUSTER_MS = int(os.getenv("OPUS_CLUSTER_MS", "20"))
+
+DEFAULT_AUDIO_FORMAT = "pcm16"
+
+_OPUS_RATE = 48000
+
+_executor = ThreadPoolExecutor(max_workers=AUDIO_ENCODE_WORKERS, thread_name_prefix="audio-encode")
+# Per-thread conversion buffers, grown as needed and reused across chunks and utterances
+_scratch = threading.local()
+_opus_available = None
+
+
+def _scratch_buffers(size):
+    floats = getattr(_scratch, "floats", None)
+    if floats is None or floats.size < size:
+        capacity = max(size, SAMPLE_RATE)
+        _scratch.floats = floats = np.empty(capacity, dtype=np.float32)
+        _scratch.ints = np.empty(capacity, dtype="<i2")
+    return floats[:size], _scratch.ints[:size]
+
+
+def pcm16_bytes(chunk):
+    """Convert a float waveform chunk in [-1, 1] to little-endian PCM16 bytes."""
+    if hasattr(chunk, "detach"):
+        chunk = chunk.detach().cpu().numpy()
+    chunk = np.asarray(chunk).reshape(-1)
+    floats, ints = _scratch_buffers(chunk.size)
+    np.clip(chunk, -1.0, 1.0, out=floats)
+    np.multiply(floats, 32767, out=floats)
+    ints[:] = floats
+    return ints.tobytes()
+
+
+def pcm16_from_wav(data):
+    """PCM16 samples of a 24 kHz mono 16-bit WAV file, or None for anything else."""
+    try:
+        with wave.open(io.BytesIO(data)) as wav_file:
+            if (wav_file.getnchannels(), wav_file.getsampwidth(), wav_file.getframerate()) != (1, 2, SAMPLE_RATE):
+                return None
+            return wav_file.readframes(wav_file.getnframes())
+    except (wave.Error, EOFError):
+        return None
+
+
+def opus_available():
+    global _opus_available
+    if _opus_available is None:
+        try:
+            import av  # noqa: F401
+            _opus_available = True
+        except ImportError:
+            _opus_available = False
+    return _opus_available
+
+
+def available_formats():
+    return ["opus", "pcm16"] if opus_available() else ["pcm16"]
+
+
+def negotiate_format(accepted):
+    """First format in the client's preference list that we can produce."""
+    supported = available_formats()
+    for name in accepted or ():
+        if name in supported:
+            return name
+    return DEFAULT_AUDIO_FORMAT
+
+
+class _Sink(io.RawIOBase):
+    """Write-only target for the muxer; drained after every chunk."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def write(self, data):
+        self._buffer += data
+        return len(data)
+
+    def drain(self):
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+class _OpusWebmStream:
+    """Incremental PCM16 -> WebM/Opus encoder for one utterance."""
+
+    def __init__(self):
+        import av
+
+        self._sink = _Sink()
+        self._container = av.open(
+            self._sink,
+            mode="w",
+            format="webm",
+            options={"live": "1", "cluster_time_limit": str(OPUS_CLUSTER_MS), "flush_packets": "1"},
+            buffer_size=4096,
+        )
+        self._stream = self._container.add_stream("libopus", rate=_OPUS_RATE, layout="mono")
+        self._stream.bit_rate = OPUS_BITRATE
+        self._resampler = av.AudioResampler(format="s16", layout="mono", rate=_OPUS_RATE)
+        self._av = av
+        self._closed = False
+
+    def _mux(self, frames):
+        for frame in frames:
+            for packet in self._stream.encode(frame):
+                self._container.mux(packet)
+
+    def feed(self, pcm):
+        samples = np.frombuffer(pcm, dtype="<i2")
+        frame = self._av.AudioFrame.from_ndarray(samples.reshape(1, -1), format="s16", layout="mono")
+        frame.sample_rate = SAMPLE_RATE
+        self._mux(self._resampler.resample(frame))
+        return self._sink.drain()
+
+    def finish(self):
+        if self._closed:
+            return b""
+        self._closed = True
+        self._mux(self._resampler.resample(None))
+        for packet in self._stream.encode(None):
+            self._container.mux(packet)
+        self._container.close()
+        return self._sink.drain()
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            try:
+                self._container.close()
+            except Exception:
+                pass
+
+
+class UtteranceEncoder:
+    """Converts one utterance's synthesised (format, payload) pairs to the negotiated format."""
+
+    def __init__(self, audio_format=DEFAULT_AUDIO_FORMAT):
+        self.audio_format = audio_format if audio_format in available_formats() else DEFAULT_AUDIO_FORMAT
+        self._opus = None
+        self.encode_seconds = 0.0
+
+    def _timed(self, function, *args):
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            self.encode_seconds += time.perf_counter() - start
+
+    def _encode(self, fmt, payload):
+        pcm = payload if fmt == FORMAT_PCM16 else pcm16_from_wav(payload) if fmt == FORMAT_WAV else None
+        if pcm is None:
+            # MP3 or an unexpected WAV layout: the browser plays the file as-is
+            return [(fmt, payload)]
+        if self._opus is None:
+            self._opus = _OpusWebmStream()
+        data = self._opus.feed(pcm)
+        return [(FORMAT_OPUS, data)] if data else []
+
+    def _finish(self):
+        if self._opus is None:
+            return []
+        data = self._opus.finish()
+        return [(FORMAT_OPUS, data)] if data else []
+
+    async def encode(self, fmt, payload):
+        """Return the frames to send for one synthesised chunk."""
+        if self.audio_format == "pcm16":
+            return [(fmt, payload)]
+        return await asyncio.get_running_loop().run_in_executor(_executor, self._timed, self._encode, fmt, payload)
+
+    async def finish(self):
+        """Flush whatever the encoder still holds at the end of the utterance."""
+        if self._opus is None:
+            return []
+        return await asyncio.get_running_loop().run_in_executor(_executor, self._timed, self._finish)
+
+    def close(self):
+        # PCM16 passes through here: streamed chunks are converted inside the
+        # TTS worker (part of tts_inference), whole waveforms by to_pcm16
+        if self._opus is not None:
+            self._opus.close()
+            record_stage("encode", self.encode_seconds, format=self.audio_format)
+
+
+async def to_pcm16(wav):
+    """Convert a complete float waveform to PCM16 off the event loop."""
+    start = time.perf_counter()
+    data = await asyncio.get_running_loop().run_in_executor(_executor, pcm16_bytes, wav)
+    record_stage("encode", time.perf_counter() - start, format="pcm16")
+    return data
@@ -0,0 +1,62 @@
+"""
+Binary framing for audio sent over the /narrate WebSocket.
+
+Every binary message starts with an 8-byte little-endian header:
+
+    kind (u8) | format (u8) | utterance (u16) | sequence (u32)
+
+followed by the payload. The browser uses the format to decide whether a
+frame is a complete file it can hand to an <audio> element (mp3/wav), a
+chunk of raw 24 kHz mono PCM16 it should schedule through Web Audio, or the
+next piece of an utterance's WebM/Opus stream for MediaSource (opus).
+"""
+
+import struct
+
+HEADER = struct.Struct("<BBHI")
+HEADER_SIZE = HEADER.size
+
+# Frame kinds
+FRAME_AUDIO = 1
+FRAME_END = 2
+
+# Payload formats
+FORMAT_NONE = 0
+FORMAT_MP3 = 1
+FORMAT_WAV = 2
+FORMAT_PCM16 = 3
+FORMAT_OPUS = 4
+
+SAMPLE_RATE = 24000
+
+
+def pack_frame(kind, fmt, utterance, sequence, payload=b""):
+    """Prefix a payload with the frame header."""
+    return HEADER.pack(kind, fmt, utterance & 0xFFFF, sequence & 0xFFFFFFFF) + payload
+
+
+def unpack_frame(data):
+    """Split a framed message into (kind, fmt, utterance, sequence, payload)."""
+    kind, fmt, utterance, sequence = HEADER.unpack_from(data)
+    return kind, fmt, utterance, sequence, bytes(data[HEADER_SIZE:])
+
+
+def audio_frame(fmt, utterance, sequence, payload):
+    return pack_frame(FRAME_AUDIO, fmt, utterance, sequence, payload)
+
+
+def end_frame(utterance, sequence):
+    return pack_frame(FRAME_END, FORMAT_NONE, utterance, sequence)
+
+
+def retag_frame(data, utterance):
+    """Return a copy of a framed message assigned to a different utterance."""
+    kind, fmt, _, sequence, payload = unpack_frame(data)
+    return pack_frame(kind, fmt, utterance, sequence, payload)
+
+
+def sniff_format(audio_bytes):
+    """Best-effort guess of a complete audio file's container."""
+    if audio_bytes[:4] == b"RIFF":
+        return FORMAT_WAV
+    return FORMAT_MP3
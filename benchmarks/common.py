@@ -0,0 +1,58 @@
+"""Shared helpers for the benchmark scripts."""
+
+import os
+import resource
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def summarise(values):
+    """count/mean/p50/p95/p99/max of a list of seconds."""
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 6),
+        "p50": round(percentile(values, 0.50), 6),
+        "p95": round(percentile(values, 0.95), 6),
+        "p99": round(percentile(values, 0.99), 6),
+        "max": round(max(values), 6),
+    }
+
+
+def _format_seconds(value):
+    if value < 0.01:
+        return f"{value * 1e6:.0f}us"
+    if value < 1:
+        return f"{value * 1e3:.1f}ms"
+    return f"{value:.2f}s"
+
+
+def format_summary(name, summary):
+    if not summary.get("count"):
+        return f"{name:<22} n=0"
+    fields = " ".join(f"{key}={_format_seconds(summary[key])}" for key in ("mean", "p50", "p95", "p99", "max"))
+    return f"{name:<22} n={summary['count']:<5} {fields}"
+
+
+def rss_bytes(pid=None):
+    """Current resident set size of a process (Linux /proc), or None."""
+    try:
+        with open(f"/proc/{pid or os.getpid()}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+def peak_rss_bytes():
+    """Peak RSS of this process."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
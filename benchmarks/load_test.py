@@ -0,0 +1,280 @@
+"""
+Drive N concurrent /narrate WebSocket clients and report latency percentiles.
+
+Each client sends binary image uploads, the same as the browser does. It
+measures:
+- time to first text (first text_chunk)
+- time to first audio (first binary audio frame)
+- time to done (the utterance's end frame)
+
+Modes:
+- single: each client sends --frames images, one after the other, waiting
+  for each narration to finish.
+- continuous: each client sends a new image every --interval seconds for
+  --duration seconds, like continuous mode in the UI. Newer frames
+  supersede unfinished narrations.
+
+With --launch, the script starts the stub backends, runs `uvicorn main:app`
+against them on --port and samples the server's RSS. Nothing leaves the
+machine. The app runs with TTS_LOCAL=0, so it never downloads or loads the
+local XTTS model, and the RSS reflects the request path alone:
+
+    python benchmarks/load_test.py --launch --clients 8 --mode single --frames 5
+    python benchmarks/load_test.py --url ws://host:7860/narrate --clients 4 --mode continuous
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import struct
+import subprocess
+import sys
+import time
+
+import websockets
+from PIL import Image
+
+from common import format_summary, rss_bytes, summarise
+from stub_backends import add_stub_arguments, start_stubs, stub_kwargs
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FRAME_HEADER = struct.Struct("<BBHI")
+FRAME_AUDIO = 1
+FRAME_END = 2
+
+
+def make_image(width, height, seed):
+    """A random JPEG (noise defeats frame dedup, like a moving camera)."""
+    rng = random.Random(seed)
+    image = Image.new("RGB", (width // 8, height // 8))
+    image.putdata([(rng.randrange(256), rng.randrange(256), rng.randrange(256)) for _ in range(image.width * image.height)])
+    image = image.resize((width, height), Image.NEAREST)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=80)
+    return buffer.getvalue()
+
+
+class Request:
+    def __init__(self, index):
+        self.index = index
+        self.sent_at = time.perf_counter()
+        self.first_text = None
+        self.first_audio = None
+        self.done = None
+        self.audio_bytes = 0
+        self.outcome = None
+
+
+class Client:
+    def __init__(self, index, args, results):
+        self.index = index
+        self.args = args
+        self.results = results
+        self.current = None
+        self.finished = asyncio.Event()
+
+    async def _send_frame(self, websocket, count):
+        image = make_image(self.args.width, self.args.height, seed=self.index * 100003 + count)
+        if self.current is not None and self.current.outcome is None:
+            overdue = time.perf_counter() - self.current.sent_at > self.args.timeout
+            self.current.outcome = "timeout" if overdue else "superseded"
+        self.current = Request(count)
+        self.results.append(self.current)
+        self.finished.clear()
+        await websocket.send(json.dumps({
+            "type": "image_header",
+            "voiceId": self.args.voice,
+            "voiceName": self.args.voice,
+            "voiceLabel": self.args.voice,
+            "pictureCount": count,
+            "mode": self.args.mode,
+            "politenessLevel": self.args.politeness,
+            "mimeType": "image/jpeg",
+            "size": len(image),
+        }))
+        await websocket.send(image)
+
+    def _on_message(self, message):
+        request = self.current
+        now = time.perf_counter()
+        if isinstance(message, bytes):
+            if request is None or len(message) < FRAME_HEADER.size:
+                return
+            kind = FRAME_HEADER.unpack_from(message)[0]
+            if kind == FRAME_AUDIO:
+                if request.first_audio is None:
+                    request.first_audio = now - request.sent_at
+                request.audio_bytes += len(message) - FRAME_HEADER.size
+            elif kind == FRAME_END and request.outcome is None:
+                request.done = now - request.sent_at
+                request.outcome = "ok"
+                self.finished.set()
+            return
+        data = json.loads(message)
+        kind = data.get("type")
+        if request is None:
+            return
+        if kind == "text_chunk" and request.first_text is None:
+            request.first_text = now - request.sent_at
+        elif kind in ("error", "frame_skipped") and request.outcome is None:
+            request.outcome = "error" if kind == "error" else "skipped"
+            self.finished.set()
+
+    async def run(self, deadline):
+        async with websockets.connect(self.args.url, max_size=None) as websocket:
+            await websocket.send(json.dumps({"type": "audio_formats", "accept": [self.args.audio_format]}))
+            receiver = asyncio.create_task(self._receive(websocket))
+            try:
+                if self.args.mode == "single":
+                    for count in range(1, self.args.frames + 1):
+                        await self._send_frame(websocket, count)
+                        try:
+                            await asyncio.wait_for(self.finished.wait(), self.args.timeout)
+                        except asyncio.TimeoutError:
+                            self.current.outcome = "timeout"
+                else:
+                    count = 0
+                    while time.perf_counter() < deadline:
+                        count += 1
+                        await self._send_frame(websocket, count)
+                        await asyncio.sleep(self.args.interval * random.uniform(0.9, 1.1))
+                    try:
+                        await asyncio.wait_for(self.finished.wait(), self.args.timeout)
+                    except asyncio.TimeoutError:
+                        self.current.outcome = "timeout"
+            finally:
+                receiver.cancel()
+
+    async def _receive(self, websocket):
+        async for message in websocket:
+            self._on_message(message)
+
+
+async def _wait_until_ready(http_url, timeout):
+    import httpx
+
+    deadline = time.time() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.time() < deadline:
+            try:
+                response = await client.get(f"{http_url}/health")
+                if response.json().get("ready"):
+                    return True
+            except (httpx.HTTPError, ValueError):
+                pass
+            await asyncio.sleep(0.5)
+    return False
+
+
+async def _sample_rss(pid, samples, stop):
+    while not stop.is_set():
+        value = rss_bytes(pid)
+        if value:
+            samples.append(value)
+        await asyncio.sleep(0.5)
+
+
+async def main(args):
+    server = None
+    runners = []
+    rss_samples = []
+    stop_sampling = asyncio.Event()
+    sampler = None
+    try:
+        if args.launch:
+            runners = await start_stubs(**stub_kwargs(args))
+            env = dict(
+                os.environ,
+                ANTHROPIC_BASE_URL=f"http://127.0.0.1:{args.anthropic_port}",
+                ANTHROPIC_API_KEY="stub",
+                GPU_TTS_API_URL=f"http://127.0.0.1:{args.gpu_port}",
+                AUDIO_CACHE_ENABLED="0",
+                TTS_LOCAL="0",
+                FRAME_DEDUP_MODE="off",
+            )
+            server = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(args.port), "--log-level", "warning"],
+                cwd=REPO_ROOT,
+                env=env,
+            )
+            args.url = f"ws://127.0.0.1:{args.port}/narrate"
+            print(f"Waiting for the app on port {args.port}...")
+            if not await _wait_until_ready(f"http://127.0.0.1:{args.port}", args.startup_timeout):
+                print("App did not report ready; measuring anyway")
+            sampler = asyncio.create_task(_sample_rss(server.pid, rss_samples, stop_sampling))
+
+        results = []
+        clients = [Client(index, args, results) for index in range(args.clients)]
+        started = time.perf_counter()
+        deadline = started + args.duration
+        outcomes = await asyncio.gather(*(client.run(deadline) for client in clients), return_exceptions=True)
+        elapsed = time.perf_counter() - started
+        connection_errors = [outcome for outcome in outcomes if isinstance(outcome, Exception)]
+    finally:
+        stop_sampling.set()
+        if sampler is not None:
+            await sampler
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+        for runner in runners:
+            await runner.cleanup()
+
+    completed = [request for request in results if request.outcome == "ok"]
+    report = {
+        "mode": args.mode,
+        "clients": args.clients,
+        "elapsed": round(elapsed, 2),
+        "requests": len(results),
+        "completed": len(completed),
+        "superseded": sum(1 for request in results if request.outcome == "superseded"),
+        "errors": sum(1 for request in results if request.outcome in ("error", "timeout")),
+        "connection_errors": len(connection_errors),
+        "throughput": round(len(completed) / elapsed, 3) if elapsed else 0.0,
+        "audio_bytes": sum(request.audio_bytes for request in results),
+        "time_to_first_text": summarise([r.first_text for r in results if r.first_text is not None]),
+        "time_to_first_audio": summarise([r.first_audio for r in results if r.first_audio is not None]),
+        "time_to_done": summarise([r.done for r in completed]),
+        "server_rss_peak_mb": round(max(rss_samples) / 1024 ** 2, 1) if rss_samples else None,
+    }
+
+    print(f"\n{args.clients} client(s), {args.mode} mode, {elapsed:.1f}s")
+    print(f"requests={report['requests']} completed={report['completed']} superseded={report['superseded']} "
+          f"errors={report['errors']} connection_errors={report['connection_errors']}")
+    print(f"throughput={report['throughput']} narrations/s, audio={report['audio_bytes'] / 1024:.0f} KB")
+    for key in ("time_to_first_text", "time_to_first_audio", "time_to_done"):
+        print(format_summary(key, report[key]))
+    if report["server_rss_peak_mb"] is not None:
+        print(f"server RSS peak: {report['server_rss_peak_mb']} MB")
+    for error in connection_errors[:3]:
+        print(f"connection error: {error!r}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.json}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="ws://127.0.0.1:7860/narrate")
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--mode", choices=("single", "continuous"), default="single")
+    parser.add_argument("--frames", type=int, default=3, help="Images per client in single mode")
+    parser.add_argument("--interval", type=float, default=3.0, help="Seconds between images in continuous mode")
+    parser.add_argument("--duration", type=float, default=30.0, help="Length of a continuous run")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Give up on a narration after this long")
+    parser.add_argument("--voice", default="David Attenborough")
+    parser.add_argument("--politeness", type=int, default=5)
+    parser.add_argument("--audio-format", default="pcm16", choices=("pcm16", "opus"))
+    parser.add_argument("--width", type=int, default=768)
+    parser.add_argument("--height", type=int, default=432)
+    parser.add_argument("--json", help="Also write the report to this file")
+    parser.add_argument("--launch", action="store_true", help="Start the stubs and the app locally")
+    parser.add_argument("--port", type=int, default=7861, help="App port with --launch")
+    parser.add_argument("--startup-timeout", type=float, default=600.0)
+    add_stub_arguments(parser)
+    asyncio.run(main(parser.parse_args()))
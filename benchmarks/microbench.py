@@ -0,0 +1,243 @@
+"""
+Microbenchmarks for the audio path.
+
+    python benchmarks/microbench.py encode        # PCM16 conversion and Opus encoding
+    python benchmarks/microbench.py tts           # local XTTS inference (loads the model)
+    python benchmarks/microbench.py cpu --compile --save-wavs wavs/
+    python benchmarks/microbench.py all --json out.json
+
+Encoding numbers use synthetic audio, so they run anywhere. The TTS
+benchmark runs synthesise_job directly, without the engine queue, for
+streamed and full synthesis. It reports time to first chunk, total time
+and the real-time factor (synthesis time / audio duration).
+
+The cpu suite compares the CPU modes of xtts_optimize.py on one model. It
+synthesises the same texts with the same seeds in fp32, then after int8
+quantization, then (with --compile) with the compiled vocoder. Speed is
+reported as the real-time factor and the speed-up over fp32. Quality is
+reported as the mean log-spectrum distance from the fp32 output (dB) and
+the duration ratio. Sampling still diverges once the weights change, so
+these numbers track timbre drift. They do not measure sample-level
+error. Listen to the --save-wavs output before switching modes. The
+cpu suite is not part of "all", because it quantizes the model in place.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import wave
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import format_summary, peak_rss_bytes, summarise  # noqa: E402
+
+SAMPLE_RATE = 24000
+TEXTS = [
+    "Here we observe a remarkable specimen, perched on the sofa.",
+    "A cluttered desk, home to three coffee mugs and the faint hope of productivity.",
+    "Behold the kitchen in its natural state, the washing up advancing slowly like a glacier.",
+]
+
+
+def _speech_like(seconds, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    return (0.3 * np.sin(2 * np.pi * 180 * t) * (0.5 + 0.5 * np.sin(2 * np.pi * 3 * t)) + 0.02 * rng.standard_normal(t.size)).astype(np.float32)
+
+
+def bench_encode(runs):
+    from audio_encoder import UtteranceEncoder, available_formats, pcm16_bytes
+    from audio_protocol import FORMAT_PCM16
+
+    report = {}
+    chunk = _speech_like(0.5)
+    timings = []
+    for _ in range(runs * 20):
+        start = time.perf_counter()
+        pcm16_bytes(chunk)
+        timings.append(time.perf_counter() - start)
+    report["pcm16_chunk_500ms"] = summarise(timings)
+    print(format_summary("pcm16 (0.5s chunk)", report["pcm16_chunk_500ms"]))
+
+    if "opus" not in available_formats():
+        print("opus: PyAV not installed, skipped")
+        return report
+
+    utterance = [pcm16_bytes(_speech_like(0.5, seed)) for seed in range(16)]
+    audio_seconds = 0.5 * len(utterance)
+
+    async def encode_utterance():
+        encoder = UtteranceEncoder("opus")
+        size = 0
+        try:
+            for pcm in utterance:
+                size += sum(len(payload) for _, payload in await encoder.encode(FORMAT_PCM16, pcm))
+            size += sum(len(payload) for _, payload in await encoder.finish())
+        finally:
+            encoder.close()
+        return size
+
+    timings = []
+    size = 0
+    for _ in range(runs):
+        start = time.perf_counter()
+        size = asyncio.run(encode_utterance())
+        timings.append(time.perf_counter() - start)
+    report["opus_utterance_8s"] = summarise(timings)
+    report["opus_realtime_factor"] = round(report["opus_utterance_8s"]["mean"] / audio_seconds, 4)
+    report["opus_compression"] = round(sum(len(pcm) for pcm in utterance) / size, 1) if size else None
+    print(format_summary(f"opus ({audio_seconds:.0f}s utterance)", report["opus_utterance_8s"]))
+    print(f"{'':<22} RTF={report['opus_realtime_factor']} size={size / 1024:.1f} KB ({report['opus_compression']}x smaller than PCM16)")
+    return report
+
+
+def bench_tts(runs, voice_name):
+    from convert_text_to_speech import get_tts_model, preload_all_embeddings, warm_up_tts
+    from tts_engine import synthesise_job
+
+    start = time.perf_counter()
+    get_tts_model()
+    preload_all_embeddings()
+    warm_up_tts()
+    report = {"model_load_seconds": round(time.perf_counter() - start, 2)}
+    print(f"Model loaded and warmed up in {report['model_load_seconds']}s")
+
+    for kind in ("stream", "full"):
+        first_chunk, totals, factors = [], [], []
+        for run in range(runs):
+            text = TEXTS[run % len(TEXTS)]
+            state = {"first": None, "samples": 0}
+            start = time.perf_counter()
+
+            def emit(message, payload):
+                if state["first"] is None:
+                    state["first"] = time.perf_counter() - start
+                state["samples"] += len(payload) // 2 if message == "chunk" else len(payload)
+
+            synthesise_job(kind, text, voice_name, emit, lambda: False)
+            total = time.perf_counter() - start
+            totals.append(total)
+            if state["first"] is not None:
+                first_chunk.append(state["first"])
+            if state["samples"]:
+                factors.append(total / (state["samples"] / SAMPLE_RATE))
+        report[kind] = {
+            "first_chunk": summarise(first_chunk),
+            "total": summarise(totals),
+            "realtime_factor": round(sum(factors) / len(factors), 3) if factors else None,
+        }
+        print(format_summary(f"tts {kind} first chunk", report[kind]["first_chunk"]))
+        print(format_summary(f"tts {kind} total", report[kind]["total"]))
+        print(f"{'':<22} RTF={report[kind]['realtime_factor']}")
+    return report
+
+
+def _mean_log_spectrum(wav, frame=1024, hop=256):
+    if wav.size < frame:
+        wav = np.pad(wav, (0, frame - wav.size))
+    frames = np.lib.stride_tricks.sliding_window_view(wav, frame)[::hop] * np.hanning(frame)
+    return 20 * np.log10(np.abs(np.fft.rfft(frames, axis=1)).mean(axis=0) + 1e-8)
+
+
+def _save_wav(path, wav):
+    from audio_encoder import pcm16_bytes
+
+    with wave.open(path, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(SAMPLE_RATE)
+        wav_file.writeframes(pcm16_bytes(wav))
+
+
+def bench_cpu(runs, voice_name, compile_vocoder_too, save_dir):
+    # The reference run must be the stock model, whatever the environment says
+    os.environ["TTS_CPU_MODE"] = "fp32"
+    os.environ["TTS_CPU_COMPILE"] = "0"
+    import torch
+    from convert_text_to_speech import get_tts_model, load_voice_embedding, preload_all_embeddings, warm_up_tts
+    from xtts_optimize import compile_vocoder, quantize_gpt
+
+    if torch.cuda.is_available():
+        print("cpu: a GPU is visible and XTTS would load on it, skipped")
+        return {}
+    model = get_tts_model().synthesizer.tts_model
+    preload_all_embeddings()
+    warm_up_tts()
+    embedding = load_voice_embedding(voice_name)
+
+    def synthesise(text, seed):
+        torch.manual_seed(seed)
+        start = time.perf_counter()
+        with torch.inference_mode():
+            wav = model.inference(text, "en", embedding["gpt_cond_latent"], embedding["speaker_embedding"])["wav"]
+        wav = wav.detach().cpu().numpy() if hasattr(wav, "detach") else np.asarray(wav)
+        return time.perf_counter() - start, np.asarray(wav, dtype=np.float32).reshape(-1)
+
+    steps = [("fp32", None), ("int8", lambda: quantize_gpt(model))]
+    if compile_vocoder_too:
+        steps.append(("int8+compile", lambda: compile_vocoder(model)))
+
+    report = {}
+    reference = {}
+    for mode, apply in steps:
+        if apply is not None:
+            apply()
+            synthesise("Warm up.", 0)
+        timings, factors, distances, duration_ratios = [], [], [], []
+        for run in range(runs):
+            text = TEXTS[run % len(TEXTS)]
+            seconds, wav = synthesise(text, run)
+            timings.append(seconds)
+            factors.append(seconds / max(wav.size / SAMPLE_RATE, 1e-6))
+            if mode == "fp32":
+                reference[run] = wav
+            else:
+                distances.append(float(np.abs(_mean_log_spectrum(wav) - _mean_log_spectrum(reference[run])).mean()))
+                duration_ratios.append(wav.size / max(reference[run].size, 1))
+            if save_dir:
+                os.makedirs(save_dir, exist_ok=True)
+                _save_wav(os.path.join(save_dir, f"{mode}_{run}.wav"), wav)
+        report[mode] = {
+            "total": summarise(timings),
+            "realtime_factor": round(sum(factors) / len(factors), 3),
+        }
+        if mode != "fp32":
+            report[mode]["speedup"] = round(report["fp32"]["total"]["mean"] / report[mode]["total"]["mean"], 2)
+            report[mode]["spectral_distance_db"] = round(sum(distances) / len(distances), 2)
+            report[mode]["duration_ratio"] = round(sum(duration_ratios) / len(duration_ratios), 3)
+        print(format_summary(f"cpu {mode}", report[mode]["total"]))
+        extra = "" if mode == "fp32" else (f" speedup={report[mode]['speedup']}x "
+                                           f"spectral_distance={report[mode]['spectral_distance_db']}dB "
+                                           f"duration_ratio={report[mode]['duration_ratio']}")
+        print(f"{'':<22} RTF={report[mode]['realtime_factor']}{extra}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("suite", choices=("encode", "tts", "cpu", "all"), nargs="?", default="encode")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--voice", default="David Attenborough")
+    parser.add_argument("--compile", action="store_true", help="cpu suite: also time the torch.compile'd vocoder")
+    parser.add_argument("--save-wavs", help="cpu suite: write each mode's output here for listening")
+    parser.add_argument("--json", help="Also write the report to this file")
+    args = parser.parse_args()
+
+    report = {}
+    if args.suite in ("encode", "all"):
+        report["encode"] = bench_encode(args.runs)
+    if args.suite in ("tts", "all"):
+        report["tts"] = bench_tts(args.runs, args.voice)
+    if args.suite == "cpu":
+        report["cpu"] = bench_cpu(args.runs, args.voice, args.compile, args.save_wavs)
+    report["peak_rss_mb"] = round(peak_rss_bytes() / 1024 ** 2, 1)
+    print(f"peak RSS: {report['peak_rss_mb']} MB")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.json}")
@@ -0,0 +1,198 @@
+"""
+Local stand-ins for the Anthropic Messages API and the GPU TTS worker.
+
+The Anthropic stub streams a canned description over SSE with configurable
+time-to-first-token and per-token delay. The GPU stub implements the /v2
+routes the app uses (voice registration, pre-warm and POST /v2/tts). It returns a
+16-bit 24 kHz WAV whose length and latency scale with the text. Point the
+app at them with:
+
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8801 ANTHROPIC_API_KEY=stub
+    GPU_TTS_API_URL=http://127.0.0.1:8802
+
+    python benchmarks/stub_backends.py [--first-token-ms 400] [--token-ms 25]
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import math
+import random
+import struct
+import uuid
+import wave
+
+from aiohttp import web
+
+DESCRIPTIONS = [
+    "Here we observe a remarkable specimen, perched on the sofa, contemplating the mysteries of the remote control.",
+    "A cluttered desk, home to three coffee mugs and the faint hope of productivity. Magnificent.",
+    "Behold the kitchen in its natural state, the washing up advancing slowly like a glacier.",
+    "A lone houseplant clings to life by the window. Its resilience is, frankly, inspiring.",
+]
+
+SAMPLE_RATE = 24000
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8")
+
+
+def _tokens(text):
+    # Roughly word-sized pieces, like the real stream
+    words = text.split(" ")
+    return [word if index == 0 else " " + word for index, word in enumerate(words)]
+
+
+def make_anthropic_app(first_token_ms, token_ms):
+    async def messages(request):
+        body = await request.json()
+        text = random.choice(DESCRIPTIONS)
+        if not body.get("stream"):
+            return web.json_response({
+                "id": f"msg_{uuid.uuid4().hex[:24]}",
+                "type": "message",
+                "role": "assistant",
+                "model": body.get("model"),
+                "content": [{"type": "text", "text": text}],
+                "stop_reason": "end_turn",
+                "stop_sequence": None,
+                "usage": {"input_tokens": 1200, "output_tokens": len(text.split())},
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        await response.write(_sse("message_start", {
+            "type": "message_start",
+            "message": {
+                "id": f"msg_{uuid.uuid4().hex[:24]}",
+                "type": "message",
+                "role": "assistant",
+                "model": body.get("model"),
+                "content": [],
+                "stop_reason": None,
+                "stop_sequence": None,
+                "usage": {"input_tokens": 1200, "output_tokens": 1},
+            },
+        }))
+        await response.write(_sse("content_block_start", {
+            "type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""},
+        }))
+        await asyncio.sleep(first_token_ms / 1000)
+        for index, token in enumerate(_tokens(text)):
+            if index:
+                await asyncio.sleep(token_ms / 1000)
+            await response.write(_sse("content_block_delta", {
+                "type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": token},
+            }))
+        await response.write(_sse("content_block_stop", {"type": "content_block_stop", "index": 0}))
+        await response.write(_sse("message_delta", {
+            "type": "message_delta",
+            "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+            "usage": {"output_tokens": len(text.split())},
+        }))
+        await response.write(_sse("message_stop", {"type": "message_stop"}))
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_post("/v1/messages", messages)
+    return app
+
+
+def _tone_wav(seconds):
+    frames = int(seconds * SAMPLE_RATE)
+    samples = (int(8000 * math.sin(2 * math.pi * 220 * i / SAMPLE_RATE)) for i in range(frames))
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(SAMPLE_RATE)
+        wav_file.writeframes(struct.pack(f"<{frames}h", *samples))
+    return buffer.getvalue()
+
+
+def make_gpu_app(base_ms, ms_per_char, concurrency):
+    voices = set()
+    slots = asyncio.Semaphore(concurrency)
+    wav_cache = {}
+
+    async def put_voice(request):
+        voices.add(request.match_info["voice_id"])
+        await request.read()
+        return web.json_response({"voice_id": request.match_info["voice_id"]})
+
+    async def list_voices(request):
+        return web.json_response({"voices": sorted(voices)})
+
+    async def warm(request):
+        return web.json_response({"warm": True, "voices": len(voices)})
+
+    async def tts(request):
+        body = await request.json()
+        if body.get("voice_id") not in voices:
+            return web.json_response({"error": "unknown_voice"}, status=404)
+        text = body.get("text", "")
+        async with slots:
+            await asyncio.sleep((base_ms + ms_per_char * len(text)) / 1000)
+        # Roughly 15 characters of speech per second
+        seconds = round(max(0.5, len(text) / 15), 1)
+        if seconds not in wav_cache:
+            wav_cache[seconds] = _tone_wav(seconds)
+        return web.Response(body=wav_cache[seconds], content_type="audio/wav")
+
+    app = web.Application(client_max_size=16 * 1024 * 1024)
+    app.router.add_put("/v2/voices/{voice_id}", put_voice)
+    app.router.add_get("/v2/voices", list_voices)
+    app.router.add_post("/v2/warm", warm)
+    app.router.add_post("/v2/tts", tts)
+    return app
+
+
+async def start_stubs(host="127.0.0.1", anthropic_port=8801, gpu_port=8802, first_token_ms=400, token_ms=25,
+                      gpu_base_ms=300, gpu_ms_per_char=8, gpu_concurrency=4):
+    """Start both stubs on the running loop; returns the runners to clean up."""
+    runners = []
+    for app, port in (
+        (make_anthropic_app(first_token_ms, token_ms), anthropic_port),
+        (make_gpu_app(gpu_base_ms, gpu_ms_per_char, gpu_concurrency), gpu_port),
+    ):
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        runners.append(runner)
+    return runners
+
+
+def add_stub_arguments(parser):
+    parser.add_argument("--anthropic-port", type=int, default=8801)
+    parser.add_argument("--gpu-port", type=int, default=8802)
+    parser.add_argument("--first-token-ms", type=float, default=400, help="Anthropic time to first token")
+    parser.add_argument("--token-ms", type=float, default=25, help="Anthropic delay between tokens")
+    parser.add_argument("--gpu-base-ms", type=float, default=300, help="GPU fixed latency per request")
+    parser.add_argument("--gpu-ms-per-char", type=float, default=8, help="GPU latency per character")
+    parser.add_argument("--gpu-concurrency", type=int, default=4, help="Requests the GPU stub serves at once")
+
+
+def stub_kwargs(args):
+    return dict(
+        anthropic_port=args.anthropic_port, gpu_port=args.gpu_port, first_token_ms=args.first_token_ms,
+        token_ms=args.token_ms, gpu_base_ms=args.gpu_base_ms, gpu_ms_per_char=args.gpu_ms_per_char,
+        gpu_concurrency=args.gpu_concurrency,
+    )
+
+
+async def _serve_forever(args):
+    await start_stubs(**stub_kwargs(args))
+    print(f"Anthropic stub on http://127.0.0.1:{args.anthropic_port}, GPU stub on http://127.0.0.1:{args.gpu_port}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_stub_arguments(parser)
+    try:
+        asyncio.run(_serve_forever(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
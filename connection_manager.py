@@ -0,0 +1,413 @@
+"""
+Connection management for /narrate: queued I/O, rate limits and rooms.
+
+Each connection gets a receiver task and a sender task, so no socket waits
+on the narration pipeline and the pipeline never waits on a socket:
+
+- Outbound: messages go into a per-connection queue that its sender task
+  drains. Consecutive status messages collapse into the latest one. A client
+  that falls more than WS_SEND_QUEUE_MAX messages behind is disconnected
+  (close code 1013) instead of stalling everyone else.
+- Inbound: the receiver pairs each "image_header" with the image bytes that
+  follow it and queues the result, up to WS_INBOUND_QUEUE_MAX messages. An
+  image still waiting when a newer one arrives is replaced by it
+  (NARRATE_SUPERSEDE) or, if the queue is full, dropped. A token bucket
+  limits image uploads to NARRATE_RATE_LIMIT per second with bursts of
+  NARRATE_RATE_BURST.
+- Rooms: a "create_room" message makes the sender the owner of a room with
+  a random, server-issued token. Observers who have the token (the ?room=
+  query parameter or a "join_room" message) hear the owner's narrations.
+  Each frame is narrated, encoded and serialised once, and the same bytes
+  are queued to every member. Audio uses the best format every member
+  accepts. Observers' own photos are narrated to them alone, and the room
+  closes when its owner leaves.
+
+One 1 Hz ticker sends the "Generating voice..." progress of every active
+narration, replacing a timer task per request.
+"""
+
+import asyncio
+import itertools
+import json
+import os
+import secrets
+import time
+from collections import deque
+
+from fastapi import WebSocketDisconnect
+
+from audio_encoder import DEFAULT_AUDIO_FORMAT, negotiate_format
+from image_processing import UPLOAD_MAX_BYTES
+
+WS_SEND_QUEUE_MAX = int(os.getenv("WS_SEND_QUEUE_MAX", "512"))
+WS_INBOUND_QUEUE_MAX = int(os.getenv("WS_INBOUND_QUEUE_MAX", "8"))
+NARRATE_RATE_LIMIT = float(os.getenv("NARRATE_RATE_LIMIT", "2"))
+NARRATE_RATE_BURST = int(os.getenv("NARRATE_RATE_BURST", "4"))
+# Cancel an in-flight narration when the same client sends a newer frame
+NARRATE_SUPERSEDE = os.getenv("NARRATE_SUPERSEDE", "1") == "1"
+ROOM_TOKEN_BYTES = 16
+
+_connection_ids = itertools.count(1)
+# Utterance IDs key audio playback in the browser, so they must be unique per
+# audio stream. A process-wide counter also keeps them unique for a client
+# that moves between its own stream and a room.
+_utterance_ids = itertools.count(1)
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def take(self):
+        if self.rate <= 0:
+            return True
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class ClientConnection:
+    """One /narrate socket with queued, non-blocking sends."""
+
+    def __init__(self, websocket, manager):
+        self.websocket = websocket
+        self.manager = manager
+        self.id = next(_connection_ids)
+        self.room = None
+        # Set by the client's "audio_formats" message; old clients get PCM16
+        self.accepted_formats = None
+        self.audio_format = DEFAULT_AUDIO_FORMAT
+        self.closed = False
+        self.rate_limiter = TokenBucket(NARRATE_RATE_LIMIT, NARRATE_RATE_BURST)
+        self._outbound = deque()
+        self._outbound_ready = asyncio.Event()
+        # The last queued item, if it is a status that a newer one may overwrite
+        self._tail_status = None
+        self._inbound = deque()
+        self._inbound_ready = asyncio.Event()
+        self._pending_header = None
+        self._tasks = []
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._send_loop()), asyncio.create_task(self._receive_loop())]
+
+    async def stop(self):
+        self.closed = True
+        self._outbound_ready.set()
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+    # Outbound
+
+    def _enqueue(self, item):
+        if self.closed:
+            return
+        if len(self._outbound) >= WS_SEND_QUEUE_MAX:
+            self.manager.slow_disconnects += 1
+            print(f"🐢 Client {self.id} fell {len(self._outbound)} messages behind, disconnecting", flush=True)
+            self._outbound.clear()
+            self.closed = True
+            self._outbound_ready.set()
+            asyncio.create_task(self._close(1013))
+            return
+        self._outbound.append(item)
+        self._outbound_ready.set()
+
+    def queue_text(self, text, status=False):
+        if status and self._tail_status is not None:
+            self._tail_status[1] = text
+            self.manager.coalesced += 1
+            return
+        item = ["text", text]
+        self._enqueue(item)
+        self._tail_status = item if status else None
+
+    def queue_bytes(self, data):
+        self._enqueue(["bytes", data])
+        self._tail_status = None
+
+    async def send_json(self, message):
+        self.queue_text(json.dumps(message), status=message.get("type") == "status")
+
+    async def send_bytes(self, data):
+        self.queue_bytes(data)
+
+    def next_utterance(self):
+        return next(_utterance_ids)
+
+    async def _send_loop(self):
+        try:
+            while not self.closed:
+                if not self._outbound:
+                    self._outbound_ready.clear()
+                    await self._outbound_ready.wait()
+                    continue
+                item = self._outbound.popleft()
+                if item is self._tail_status:
+                    self._tail_status = None
+                kind, payload = item
+                if kind == "bytes":
+                    await self.websocket.send_bytes(payload)
+                else:
+                    await self.websocket.send_text(payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Socket gone; the receive loop reports the disconnect
+            self.closed = True
+
+    async def _close(self, code):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+    # Inbound
+
+    def _push_inbound(self, kind, data):
+        if kind == "image":
+            pending = [item for item in self._inbound if item[0] == "image"]
+            if pending and NARRATE_SUPERSEDE:
+                # Latest frame wins; the waiting one would only be cancelled
+                self._inbound.remove(pending[0])
+                self.manager.superseded_uploads += 1
+            elif len(self._inbound) >= WS_INBOUND_QUEUE_MAX and pending:
+                self._inbound.remove(pending[0])
+                self.manager.dropped_uploads += 1
+        if len(self._inbound) >= WS_INBOUND_QUEUE_MAX and kind not in ("close", "disconnect"):
+            self.manager.dropped_uploads += 1
+            return
+        self._inbound.append((kind, data))
+        self._inbound_ready.set()
+
+    async def next_message(self):
+        """Next (kind, data): ("image", header), ("control", json), ("close", None) or ("disconnect", None)."""
+        while not self._inbound:
+            self._inbound_ready.clear()
+            await self._inbound_ready.wait()
+        return self._inbound.popleft()
+
+    async def _receive_loop(self):
+        try:
+            while True:
+                message = await self.websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    raise WebSocketDisconnect(message.get("code", 1000))
+                if message.get("bytes") is not None:
+                    self._receive_image(message["bytes"])
+                    continue
+                data = message.get("text")
+                if data == "close":
+                    self._push_inbound("close", None)
+                    return
+                try:
+                    data_json = json.loads(data)
+                except (TypeError, ValueError):
+                    await self.send_json({"type": "error", "data": "Error processing message"})
+                    continue
+                if data_json.get("type") == "image_header":
+                    data_json["headerReceivedAt"] = time.perf_counter()
+                    self._pending_header = data_json
+                elif data_json.get("type") in ("audio_formats", "create_room", "join_room", "leave_room"):
+                    self._push_inbound("control", data_json)
+                else:
+                    # Legacy clients send the image base64-encoded inside the JSON
+                    self._accept_image(data_json)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if not isinstance(e, WebSocketDisconnect):
+                print(f"Error during WebSocket communication: {e}")
+            self._push_inbound("disconnect", None)
+
+    def _receive_image(self, image_bytes):
+        data_json, self._pending_header = self._pending_header, None
+        if data_json is None:
+            self.queue_text(json.dumps({"type": "error", "data": "Image bytes received without a header."}))
+            return
+        if len(image_bytes) > UPLOAD_MAX_BYTES:
+            self.queue_text(json.dumps({"type": "error", "data": "Image too large."}))
+            return
+        data_json["imageBytes"] = image_bytes
+        data_json["receiveSeconds"] = time.perf_counter() - data_json.pop("headerReceivedAt")
+        self._accept_image(data_json)
+
+    def _accept_image(self, data_json):
+        if not self.rate_limiter.take():
+            self.manager.rate_limited += 1
+            self.queue_text(json.dumps({
+                "type": "status",
+                "message": "Slow down.",
+                "detail": f"At most {NARRATE_RATE_LIMIT:g} images per second; this one was skipped."
+            }), status=True)
+            return
+        self._push_inbound("image", data_json)
+
+
+class Room:
+    """An owner's narrations and the observers hearing them; everything sent is serialised once."""
+
+    def __init__(self, token, owner):
+        self.token = token
+        self.owner = owner
+        self.members = {owner}
+        # Observers that joined mid-utterance wait for the next one: an Opus
+        # stream cannot be decoded without the init segment they missed
+        self._waiting = set()
+
+    def add(self, connection):
+        self.members.add(connection)
+        self._waiting.add(connection)
+
+    def remove(self, connection):
+        self.members.discard(connection)
+        self._waiting.discard(connection)
+
+    @property
+    def audio_format(self):
+        # Every listener must be able to play the stream
+        accepted = None
+        for member in self.members:
+            formats = set(member.accepted_formats or [DEFAULT_AUDIO_FORMAT])
+            accepted = formats if accepted is None else accepted & formats
+        return negotiate_format(sorted(accepted)) if accepted else DEFAULT_AUDIO_FORMAT
+
+    async def send_json(self, message):
+        text = json.dumps(message)
+        status = message.get("type") == "status"
+        for member in list(self.members):
+            member.queue_text(text, status=status)
+
+    async def send_bytes(self, data):
+        for member in list(self.members):
+            if member not in self._waiting:
+                member.queue_bytes(data)
+
+    def next_utterance(self):
+        self._waiting.clear()
+        return next(_utterance_ids)
+
+
+class ConnectionManager:
+    def __init__(self):
+        self.connections = set()
+        self.rooms = {}
+        self.slow_disconnects = 0
+        self.coalesced = 0
+        self.rate_limited = 0
+        self.dropped_uploads = 0
+        self.superseded_uploads = 0
+        self._progress = {}
+        self._progress_ids = itertools.count()
+        self._ticker = None
+
+    def connect(self, websocket):
+        connection = ClientConnection(websocket, self)
+        self.connections.add(connection)
+        connection.start()
+        return connection
+
+    async def disconnect(self, connection):
+        await self.leave_room(connection)
+        self.connections.discard(connection)
+        await connection.stop()
+
+    async def create_room(self, connection):
+        """Make connection the owner of a new room; the token goes to it alone."""
+        await self.leave_room(connection)
+        token = secrets.token_urlsafe(ROOM_TOKEN_BYTES)
+        room = Room(token, connection)
+        self.rooms[token] = room
+        connection.room = room
+        await connection.send_json({"type": "room", "room": token, "owner": True})
+        return room
+
+    async def join_room(self, connection, token):
+        room = self.rooms.get(str(token or ""))
+        if room is None:
+            await connection.send_json({"type": "error", "data": "That room does not exist or has closed."})
+            return
+        if connection.room is room:
+            return
+        await self.leave_room(connection)
+        room.add(connection)
+        connection.room = room
+        await connection.send_json({"type": "room", "room": room.token, "owner": False})
+        await room.send_json({
+            "type": "status",
+            "message": "Shared narration",
+            "detail": f"{len(room.members)} listener(s) hear the same narration."
+        })
+
+    async def leave_room(self, connection):
+        room, connection.room = connection.room, None
+        if room is None:
+            return
+        room.remove(connection)
+        if connection is not room.owner:
+            return
+        # Observers only ever hear the owner, so the room ends with them
+        self.rooms.pop(room.token, None)
+        for member in list(room.members):
+            room.remove(member)
+            member.room = None
+            await member.send_json({"type": "room", "room": None, "owner": False})
+            await member.send_json({
+                "type": "status",
+                "message": "Shared narration ended.",
+                "detail": "The owner of the room has left."
+            })
+
+    def output_for(self, connection):
+        """Where a narration started by this connection is sent."""
+        room = connection.room
+        return room if room is not None and room.owner is connection else connection
+
+    def track_progress(self, output, message):
+        """Send message() to output every second until untrack_progress(handle)."""
+        handle = next(self._progress_ids)
+        self._progress[handle] = (output, message)
+        if self._ticker is None or self._ticker.done():
+            self._ticker = asyncio.create_task(self._tick())
+        return handle
+
+    def untrack_progress(self, handle):
+        self._progress.pop(handle, None)
+
+    async def _tick(self):
+        while self._progress:
+            for output, message in list(self._progress.values()):
+                try:
+                    await output.send_json(message())
+                except Exception:
+                    pass
+            await asyncio.sleep(1)
+
+    def stats(self):
+        return {
+            "connections": len(self.connections),
+            "rooms": len(self.rooms),
+            "room_members": sum(len(room.members) for room in self.rooms.values()),
+            "active_narrations": len(self._progress),
+            "queued_messages": sum(len(connection._outbound) for connection in self.connections),
+            "coalesced_statuses": self.coalesced,
+            "slow_disconnects": self.slow_disconnects,
+            "rate_limited": self.rate_limited,
+            "dropped_uploads": self.dropped_uploads,
+            "superseded_uploads": self.superseded_uploads,
+        }
+
+
+connection_manager = ConnectionManager()
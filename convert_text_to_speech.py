@@ -6,9 +6,21 @@ os.environ["COQUI_TOS_AGREED"] = "1"
 import io
 import torch
 import torchaudio
-from TTS.api import TTS
 import asyncio
 import base64
+import re
+import time
+import hashlib
+
+from audio_cache import get_audio_cache, make_cache_key
+from gpu_client import get_gpu_api_url, synthesise_remote
+from embedding_wire import embedding_fingerprint
+from embedding_pack import PACK_FILENAME, find_pth_voices, pack_voice_names, read_pack
+from tts_engine import PRIORITY_INTERACTIVE, TTSJobError, TTSRejectedError, get_tts_engine
+from audio_protocol import FORMAT_PCM16, audio_frame, end_frame, sniff_format
+from audio_encoder import DEFAULT_AUDIO_FORMAT, UtteranceEncoder, to_pcm16
+from tracing import record_stage
+from tts_router import get_tts_router
 
 # External GPU TTS provider (Modal Labs or similar)
 # Set MODAL_API_URL to your deployed Modal endpoint
@@ -25,6 +37,23 @@ VOICE_FOLDERS = {
     "Morgan Freeman": "Voice_Files/Morgan Freeman",
     "Stephen Fry": "Voice_Files/Stephen Fry",
 }
+# Spoken for voice names with neither an embedding nor reference clips
+DEFAULT_VOICE = "David Attenborough"
+
+# TTS_LOCAL=0 never loads the local XTTS model: every request goes to the GPU service
+TTS_LOCAL = os.getenv("TTS_LOCAL", "1") == "1"
+# Stream local CPU synthesis sentence by sentence via XTTS inference_stream
+TTS_STREAMING = os.getenv("XTTS_STREAMING", "1") == "1"
+# Number of GPT tokens decoded per streamed chunk (smaller = earlier first audio)
+TTS_STREAM_CHUNK_SIZE = int(os.getenv("XTTS_STREAM_CHUNK_SIZE", "20"))
+
+EMBEDDINGS_DIR = "voice_embeddings"
+# Reference clips of voices uploaded through POST /voices
+CUSTOM_VOICES_DIR = os.getenv("CUSTOM_VOICES_DIR", "Voice_Files/custom")
+# Same settings setup_embeddings_on_hf.py builds the stock voices with
+LATENT_SETTINGS = {"gpt_cond_len": 30, "gpt_cond_chunk_len": 4, "max_ref_length": 60}
+
+_SENTENCE_END = re.compile(r'(?<=[.!?…])\s+')
 
 VOICE_DISPLAY_NAMES = [
     "David Attenborough",
@@ -38,23 +67,67 @@ VOICE_DISPLAY_NAMES = [
 ]
 
 _tts_model = None
+# Per-voice GPT key/value cache of the loaded model (xtts_prefix_cache.py)
+_prefix_cache = None
 _embeddings_cache = {}
+_voice_fingerprints = {}
 _embeddings_preloaded = False
+# voice name -> "ready" / "partial" / "missing", built from one directory scan
+_voice_status_index = None
 _tts_ready = False
 
 def get_tts_model():
-    global _tts_model
+    global _tts_model, _prefix_cache
     if _tts_model is None:
+        # Imported lazily: the TTS package alone takes seconds to import
+        from TTS.api import TTS
         print("Loading XTTS model...")
         device = "cuda" if torch.cuda.is_available() else "cpu"
         if device == "cpu":
-            # Optimise for 2 vCPU on HF free tier
-            torch.set_num_threads(2)
+            # Defaults to 2 threads for the 2 vCPU HF free tier; worker processes pin their own
+            torch.set_num_threads(int(os.getenv("TTS_TORCH_THREADS", "2")))
             torch.set_num_interop_threads(1)
         _tts_model = TTS("tts_models/multilingual/multi-dataset/xtts_v2").to(device)
+        if device == "cpu":
+            from xtts_optimize import optimize_xtts_for_cpu
+            device = f"cpu ({optimize_xtts_for_cpu(_tts_model.synthesizer.tts_model)})"
+        from xtts_prefix_cache import TTS_PREFIX_CACHE, install_prefix_cache
+        if TTS_PREFIX_CACHE:
+            _prefix_cache = install_prefix_cache(_tts_model.synthesizer.tts_model)
         print(f"Model loaded on {device}")
     return _tts_model
 
+def ensure_voice_prefix(voice_name, embedding):
+    """Make sure the voice's GPT conditioning prefix is in the KV cache.
+
+    Only built-in and uploaded voices get an entry, so one-off names cannot
+    evict the voices in regular use.
+    """
+    if _prefix_cache is None:
+        return
+    if voice_name not in VOICE_FOLDERS and get_voice_folder(voice_name) is None:
+        return
+    try:
+        if _prefix_cache.ensure(voice_name, embedding['gpt_cond_latent']):
+            print(f"  Cached GPT prefix for {voice_name}")
+    except Exception as e:
+        print(f"  ⚠ Could not cache GPT prefix for {voice_name}: {e}")
+
+def build_voice_prefixes():
+    """Precompute the GPT prefix of every loaded voice, up to the cache budget."""
+    if _prefix_cache is None:
+        return
+    for voice_name, embedding in list(_embeddings_cache.items()):
+        ensure_voice_prefix(voice_name, embedding)
+        if _prefix_cache.stats()["evictions"]:
+            break
+    stats = _prefix_cache.stats()
+    print(f"GPT prefix cache: {stats['voices']} voices, {stats['bytes'] / 1024 ** 2:.1f} MB")
+
+def get_prefix_cache_stats():
+    """This process's cache; TTSEngine.prefix_cache_stats() covers worker processes."""
+    return _prefix_cache.stats() if _prefix_cache is not None else {"enabled": False}
+
 def warm_up_tts():
     """Run a tiny inference to warm up the model."""
     global _tts_ready
@@ -64,21 +137,53 @@ def warm_up_tts():
             print("Warm-up skipped: no embeddings loaded yet")
             _tts_ready = False
             return
+        build_voice_prefixes()
         voice_name = next(iter(_embeddings_cache.keys()))
         embedding = _embeddings_cache[voice_name]
-        _ = tts.synthesizer.tts_model.inference(
-            text="Hi.",
-            language="en",
-            gpt_cond_latent=embedding['gpt_cond_latent'],
-            speaker_embedding=embedding['speaker_embedding']
-        )
+        with torch.inference_mode():
+            _ = tts.synthesizer.tts_model.inference(
+                text="Hi.",
+                language="en",
+                gpt_cond_latent=embedding['gpt_cond_latent'],
+                speaker_embedding=embedding['speaker_embedding']
+            )
         _tts_ready = True
     except Exception as e:
         print(f"Warm-up failed: {e}")
         _tts_ready = False
 
 def is_tts_ready():
-    return _tts_ready
+    if not TTS_LOCAL:
+        return _embeddings_preloaded and get_gpu_api_url() is not None
+    return _tts_ready or get_tts_engine().ready
+
+def _load_pth_embedding(gpt_path, speaker_path):
+    return {
+        'gpt_cond_latent': torch.load(gpt_path, map_location='cpu'),
+        'speaker_embedding': torch.load(speaker_path, map_location='cpu')
+    }
+
+def _build_voice_status_index():
+    """Scan the embedding and voice-file folders once; statuses are served from memory."""
+    global _voice_status_index
+    embedded = set(_embeddings_cache)
+    pack_path = os.path.join(EMBEDDINGS_DIR, PACK_FILENAME)
+    if os.path.exists(pack_path):
+        try:
+            embedded.update(pack_voice_names(pack_path))
+        except Exception as e:
+            print(f"Unreadable embedding pack: {e}")
+    embedded.update(find_pth_voices(EMBEDDINGS_DIR))
+    index = {}
+    for voice_name in set(VOICE_DISPLAY_NAMES) | embedded:
+        if voice_name in embedded:
+            index[voice_name] = "ready"
+        elif voice_name in VOICE_FOLDERS and os.path.exists(VOICE_FOLDERS[voice_name]):
+            index[voice_name] = "partial"
+        else:
+            index[voice_name] = "missing"
+    _voice_status_index = index
+    return index
 
 def preload_all_embeddings():
     """Preload all voice embeddings at startup for faster access"""
@@ -88,106 +193,160 @@ def preload_all_embeddings():
         return
     
     print("Preloading all voice embeddings...")
-    embeddings_dir = "voice_embeddings"
     
-    if not os.path.exists(embeddings_dir):
+    if not os.path.exists(EMBEDDINGS_DIR):
         print("No embeddings directory found")
+        _build_voice_status_index()
         return
     
-    # Find all voice embeddings
-    gpt_files = [f for f in os.listdir(embeddings_dir) if f.endswith("_gpt.pth")]
+    pack_path = os.path.join(EMBEDDINGS_DIR, PACK_FILENAME)
+    pack_mtime = 0.0
+    if os.path.exists(pack_path):
+        try:
+            _embeddings_cache.update(read_pack(pack_path))
+            pack_mtime = os.path.getmtime(pack_path)
+            print(f"  Mapped {len(_embeddings_cache)} voices from {pack_path}")
+        except Exception as e:
+            print(f"  Failed to map {pack_path}: {e}")
     
-    for gpt_file in gpt_files:
-        voice_name = gpt_file.replace("_gpt.pth", "").replace("_", " ")
-        safe_name = voice_name.replace(" ", "_")
-        
-        gpt_path = f"{embeddings_dir}/{safe_name}_gpt.pth"
-        speaker_path = f"{embeddings_dir}/{safe_name}_speaker.pth"
-        
-        if os.path.exists(speaker_path):
-            try:
-                embedding = {
-                    'gpt_cond_latent': torch.load(gpt_path, map_location='cpu'),
-                    'speaker_embedding': torch.load(speaker_path, map_location='cpu')
-                }
-                _embeddings_cache[voice_name] = embedding
-                print(f"  Preloaded: {voice_name}")
-            except Exception as e:
-                print(f"  Failed: {voice_name} - {e}")
+    # Voices missing from the pack, or re-cloned since it was built, load from their .pth pair
+    stale = 0
+    for voice_name, (gpt_path, speaker_path) in find_pth_voices(EMBEDDINGS_DIR).items():
+        if voice_name in _embeddings_cache and max(os.path.getmtime(gpt_path), os.path.getmtime(speaker_path)) <= pack_mtime:
+            continue
+        try:
+            _embeddings_cache[voice_name] = _load_pth_embedding(gpt_path, speaker_path)
+            stale += 1
+            print(f"  Preloaded: {voice_name}")
+        except Exception as e:
+            print(f"  Failed: {voice_name} - {e}")
+    if stale and pack_mtime:
+        print(f"  {stale} voice(s) newer than {pack_path}; run `python embedding_pack.py` to rebuild it")
     
     _embeddings_preloaded = True
+    _build_voice_status_index()
     print(f"Preloaded {len(_embeddings_cache)} voice embeddings")
 
+def _embedding_paths(voice_name):
+    safe_name = voice_name.replace(" ", "_")
+    return f"{EMBEDDINGS_DIR}/{safe_name}_gpt.pth", f"{EMBEDDINGS_DIR}/{safe_name}_speaker.pth"
+
+def _store_embedding(voice_name, embedding):
+    _embeddings_cache[voice_name] = embedding
+    _voice_fingerprints.pop(voice_name, None)
+    if _voice_status_index is not None:
+        _voice_status_index[voice_name] = "ready"
+
 def load_voice_embedding(voice_name):
     """Load voice embedding (from cache if preloaded)"""
-    global _embeddings_cache
-    
     # Return from cache if available
     if voice_name in _embeddings_cache:
         return _embeddings_cache[voice_name]
     
-    # Try to load from disk
-    safe_name = voice_name.replace(" ", "_")
-    gpt_path = f"voice_embeddings/{safe_name}_gpt.pth"
-    speaker_path = f"voice_embeddings/{safe_name}_speaker.pth"
+    # Try to load from disk (e.g. a voice another worker process just cloned)
+    gpt_path, speaker_path = _embedding_paths(voice_name)
     
     if os.path.exists(gpt_path) and os.path.exists(speaker_path):
         try:
-            embedding = {
-                'gpt_cond_latent': torch.load(gpt_path, map_location='cpu'),
-                'speaker_embedding': torch.load(speaker_path, map_location='cpu')
-            }
+            embedding = _load_pth_embedding(gpt_path, speaker_path)
             print(f"Loaded embedding for {voice_name}")
-            _embeddings_cache[voice_name] = embedding
+            _store_embedding(voice_name, embedding)
             return embedding
         except Exception as e:
             print(f"Failed to load embedding: {e}")
     
     return None
 
+def compute_voice_latents(voice_name, audio_paths, persist=True):
+    """Extract conditioning latents from reference clips once and cache them.
+
+    With persist, the latents are also written to the embedding store so
+    every worker process (and the next start-up) reuses them.
+    """
+    model = get_tts_model().synthesizer.tts_model
+    start = time.time()
+    gpt_cond_latent, speaker_embedding = model.get_conditioning_latents(
+        audio_path=list(audio_paths), **LATENT_SETTINGS
+    )
+    embedding = {'gpt_cond_latent': gpt_cond_latent.cpu(), 'speaker_embedding': speaker_embedding.cpu()}
+    print(f"  ⏱️  Conditioning latents for {voice_name}: {time.time() - start:.2f}s", flush=True)
+    if persist:
+        os.makedirs(EMBEDDINGS_DIR, exist_ok=True)
+        for path, tensor in zip(_embedding_paths(voice_name), embedding.values()):
+            torch.save(tensor, f"{path}.tmp")
+            os.replace(f"{path}.tmp", path)
+    _store_embedding(voice_name, embedding)
+    return embedding
+
+def register_voice_embedding(voice_name):
+    """Pick up a voice that a TTS worker has just added to the embedding store."""
+    return load_voice_embedding(voice_name)
+
 def get_voice_asset_status(voice_name):
     """Return readiness status for a voice based on available assets."""
-    safe_name = voice_name.replace(" ", "_")
-    gpt_path = f"voice_embeddings/{safe_name}_gpt.pth"
-    speaker_path = f"voice_embeddings/{safe_name}_speaker.pth"
-    has_embedding = os.path.exists(gpt_path) and os.path.exists(speaker_path)
-    has_voice_files = voice_name in VOICE_FOLDERS and os.path.exists(VOICE_FOLDERS[voice_name])
-
-    if has_embedding:
-        return "ready"
-    if has_voice_files:
-        return "partial"
-    return "missing"
+    index = _voice_status_index if _voice_status_index is not None else _build_voice_status_index()
+    return index.get(voice_name, "missing")
 
 def get_voice_statuses():
-    """Return status for each voice button."""
-    return {voice_name: get_voice_asset_status(voice_name) for voice_name in VOICE_DISPLAY_NAMES}
+    """Return status for each voice button, plus any cloned voices."""
+    statuses = {voice_name: get_voice_asset_status(voice_name) for voice_name in VOICE_DISPLAY_NAMES}
+    for voice_name, status in (_voice_status_index or {}).items():
+        if status == "ready":
+            statuses.setdefault(voice_name, status)
+    return statuses
+
+def get_voice_fingerprint(voice_name):
+    """Content hash of the voice conditioning (cache key and GPU voice ID)."""
+    if voice_name in _voice_fingerprints:
+        return _voice_fingerprints[voice_name]
+    embedding = load_voice_embedding(voice_name)
+    if embedding:
+        fingerprint = embedding_fingerprint(embedding)
+        _voice_fingerprints[voice_name] = fingerprint
+        return fingerprint
+    digest = hashlib.sha256()
+    # No embedding: the reference clips themselves define the voice
+    digest.update(voice_name.encode("utf-8"))
+    for path in get_voice_files(voice_name):
+        digest.update(path.encode("utf-8"))
+        try:
+            digest.update(str(os.path.getmtime(path)).encode("utf-8"))
+        except OSError:
+            pass
+    return digest.hexdigest()
+
+def custom_voice_folder(voice_name):
+    return os.path.join(CUSTOM_VOICES_DIR, voice_name.replace(" ", "_"))
+
+def get_voice_folder(voice_name):
+    """Reference clip folder for a built-in or uploaded voice, or None."""
+    if voice_name in VOICE_FOLDERS:
+        folder = VOICE_FOLDERS[voice_name]
+    else:
+        folder = custom_voice_folder(voice_name)
+    return folder if os.path.exists(folder) else None
 
 def get_voice_files(voice_name):
-    folder = VOICE_FOLDERS.get(voice_name, "Voice_Files/David Attenborough")
-    if not os.path.exists(folder):
-        return ["Voice_Files/David Attenborough/david 1a.mp3"]
+    folder = get_voice_folder(voice_name)
+    if folder is None:
+        return [f"{VOICE_FOLDERS[DEFAULT_VOICE]}/david 1a.mp3"]
     
     files = []
     for ext in ['.mp3', '.mp4', '.wav', '.m4a']:
-        files.extend([os.path.join(folder, f) for f in os.listdir(folder) if f.lower().endswith(ext)])
+        files.extend([os.path.join(folder, f) for f in sorted(os.listdir(folder)) if f.lower().endswith(ext)])
     
-    return files[:3] if files else ["Voice_Files/David Attenborough/david 1a.mp3"]
+    return files[:3] if files else [f"{VOICE_FOLDERS[DEFAULT_VOICE]}/david 1a.mp3"]
 
 async def _convert_with_external_gpu(text, voice_name, total_start):
     """Use external GPU service (Modal Labs) to run XTTS with voice embeddings"""
-    import time
-    import json
-    import base64
-    
-    api_url = os.getenv("MODAL_API_URL") or os.getenv("GPU_TTS_API_URL")
+    api_url = get_gpu_api_url()
     
     if not api_url:
         raise ValueError("MODAL_API_URL or GPU_TTS_API_URL not set")
     
     gpu_start = time.time()
     
-    # Get voice embedding to send to GPU service
+    # Get voice embedding; it is only uploaded if the GPU worker hasn't cached it yet
     embedding = load_voice_embedding(voice_name)
     
     if not embedding:
@@ -196,60 +355,232 @@ async def _convert_with_external_gpu(text, voice_name, total_start):
     print(f"  📡 Calling external GPU service: {api_url}")
     print(f"  🎭 Using voice: {voice_name}")
     
+    router = get_tts_router()
+    router.gpu.in_flight += 1
     try:
-        # Prepare embedding data for transmission
-        # Convert tensors to base64 or send as JSON-serializable format
-        import torch
-        
-        # Serialize embeddings (convert tensors to lists for JSON)
-        embedding_data = {
-            'gpt_cond_latent': embedding['gpt_cond_latent'].cpu().numpy().tolist() if isinstance(embedding['gpt_cond_latent'], torch.Tensor) else embedding['gpt_cond_latent'],
-            'speaker_embedding': embedding['speaker_embedding'].cpu().numpy().tolist() if isinstance(embedding['speaker_embedding'], torch.Tensor) else embedding['speaker_embedding'],
-        }
-        
-        # Send request to GPU service
-        payload = {
-            'text': text,
-            'language': 'en',
-            'voice_name': voice_name,
-            'embedding': embedding_data
-        }
-        
-        import httpx
-        async with httpx.AsyncClient(timeout=120.0) as http_client:
-            # Modal endpoint is the full URL, no /tts needed
-            response = await http_client.post(
-                api_url,
-                json=payload,
-                headers={"Content-Type": "application/json"}
-            )
-            response.raise_for_status()
-            
-            # Response should be audio bytes or base64 encoded audio
-            if response.headers.get("content-type", "").startswith("audio/"):
-                audio_data = response.content
-            else:
-                # Try JSON response with base64 audio
-                result = response.json()
-                if 'audio' in result:
-                    audio_data = base64.b64decode(result['audio'])
-                else:
-                    audio_data = response.content
-        
-        gpu_time = time.time() - gpu_start
-        total_time = time.time() - total_start
-        
-        print(f"🎤 External GPU TTS COMPLETE: {total_time:.2f}s (API: {gpu_time:.2f}s, FREE GPU!)", flush=True)
-        
-        yield audio_data
-        
+        audio_data = await synthesise_remote(
+            text,
+            voice_name,
+            get_voice_fingerprint(voice_name),
+            embedding,
+            language="en"
+        )
+    except asyncio.CancelledError:
+        raise
     except Exception as e:
+        router.record_gpu(time.time() - gpu_start, len(text), ok=False)
         print(f"  ❌ External GPU API error: {e}", flush=True)
         raise  # Re-raise to trigger fallback to local processing
+    finally:
+        router.gpu.in_flight -= 1
+
+    gpu_time = time.time() - gpu_start
+    total_time = time.time() - total_start
+    router.record_gpu(gpu_time, len(text), ok=True)
+    record_stage("tts_gpu", gpu_time)
+
+    print(f"🎤 External GPU TTS COMPLETE: {total_time:.2f}s (API: {gpu_time:.2f}s, FREE GPU!)", flush=True)
+    return audio_data
+
+def split_sentences(text):
+    """Split text into sentences so each can start streaming independently."""
+    return [part.strip() for part in _SENTENCE_END.split(text) if part.strip()]
+
+async def convert_text_to_speech(text, voice_name, status_cb=None, utterance=0, stream=None, priority=PRIORITY_INTERACTIVE, audio_format=DEFAULT_AUDIO_FORMAT):
+    """Synthesise text and yield framed binary audio messages (see audio_protocol).
+
+    Audio is produced as PCM16 chunks (or a WAV/MP3 file from the GPU) and
+    converted to the client's negotiated audio_format by audio_encoder. An
+    end frame closes the utterance.
+    """
+    async def _single():
+        yield text
+
+    async for frame in convert_segments_to_speech(_single(), voice_name, status_cb, utterance, stream, priority, audio_format):
+        yield frame
 
-async def convert_text_to_speech(text, voice_name, status_cb=None):
+async def convert_segments_to_speech(segments, voice_name, status_cb=None, utterance=0, stream=None, priority=PRIORITY_INTERACTIVE, audio_format=DEFAULT_AUDIO_FORMAT):
+    """Synthesise an async stream of text segments as one framed utterance.
+
+    Each segment is synthesised as soon as it arrives, so callers can feed
+    sentences while the description is still being generated.
+    """
+    encoder = UtteranceEncoder(audio_format)
+    sequence = 0
+    try:
+        async for segment in segments:
+            async for fmt, payload in _synthesise(segment, voice_name, status_cb, stream, priority):
+                for out_fmt, out_payload in await encoder.encode(fmt, payload):
+                    yield audio_frame(out_fmt, utterance, sequence, out_payload)
+                    sequence += 1
+        for out_fmt, out_payload in await encoder.finish():
+            yield audio_frame(out_fmt, utterance, sequence, out_payload)
+            sequence += 1
+    finally:
+        encoder.close()
+    if sequence:
+        yield end_frame(utterance, sequence)
+
+async def _synthesise(text, voice_name, status_cb=None, stream=None, priority=PRIORITY_INTERACTIVE):
+    """Yield (format, payload) pairs, serving repeats from the audio cache.
+
+    The cache is checked before either the GPU or CPU path runs; a result is
+    only stored once synthesis completes without error.
+    """
+    if stream is None:
+        stream = TTS_STREAMING
+    cache = get_audio_cache()
+    key = None
+    loop = asyncio.get_event_loop()
+    if cache is not None:
+        key = make_cache_key(
+            get_voice_fingerprint(voice_name),
+            text,
+            language="en",
+            params={"model": "xtts_v2", "stream": bool(stream), "stream_chunk_size": TTS_STREAM_CHUNK_SIZE if stream else None, "output": "pcm16"}
+        )
+        cached = await loop.run_in_executor(None, cache.get, key)
+        if cached is not None:
+            print(f"  💾 Audio cache hit: {voice_name} ({len(text)} chars)")
+            for fmt, payload in cached:
+                yield fmt, payload
+            return
+
+    chunks = []
+    try:
+        async for fmt, payload in _synthesise_uncached(text, voice_name, status_cb, stream, priority):
+            chunks.append((fmt, payload))
+            yield fmt, payload
+    except TTSRejectedError:
+        # Callers tell the client the server is busy
+        raise
+    except Exception:
+        # Already logged; nothing is cached for a failed synthesis
+        return
+    if cache is not None and chunks:
+        await loop.run_in_executor(None, cache.put, key, chunks)
+
+async def _synthesise_local(text, voice_name, total_start, stream, priority):
+    """Yield (format, payload) pairs from the local engine, recording its speed with the router."""
+    if not TTS_LOCAL:
+        raise TTSJobError("Local TTS is disabled (TTS_LOCAL=0)")
+    router = get_tts_router()
+    engine = get_tts_engine()
+    local_start = time.time()
+    chunk_count = 0
+    router.cpu.in_flight += 1
+    try:
+        # Queue on the local engine; streamed jobs yield PCM16 chunks, others one waveform
+        async for message, payload in engine.run("stream" if stream else "full", text, voice_name, priority=priority):
+            if message == "chunk":
+                if chunk_count == 0:
+                    print(f"  ⏱️  Time to first audio: {time.time() - total_start:.2f}s", flush=True)
+                chunk_count += 1
+                yield FORMAT_PCM16, payload
+            elif message == "wav":
+                generation_time = time.time() - total_start
+                audio_data = await to_pcm16(payload)
+                total_tts_time = time.time() - total_start
+                print(f"🎤 TTS COMPLETE: {total_tts_time:.2f}s (Generation: {generation_time:.2f}s)", flush=True)
+                # Send as a single chunk to avoid stutter
+                yield FORMAT_PCM16, audio_data
+    except TTSRejectedError:
+        raise
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        router.record_cpu(time.time() - local_start, len(text), ok=False)
+        raise
+    finally:
+        router.cpu.in_flight -= 1
+    router.record_cpu(time.time() - local_start, len(text), ok=True)
+    if chunk_count:
+        total_tts_time = time.time() - total_start
+        print(f"🎤 TTS STREAM COMPLETE: {total_tts_time:.2f}s ({chunk_count} chunks)", flush=True)
+
+async def _pump(source, queue):
+    """Feed an async generator into a queue, ending with None or the exception raised."""
+    try:
+        async for item in source:
+            await queue.put(item)
+        await queue.put(None)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        await queue.put(e)
+
+async def _cancel(*tasks):
+    for task in tasks:
+        if task is not None and not task.done():
+            task.cancel()
+    for task in tasks:
+        if task is not None:
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+async def _synthesise_hedged(text, voice_name, total_start, stream, priority, emit_status):
+    """GPU first; past the router's hedge deadline, race the local engine.
+
+    Whichever backend produces audio first wins and the other is cancelled.
+    GPU failures fall through to the local engine.
+    """
+    router = get_tts_router()
+    gpu_task = asyncio.create_task(_convert_with_external_gpu(text, voice_name, total_start))
+    gpu_start = time.time()
+    cpu_task = None
+    first_item = None
+    cpu_error = None
+    queue = asyncio.Queue()
+    try:
+        hedge_delay = router.hedge_delay()
+        can_hedge = hedge_delay is not None and get_tts_engine().ready
+        await asyncio.wait({gpu_task}, timeout=hedge_delay if can_hedge else None)
+
+        if not gpu_task.done():
+            router.hedged += 1
+            print(f"  🏁 GPU hasn't answered in {hedge_delay:.1f}s, racing local CPU", flush=True)
+            await emit_status("CPU", "GPU is slow, also trying local CPU")
+            cpu_task = asyncio.create_task(_pump(_synthesise_local(text, voice_name, total_start, stream, priority), queue))
+            first_item = asyncio.create_task(queue.get())
+            await asyncio.wait({gpu_task, first_item}, return_when=asyncio.FIRST_COMPLETED)
+            if not gpu_task.done():
+                item = first_item.result()
+                if item is not None and not isinstance(item, Exception):
+                    # CPU produced audio first: commit to it
+                    router.hedge_wins["cpu"] += 1
+                    gpu_task.cancel()
+                    router.record_gpu(time.time() - gpu_start, len(text), ok=False)
+                    yield item
+                    while (item := await queue.get()) is not None:
+                        if isinstance(item, Exception):
+                            raise item
+                        yield item
+                    return
+                # CPU failed or was rejected; the GPU is all that's left
+                cpu_error = item
+                await asyncio.wait({gpu_task})
+            elif gpu_task.exception() is None:
+                router.hedge_wins["gpu"] += 1
+
+        if gpu_task.exception() is None:
+            audio = gpu_task.result()
+            yield sniff_format(audio), audio
+            return
+        if cpu_error is not None:
+            raise cpu_error
+        await emit_status("CPU", "GPU unavailable, using local CPU")
+        print(f"  ⚠️  External GPU service failed, falling back to local CPU: {gpu_task.exception()}")
+    finally:
+        await _cancel(first_item, cpu_task, gpu_task)
+
+    async for fmt, payload in _synthesise_local(text, voice_name, total_start, stream, priority):
+        yield fmt, payload
+
+async def _synthesise_uncached(text, voice_name, status_cb=None, stream=None, priority=PRIORITY_INTERACTIVE):
+    """Yield (format, payload) pairs for the synthesised text."""
     try:
-        import time
         total_start = time.time()
         print(f"🎤 Generating speech: {voice_name} (Text length: {len(text)} chars)")
         
@@ -263,101 +594,32 @@ async def convert_text_to_speech(text, voice_name, status_cb=None):
             except Exception:
                 pass
 
-        # Check if external GPU service is configured
-        modal_url = os.getenv("MODAL_API_URL") or os.getenv("GPU_TTS_API_URL")
-        use_external_gpu = modal_url is not None
-        
-        if use_external_gpu:
-            try:
-                await _emit_status("GPU", "Using external GPU service")
-                print("  🚀 Using external GPU service (free GPU, same XTTS model)")
-                async for chunk in _convert_with_external_gpu(text, voice_name, total_start):
-                    yield chunk
-                return
-            except Exception as e:
-                await _emit_status("CPU", "GPU unavailable, using local CPU")
-                print(f"  ⚠️  External GPU service failed, falling back to local CPU: {e}")
-                # Fall through to local processing
-        
-        # Local CPU processing (original method)
-        await _emit_status("CPU", "Using local CPU")
-        loop = asyncio.get_event_loop()
-        
-        def generate():
-            model_start = time.time()
-            tts = get_tts_model()
-            model_load_time = time.time() - model_start
-            if model_load_time > 0.1:
-                print(f"  ⏱️  Model access: {model_load_time:.2f}s")
-            
-            embedding_start = time.time()
-            embedding = load_voice_embedding(voice_name)
-            embedding_time = time.time() - embedding_start
-            if embedding_time > 0.1:
-                print(f"  ⏱️  Embedding load: {embedding_time:.2f}s")
-            
-            inference_start = time.time()
-            if embedding:
-                print("  ✓ Using pre-computed embedding")
-                # Use synthesizer directly with pre-computed embeddings
-                wav = tts.synthesizer.tts_model.inference(
-                    text=text,
-                    language="en",
-                    gpt_cond_latent=embedding['gpt_cond_latent'],
-                    speaker_embedding=embedding['speaker_embedding']
-                )
-                wav = wav["wav"]
-            else:
-                print("  ⚠ Computing embedding on-the-fly")
-                voice_files = get_voice_files(voice_name)
-                print(f"  Using {len(voice_files)} voice file(s)")
-                
-                wav = tts.tts(
-                    text=text,
-                    speaker_wav=voice_files,
-                    language="en",
-                    split_sentences=False
-                )
-            inference_time = time.time() - inference_start
-            print(f"  ⏱️  TTS Inference: {inference_time:.2f}s", flush=True)
-            return wav
-        
-        wav = await loop.run_in_executor(None, generate)
-        generation_time = time.time() - total_start
-        
-        # Convert to MP3
-        encode_start = time.time()
-        if not isinstance(wav, torch.Tensor):
-            wav = torch.FloatTensor(wav)
-        if wav.dim() == 1:
-            wav = wav.unsqueeze(0)
-        
-        buffer = io.BytesIO()
-        try:
-            # Try saving as MP3
-            torchaudio.save(buffer, wav, 24000, format="mp3")
-        except (ImportError, RuntimeError):
-            # Fallback: save as WAV first, then convert
-            import scipy.io.wavfile as wavfile
-            import numpy as np
-            wav_np = wav.cpu().numpy()
-            if wav_np.ndim > 1:
-                wav_np = wav_np[0]  # Take first channel if stereo
-            # Normalise to int16 range
-            wav_np = np.int16(wav_np / np.max(np.abs(wav_np)) * 32767)
-            wavfile.write(buffer, 24000, wav_np)
-            buffer.seek(0)
-        audio_data = buffer.getvalue()
-        encode_time = time.time() - encode_start
-        
-        total_tts_time = time.time() - total_start
-        print(f"🎤 TTS COMPLETE: {total_tts_time:.2f}s (Generation: {generation_time:.2f}s, Encoding: {encode_time:.2f}s)", flush=True)
-        
-        # Send as a single chunk to avoid stutter
-        yield audio_data
+        router = get_tts_router()
+        engine_stats = get_tts_engine().stats()
+        cpu_load = (engine_stats["queue_depth"] + engine_stats["busy_workers"]) / max(engine_stats["workers"], 1)
+        backend = router.choose(len(text), cpu_load) if TTS_LOCAL else "gpu"
+
+        if backend == "gpu":
+            await _emit_status("GPU", "Using external GPU service")
+            print("  🚀 Using external GPU service (free GPU, same XTTS model)")
+            async for fmt, payload in _synthesise_hedged(text, voice_name, total_start, stream, priority, _emit_status):
+                yield fmt, payload
+            return
+
+        if get_gpu_api_url() is not None:
+            reason = "GPU circuit open" if router.state == "open" else "GPU busy"
+            print(f"  🔀 Routing to local CPU ({reason})")
+            await _emit_status("CPU", f"Using local CPU ({reason})")
+        else:
+            await _emit_status("CPU", "Using local CPU")
+        async for fmt, payload in _synthesise_local(text, voice_name, total_start, stream, priority):
+            yield fmt, payload
             
+    except TTSRejectedError as e:
+        print(f"  🚦 TTS rejected: {e}", flush=True)
+        raise
     except Exception as e:
         print(f"TTS error: {e}")
         import traceback
         traceback.print_exc()
-
+        raise
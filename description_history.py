@@ -0,0 +1,55 @@
+"""
+Per-connection memory of recent narrations.
+
+Each /narrate connection keeps its last few descriptions in a ring buffer.
+generate_description sends them to Claude as prior context, so consecutive
+frames in continuous mode read as one running commentary instead of repeating
+themselves. The buffer is capped by entry count (HISTORY_MAX_ENTRIES) and by
+an estimated token budget (HISTORY_TOKEN_BUDGET). The oldest entries are
+dropped first, so memory stays bounded however long a connection lives.
+"""
+
+import os
+from collections import deque
+
+HISTORY_MAX_ENTRIES = int(os.getenv("HISTORY_MAX_ENTRIES", "5"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "200"))
+# A single runaway description shouldn't crowd out the rest
+HISTORY_MAX_ENTRY_CHARS = 300
+
+
+def estimate_tokens(text):
+    """Rough Claude token count (~4 characters per token for English)."""
+    return max(1, (len(text) + 3) // 4)
+
+
+class DescriptionHistory:
+    """Bounded ring buffer of a connection's recent descriptions."""
+
+    def __init__(self, max_entries=HISTORY_MAX_ENTRIES, token_budget=HISTORY_TOKEN_BUDGET):
+        self.token_budget = token_budget
+        self._entries = deque(maxlen=max(0, max_entries))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, description):
+        description = " ".join(description.split())[:HISTORY_MAX_ENTRY_CHARS]
+        if description and self._entries.maxlen:
+            self._entries.append(description)
+
+    def clear(self):
+        self._entries.clear()
+
+    def recent(self):
+        """Oldest-first descriptions that fit the token budget, newest kept first."""
+        selected = []
+        used = 0
+        for description in reversed(self._entries):
+            cost = estimate_tokens(description)
+            if used + cost > self.token_budget:
+                break
+            selected.append(description)
+            used += cost
+        selected.reverse()
+        return selected
@@ -0,0 +1,151 @@
+"""
+Consolidated voice embedding pack.
+
+All voices' `gpt_cond_latent` and `speaker_embedding` tensors live in one
+flat file with a JSON index header, so start-up is a single mmap instead of
+two pickled `torch.load` calls per voice. Layout:
+
+    b"XVPK" | version (u32 LE) | header length (u32 LE) | JSON header
+    | padding | tensor data (each buffer 64-byte aligned)
+
+The header maps voice name -> tensor name -> dtype/shape/offset/nbytes, with
+offsets relative to the start of the data section.
+
+Build or refresh the pack from the existing `_gpt.pth`/`_speaker.pth` pairs:
+
+    python embedding_pack.py [voice_embeddings]
+"""
+
+import json
+import os
+import struct
+import sys
+
+import numpy as np
+
+PACK_MAGIC = b"XVPK"
+PACK_VERSION = 1
+PACK_FILENAME = "voices.pack"
+TENSOR_NAMES = ("gpt_cond_latent", "speaker_embedding")
+_PREAMBLE = struct.Struct("<4sII")
+_ALIGN = 64
+
+
+def _align(value):
+    return (value + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def _to_numpy(value):
+    if hasattr(value, "detach"):
+        value = value.detach().cpu().float().numpy()
+    return np.ascontiguousarray(np.asarray(value, dtype=np.float32))
+
+
+def write_pack(path, voices):
+    """Write {voice name: {tensor name: tensor/array}} to a pack file."""
+    index = {}
+    buffers = []
+    offset = 0
+    for voice_name in sorted(voices):
+        entry = {}
+        for tensor_name in TENSOR_NAMES:
+            array = _to_numpy(voices[voice_name][tensor_name])
+            offset = _align(offset)
+            entry[tensor_name] = {
+                "dtype": str(array.dtype),
+                "shape": list(array.shape),
+                "offset": offset,
+                "nbytes": array.nbytes,
+            }
+            buffers.append((offset, array.tobytes()))
+            offset += array.nbytes
+        index[voice_name] = entry
+
+    header = json.dumps({"voices": index}).encode("utf-8")
+    data_start = _align(_PREAMBLE.size + len(header))
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_PREAMBLE.pack(PACK_MAGIC, PACK_VERSION, len(header)))
+        f.write(header)
+        for buffer_offset, data in buffers:
+            f.seek(data_start + buffer_offset)
+            f.write(data)
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+
+
+def _read_header(path):
+    with open(path, "rb") as f:
+        magic, version, header_len = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+        if magic != PACK_MAGIC or version != PACK_VERSION:
+            raise ValueError(f"{path} is not a version {PACK_VERSION} voice pack")
+        header = json.loads(f.read(header_len).decode("utf-8"))
+    return header, _align(_PREAMBLE.size + header_len)
+
+
+def pack_voice_names(path):
+    """Voice names in a pack, read from the header alone."""
+    header, _ = _read_header(path)
+    return list(header["voices"])
+
+
+def read_pack(path):
+    """Map a pack file and return {voice name: {tensor name: torch.Tensor}}.
+
+    Tensors are views over a copy-on-write memory map: nothing is read or
+    copied until a page is touched.
+    """
+    import torch
+
+    header, data_start = _read_header(path)
+    mapped = np.memmap(path, dtype=np.uint8, mode="c")
+
+    voices = {}
+    for voice_name, entry in header["voices"].items():
+        tensors = {}
+        for tensor_name, meta in entry.items():
+            start = data_start + meta["offset"]
+            array = mapped[start:start + meta["nbytes"]].view(meta["dtype"]).reshape(meta["shape"])
+            tensors[tensor_name] = torch.from_numpy(array)
+        voices[voice_name] = tensors
+    return voices
+
+
+def find_pth_voices(embeddings_dir):
+    """Voice name -> (gpt path, speaker path) for every complete .pth pair."""
+    pairs = {}
+    if not os.path.isdir(embeddings_dir):
+        return pairs
+    for filename in os.listdir(embeddings_dir):
+        if not filename.endswith("_gpt.pth"):
+            continue
+        safe_name = filename[:-len("_gpt.pth")]
+        speaker_path = os.path.join(embeddings_dir, f"{safe_name}_speaker.pth")
+        if os.path.exists(speaker_path):
+            pairs[safe_name.replace("_", " ")] = (os.path.join(embeddings_dir, filename), speaker_path)
+    return pairs
+
+
+def convert_pth_dir(embeddings_dir, pack_path=None):
+    """Build a pack from every `_gpt.pth`/`_speaker.pth` pair in embeddings_dir."""
+    import torch
+
+    pack_path = pack_path or os.path.join(embeddings_dir, PACK_FILENAME)
+    pairs = find_pth_voices(embeddings_dir)
+    if not pairs:
+        print(f"No _gpt.pth/_speaker.pth pairs in {embeddings_dir}; nothing to pack")
+        return None
+    voices = {}
+    for voice_name, (gpt_path, speaker_path) in sorted(pairs.items()):
+        voices[voice_name] = {
+            "gpt_cond_latent": torch.load(gpt_path, map_location="cpu"),
+            "speaker_embedding": torch.load(speaker_path, map_location="cpu"),
+        }
+        print(f"  Packed: {voice_name}")
+    write_pack(pack_path, voices)
+    print(f"Wrote {len(voices)} voices to {pack_path} ({os.path.getsize(pack_path) / 1024:.0f} KB)")
+    return pack_path
+
+
+if __name__ == "__main__":
+    convert_pth_dir(sys.argv[1] if len(sys.argv) > 1 else "voice_embeddings")
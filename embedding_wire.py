@@ -0,0 +1,78 @@
+"""
+Compact binary encoding of voice embeddings for the GPU TTS service.
+
+Shared by the app (convert_text_to_speech / gpu_client) and the Modal worker
+(modal_xtts_deploy), so it only depends on numpy. Layout:
+
+    b"XEMB" | header length (u32 LE) | JSON header | raw tensor buffers
+
+The header lists each tensor's name, dtype, shape, offset and byte length.
+"""
+
+import hashlib
+import json
+import struct
+
+import numpy as np
+
+MAGIC = b"XEMB"
+_LENGTH = struct.Struct("<I")
+TENSOR_NAMES = ("gpt_cond_latent", "speaker_embedding")
+
+
+def _to_numpy(value, dtype):
+    if hasattr(value, "detach"):
+        value = value.detach().cpu().float().numpy()
+    return np.ascontiguousarray(np.asarray(value, dtype=dtype))
+
+
+def embedding_fingerprint(embedding):
+    """Content hash used as the voice ID.
+
+    Values are rounded to float16 first so the app (float32 tensors) and the
+    GPU worker (which may have received a float16 upload) agree on the ID.
+    """
+    digest = hashlib.sha256()
+    for name in TENSOR_NAMES:
+        array = _to_numpy(embedding[name], np.float16)
+        digest.update(name.encode("utf-8"))
+        digest.update(str(array.shape).encode("utf-8"))
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+def pack_embedding(embedding, dtype="float32"):
+    """Serialise {'gpt_cond_latent', 'speaker_embedding'} to bytes."""
+    entries = []
+    buffers = []
+    offset = 0
+    for name in TENSOR_NAMES:
+        array = _to_numpy(embedding[name], dtype)
+        data = array.tobytes()
+        entries.append({
+            "name": name,
+            "dtype": str(array.dtype),
+            "shape": list(array.shape),
+            "offset": offset,
+            "nbytes": len(data),
+        })
+        buffers.append(data)
+        offset += len(data)
+    header = json.dumps({"tensors": entries}).encode("utf-8")
+    return MAGIC + _LENGTH.pack(len(header)) + header + b"".join(buffers)
+
+
+def unpack_embedding(blob):
+    """Inverse of pack_embedding; returns {name: float32 numpy array}."""
+    blob = memoryview(blob)
+    if bytes(blob[:4]) != MAGIC:
+        raise ValueError("Not an embedding blob")
+    (header_len,) = _LENGTH.unpack_from(blob, 4)
+    header_end = 8 + header_len
+    header = json.loads(bytes(blob[8:header_end]).decode("utf-8"))
+    tensors = {}
+    for entry in header["tensors"]:
+        start = header_end + entry["offset"]
+        array = np.frombuffer(blob[start:start + entry["nbytes"]], dtype=entry["dtype"])
+        tensors[entry["name"]] = array.reshape(entry["shape"]).astype(np.float32)
+    return tensors
@@ -0,0 +1,85 @@
+"""
+Perceptual-hash deduplication of camera frames.
+
+Each /narrate connection keeps the difference hash (dHash) of the last frame
+it narrated. A new frame whose hash is within FRAME_DEDUP_THRESHOLD bits of
+it (and was sent with the same voice and politeness) is treated as the same
+scene, so we can skip it or replay the previous narration instead of paying
+for another vision call and TTS run.
+"""
+
+import io
+import os
+import time
+
+from PIL import Image
+
+# "replay" resends the previous narration, "skip" ignores the frame, "off" disables dedup
+FRAME_DEDUP_MODE = os.getenv("FRAME_DEDUP_MODE", "replay")
+# Maximum Hamming distance (out of 64 bits) for two frames to count as the same scene
+FRAME_DEDUP_THRESHOLD = int(os.getenv("FRAME_DEDUP_THRESHOLD", "5"))
+# Re-narrate an unchanged scene after this many seconds anyway
+FRAME_DEDUP_MAX_AGE = float(os.getenv("FRAME_DEDUP_MAX_AGE", "60"))
+
+_HASH_SIZE = 8
+
+
+def dhash(image_bytes, hash_size=_HASH_SIZE):
+    """64-bit difference hash of an encoded image."""
+    image = Image.open(io.BytesIO(image_bytes))
+    # Let the JPEG decoder downscale while decoding; much cheaper than a full decode
+    image.draft("L", (hash_size * 8, hash_size * 8))
+    image = image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = list(image.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class FrameDeduplicator:
+    """Per-connection record of the last narrated scene."""
+
+    def __init__(self, mode=FRAME_DEDUP_MODE, threshold=FRAME_DEDUP_THRESHOLD, max_age=FRAME_DEDUP_MAX_AGE):
+        self.mode = mode
+        self.threshold = threshold
+        self.max_age = max_age
+        self._last_hash = None
+        self._last_context = None
+        self._last_time = 0.0
+        self.description = ""
+        self.audio_frames = []
+        self.duplicates = 0
+
+    @property
+    def enabled(self):
+        return self.mode in ("replay", "skip")
+
+    def is_duplicate(self, frame_hash, context):
+        """True if frame_hash matches the last narrated scene under the same context."""
+        if not self.enabled or frame_hash is None or self._last_hash is None:
+            return False
+        if context != self._last_context:
+            return False
+        if time.time() - self._last_time > self.max_age:
+            return False
+        if hamming(frame_hash, self._last_hash) > self.threshold:
+            return False
+        self.duplicates += 1
+        return True
+
+    def remember(self, frame_hash, context, description, audio_frames):
+        """Record the narration produced for a frame so it can be replayed."""
+        if frame_hash is None:
+            return
+        self._last_hash = frame_hash
+        self._last_context = context
+        self._last_time = time.time()
+        self.description = description
+        self.audio_frames = list(audio_frames)
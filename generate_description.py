@@ -1,73 +1,140 @@
 import os
 import asyncio
-from anthropic import AsyncAnthropic
 
-ANTHROPIC_API_KEY = os.getenv('ANTHROPIC_API_KEY')
+from anthropic_client import get_anthropic_client, begin_request_timing, summarise_request_timing
+from tracing import prompt_tokens_total, record_stage
+
+# Marks the end of a prompt prefix Claude may cache and reuse across requests
+CACHE_BREAKPOINT = {"type": "ephemeral"}
+# Yielded in place of (the rest of) a description when the API call fails
+DESCRIPTION_ERROR = "Error generating description."
+
+POLITENESS_PROMPTS = {
+    1: "Be extremely formal and sophisticated, using the most refined and elegant language possible.",
+    2: "Be very proper and courteous, offering sincere compliments with graceful language.",
+    3: "Be warmly professional, using polite and encouraging words.",
+    4: "Be friendly and positive, maintaining an upbeat and welcoming tone.",
+    5: "Be conversational and natural, like chatting with a friend.",
+    6: "Be casual and laid-back, using everyday language.",
+    7: "Be playful and fun, adding light jokes to the description.",
+    8: "Be mildly sarcastic, with gentle teasing and witty observations.",
+    9: "Be cheekily critical, using clever wordplay and humorous jabs.",
+    10: "Be hilariously snarky, with maximum sass but keeping it playful.",
+}
+
+# Voice names arrive from clients, so only this many templates are kept
+PROMPT_TEMPLATE_MAX = int(os.getenv("PROMPT_TEMPLATE_MAX", "512"))
+
+# (voice, politeness) -> (system blocks, instruction block)
+_prompt_templates = {}
 
 def get_politeness_prompt(politeness_level):
-    prompts = {
-        1: "Be extremely formal and sophisticated, using the most refined and elegant language possible.",
-        2: "Be very proper and courteous, offering sincere compliments with graceful language.",
-        3: "Be warmly professional, using polite and encouraging words.",
-        4: "Be friendly and positive, maintaining an upbeat and welcoming tone.",
-        5: "Be conversational and natural, like chatting with a friend.",
-        6: "Be casual and laid-back, using everyday language.",
-        7: "Be playful and fun, adding light jokes to the description.",
-        8: "Be mildly sarcastic, with gentle teasing and witty observations.",
-        9: "Be cheekily critical, using clever wordplay and humorous jabs.",
-        10: "Be hilariously snarky, with maximum sass but keeping it playful.",
-    }
-    
-    return prompts.get(politeness_level, "Be casual and straightforward, with a balanced tone.")
-
-async def generate_description(image_data, selected_voice_name, description_history, politeness_level=5):
+    return POLITENESS_PROMPTS.get(politeness_level, "Be casual and straightforward, with a balanced tone.")
+
+def _compile_prompt(voice_name, politeness_level):
+    system_prompt = f"""You are {voice_name} and you must describe the image you are given in 15 words or less. {get_politeness_prompt(politeness_level)}
+        Please use only raw text without any special formatting characters like asterisks."""
+    system = ({"type": "text", "text": system_prompt, "cache_control": CACHE_BREAKPOINT},)
+    instruction = {"type": "text", "text": f"As {voice_name}, describe this image in your assigned tone in 15 words or less"}
+    return system, instruction
+
+def compile_prompt_templates(voice_names):
+    """Build the prompt for every politeness level of each voice up front.
+
+    Identical prompt bytes per (voice, politeness) are what let Anthropic's
+    prompt cache match the prefix on repeated requests.
+    """
+    for voice_name in voice_names:
+        for politeness_level in POLITENESS_PROMPTS:
+            _prompt_templates[(voice_name, politeness_level)] = _compile_prompt(voice_name, politeness_level)
+    return len(_prompt_templates)
+
+def get_prompt_template(voice_name, politeness_level):
+    key = (voice_name, politeness_level)
+    template = _prompt_templates.get(key)
+    if template is None:
+        template = _compile_prompt(voice_name, politeness_level)
+        if len(_prompt_templates) < PROMPT_TEMPLATE_MAX:
+            _prompt_templates[key] = template
+    return template
+
+def history_blocks(description_history):
+    """Prior descriptions as user content blocks, oldest first.
+
+    One block per entry lets the next request (same history plus one new
+    entry) hit the cached prefix at the previous block boundary.
+    """
+    if not description_history:
+        return []
+    blocks = [{"type": "text", "text": "For context, these are your most recent descriptions, oldest first. Don't repeat them; mention what's new or changed."}]
+    blocks += [{"type": "text", "text": f"- {description}"} for description in description_history]
+    blocks[-1] = dict(blocks[-1], cache_control=CACHE_BREAKPOINT)
+    return blocks
+
+
+def _record_prompt_usage(usage):
+    cache_read = getattr(usage, "cache_read_input_tokens", None) or 0
+    cache_write = getattr(usage, "cache_creation_input_tokens", None) or 0
+    prompt_tokens_total.inc(usage.input_tokens, kind="uncached")
+    prompt_tokens_total.inc(cache_read, kind="cache_read")
+    prompt_tokens_total.inc(cache_write, kind="cache_write")
+    return cache_read, cache_write
+
+
+async def generate_description(image_data, selected_voice_name, description_history, politeness_level=5, media_type="image/jpeg"):
     import time
     desc_start = time.time()
-    client = AsyncAnthropic(api_key=ANTHROPIC_API_KEY)
+    client = get_anthropic_client()
     try:
-        politeness_instruction = get_politeness_prompt(politeness_level)
-        system_prompt = f"""You are {selected_voice_name} and you must describe the image you are given in 15 words or less. {politeness_instruction}
-        Please use only raw text without any special formatting characters like asterisks."""
-        
+        system, instruction = get_prompt_template(selected_voice_name, politeness_level)
         print(f"🖼️  Generating description as {selected_voice_name} (politeness: {politeness_level})")
 
         api_start = time.time()
+        timing = begin_request_timing()
         async with client.messages.stream(
             model="claude-3-haiku-20240307",
             max_tokens=100,
             temperature=1,
-            system=system_prompt,
+            system=list(system),
             messages=[
                 {
                     "role": "user",
-                    "content": [
+                    "content": history_blocks(description_history) + [
                         {
                             "type": "image",
                             "source": {
                                 "type": "base64",
-                                "media_type": "image/jpeg",
+                                "media_type": media_type,
                                 "data": image_data
                             }
                         },
-                        {
-                            "type": "text",
-                            "text": f"As {selected_voice_name}, describe this image in your assigned tone in 15 words or less"
-                        }
+                        instruction
                     ]
                 }
             ]
         ) as stream:
+            stream_open_time = time.time() - api_start
+            connection = summarise_request_timing(timing)
+            record_stage("vision_connect", stream_open_time, reused_connection=connection["reused_connection"])
+            connect_label = "reused" if connection["reused_connection"] else f"{connection['connect']:.2f}s"
+            print(f"  ⏱️  Connect: {connect_label} | Response headers: {stream_open_time:.2f}s", flush=True)
             description = ""
             first_chunk_time = None
             async for event in stream.text_stream:
                 if first_chunk_time is None:
                     first_chunk_time = time.time() - api_start
+                    record_stage("vision_first_token", first_chunk_time)
                     print(f"  ⏱️  First token received: {first_chunk_time:.2f}s", flush=True)
                 description += event
                 yield event
-        
+            usage = stream.current_message_snapshot.usage
+
+        cache_read, cache_write = _record_prompt_usage(usage)
         total_desc_time = time.time() - desc_start
-        print(f"🖼️  Description complete: {total_desc_time:.2f}s (First token: {first_chunk_time:.2f}s if available)", flush=True)
+        record_stage("vision_complete", time.time() - api_start)
+        first_token_label = f"{first_chunk_time:.2f}s" if first_chunk_time is not None else "n/a"
+        print(f"🖼️  Description complete: {total_desc_time:.2f}s (First token: {first_token_label}, "
+              f"input tokens: {usage.input_tokens} uncached / {cache_read} cached / {cache_write} cache write)", flush=True)
     except Exception as e:
         print(f"❌ Error generating description: {e}")
-        yield "Error generating description."
\ No newline at end of file
+        yield DESCRIPTION_ERROR
\ No newline at end of file
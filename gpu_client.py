@@ -0,0 +1,204 @@
+"""
+Long-lived client for the external GPU TTS service (Modal).
+
+Requests are text plus a voice ID. The voice ID is the content hash of the
+embedding, and the worker caches embeddings by that ID. An embedding is only
+uploaded, in the compact binary format from embedding_wire, when the worker
+says it hasn't seen that voice. Audio comes back as raw bytes. Deployments
+without the /v2 routes fall back to the original JSON protocol.
+"""
+
+import asyncio
+import base64
+import os
+import time
+
+import httpx
+
+from embedding_wire import pack_embedding
+
+GPU_TTS_TIMEOUT = float(os.getenv("GPU_TTS_TIMEOUT", "120"))
+GPU_TTS_CONNECT_TIMEOUT = float(os.getenv("GPU_TTS_CONNECT_TIMEOUT", "10"))
+GPU_TTS_MAX_CONNECTIONS = int(os.getenv("GPU_TTS_MAX_CONNECTIONS", "20"))
+GPU_TTS_MAX_KEEPALIVE = int(os.getenv("GPU_TTS_MAX_KEEPALIVE", "10"))
+# Health probes are cheap reads; don't let a hung endpoint hold one for long
+GPU_PROBE_TIMEOUT = float(os.getenv("GPU_PROBE_TIMEOUT", "10"))
+# Seconds between pre-warm calls; a client connecting asks the GPU service to start a container
+GPU_PREWARM_INTERVAL = float(os.getenv("GPU_PREWARM_INTERVAL", "60"))
+GPU_TTS_HTTP2 = os.getenv("GPU_TTS_HTTP2", "1") == "1"
+# float16 halves the upload size; XTTS conditioning is insensitive to the precision loss
+GPU_EMBEDDING_DTYPE = os.getenv("GPU_EMBEDDING_DTYPE", "float16")
+
+_http_client = None
+_legacy_endpoints = set()
+_prewarm_task = None
+_last_prewarm = 0.0
+
+
+class UnknownVoiceError(Exception):
+    """The GPU worker has no embedding registered for the requested voice ID."""
+
+
+def get_gpu_api_url():
+    return os.getenv("MODAL_API_URL") or os.getenv("GPU_TTS_API_URL")
+
+
+def _create_http_client():
+    kwargs = dict(
+        limits=httpx.Limits(
+            max_connections=GPU_TTS_MAX_CONNECTIONS,
+            max_keepalive_connections=GPU_TTS_MAX_KEEPALIVE,
+        ),
+        timeout=httpx.Timeout(GPU_TTS_TIMEOUT, connect=GPU_TTS_CONNECT_TIMEOUT),
+    )
+    if GPU_TTS_HTTP2:
+        try:
+            return httpx.AsyncClient(http2=True, **kwargs)
+        except ImportError:
+            print("  ⚠️  h2 not installed, GPU client using HTTP/1.1")
+    return httpx.AsyncClient(**kwargs)
+
+
+def get_gpu_http_client():
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = _create_http_client()
+    return _http_client
+
+
+async def start_gpu_client():
+    """Create the pooled client (called from app startup) if a GPU endpoint is configured."""
+    if get_gpu_api_url():
+        get_gpu_http_client()
+
+
+async def close_gpu_client():
+    global _http_client
+    client = _http_client
+    _http_client = None
+    if client is not None and not client.is_closed:
+        await client.aclose()
+
+
+def _endpoint(api_url, path):
+    return api_url.rstrip("/") + path
+
+
+async def register_voice(api_url, voice_id, embedding):
+    """Upload an embedding to the worker's voice cache."""
+    blob = pack_embedding(embedding, GPU_EMBEDDING_DTYPE)
+    response = await get_gpu_http_client().put(
+        _endpoint(api_url, f"/v2/voices/{voice_id}"),
+        content=blob,
+        headers={"Content-Type": "application/octet-stream"},
+    )
+    response.raise_for_status()
+    print(f"  📤 Registered voice {voice_id[:12]} with GPU service ({len(blob) / 1024:.0f} KB)")
+
+
+async def probe_gpu(api_url):
+    """True if the GPU service answers (any non-5xx status; legacy workers 404 here)."""
+    try:
+        response = await get_gpu_http_client().get(_endpoint(api_url, "/v2/voices"), timeout=GPU_PROBE_TIMEOUT)
+    except httpx.HTTPError as e:
+        print(f"  🔌 GPU probe failed: {e!r}")
+        return False
+    return response.status_code < 500
+
+
+async def _prewarm(api_url):
+    start = time.monotonic()
+    try:
+        response = await get_gpu_http_client().post(_endpoint(api_url, "/v2/warm"))
+    except httpx.HTTPError as e:
+        print(f"  ⚠️  GPU pre-warm failed: {e!r}")
+        return
+    if response.status_code == 404:
+        # Worker predates the warm route; its first real request warms it instead
+        return
+    if response.is_success:
+        print(f"  🔥 GPU service warm ({time.monotonic() - start:.1f}s)")
+    else:
+        print(f"  ⚠️  GPU pre-warm returned {response.status_code}")
+
+
+def prewarm_gpu():
+    """Ask the GPU service to start a container ahead of the first request.
+
+    Fire and forget, and at most once per GPU_PREWARM_INTERVAL, so clients
+    reconnecting don't fan out into extra calls.
+    """
+    global _prewarm_task, _last_prewarm
+    api_url = get_gpu_api_url()
+    if not api_url or GPU_PREWARM_INTERVAL <= 0 or api_url in _legacy_endpoints:
+        return
+    now = time.monotonic()
+    if gpu_warming() or now - _last_prewarm < GPU_PREWARM_INTERVAL:
+        return
+    _last_prewarm = now
+    _prewarm_task = asyncio.create_task(_prewarm(api_url))
+
+
+def gpu_warming():
+    """True while a pre-warm call is waiting on the GPU service to start."""
+    return _prewarm_task is not None and not _prewarm_task.done()
+
+
+async def _request_tts(api_url, text, voice_id, language):
+    response = await get_gpu_http_client().post(
+        _endpoint(api_url, "/v2/tts"),
+        json={"text": text, "language": language, "voice_id": voice_id},
+    )
+    if response.status_code == 404:
+        try:
+            error = response.json().get("error")
+        except ValueError:
+            error = None
+        if error == "unknown_voice":
+            raise UnknownVoiceError(voice_id)
+        # Route missing: the worker predates the binary protocol
+        _legacy_endpoints.add(api_url)
+        return None
+    response.raise_for_status()
+    return response.content
+
+
+async def _request_tts_legacy(api_url, text, voice_name, embedding, language):
+    """Original JSON protocol: embedding as nested lists, base64 WAV back."""
+    payload = {
+        'text': text,
+        'language': language,
+        'voice_name': voice_name,
+        'embedding': {
+            name: embedding[name].cpu().numpy().tolist() if hasattr(embedding[name], "cpu") else embedding[name]
+            for name in ('gpt_cond_latent', 'speaker_embedding')
+        },
+    }
+    response = await get_gpu_http_client().post(api_url, json=payload)
+    response.raise_for_status()
+    if response.headers.get("content-type", "").startswith("audio/"):
+        return response.content
+    result = response.json()
+    if 'audio' in result:
+        return base64.b64decode(result['audio'])
+    if 'error' in result:
+        raise RuntimeError(result['error'])
+    return response.content
+
+
+async def synthesise_remote(text, voice_name, voice_id, embedding, language="en"):
+    """Synthesise text on the GPU worker and return the audio file bytes."""
+    api_url = get_gpu_api_url()
+    if not api_url:
+        raise ValueError("MODAL_API_URL or GPU_TTS_API_URL not set")
+
+    if api_url not in _legacy_endpoints:
+        try:
+            audio = await _request_tts(api_url, text, voice_id, language)
+        except UnknownVoiceError:
+            await register_voice(api_url, voice_id, embedding)
+            audio = await _request_tts(api_url, text, voice_id, language)
+        if audio is not None:
+            return audio
+
+    return await _request_tts_legacy(api_url, text, voice_name, embedding, language)
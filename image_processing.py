@@ -0,0 +1,56 @@
+"""
+Image preparation for the vision model.
+
+Frames arrive either as raw JPEG/WebP bytes (binary upload) or base64 inside
+a JSON message (legacy clients). Before they go to Claude they are downscaled
+so the long edge is at most VISION_MAX_DIMENSION and re-encoded as JPEG.
+A 15-word description doesn't need more, and vision input tokens grow with
+pixel count. Frames that are already small enough are passed through
+untouched.
+"""
+
+import base64
+import io
+import os
+
+from PIL import Image
+
+# Long-edge limit for images sent to Claude
+VISION_MAX_DIMENSION = int(os.getenv("VISION_MAX_DIMENSION", "768"))
+VISION_JPEG_QUALITY = int(os.getenv("VISION_JPEG_QUALITY", "80"))
+# Limits advertised to the browser so it downscales before uploading
+UPLOAD_MAX_DIMENSION = int(os.getenv("UPLOAD_MAX_DIMENSION", str(VISION_MAX_DIMENSION)))
+UPLOAD_QUALITY = float(os.getenv("UPLOAD_QUALITY", "0.8"))
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(4 * 1024 * 1024)))
+
+SUPPORTED_MEDIA_TYPES = ("image/jpeg", "image/webp", "image/png")
+_FORMAT_MEDIA_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+
+def upload_config():
+    """Upload settings sent to the client when it connects."""
+    return {
+        "binary": True,
+        "maxDimension": UPLOAD_MAX_DIMENSION,
+        "quality": UPLOAD_QUALITY,
+        "maxBytes": UPLOAD_MAX_BYTES,
+        "mimeTypes": ["image/webp", "image/jpeg"],
+    }
+
+
+def prepare_image_for_vision(image_bytes):
+    """Return (base64 data, media type) sized for the vision model."""
+    image = Image.open(io.BytesIO(image_bytes))
+    media_type = _FORMAT_MEDIA_TYPES.get(image.format)
+    width, height = image.size
+    if media_type in SUPPORTED_MEDIA_TYPES and max(width, height) <= VISION_MAX_DIMENSION:
+        return base64.b64encode(image_bytes).decode("ascii"), media_type
+
+    if image.format == "JPEG":
+        # Let libjpeg do most of the downscale during decode
+        image.draft("RGB", (VISION_MAX_DIMENSION, VISION_MAX_DIMENSION))
+    image = image.convert("RGB")
+    image.thumbnail((VISION_MAX_DIMENSION, VISION_MAX_DIMENSION), Image.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=VISION_JPEG_QUALITY, optimize=True)
+    return base64.b64encode(buffer.getvalue()).decode("ascii"), "image/jpeg"
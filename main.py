@@ -1,16 +1,51 @@
 from dotenv import load_dotenv
 load_dotenv()
 
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Request
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi.responses import FileResponse, HTMLResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from narrate_description import router as narrate_description_router
-from convert_text_to_speech import get_tts_model, preload_all_embeddings, warm_up_tts, is_tts_ready
+from voice_cloning import router as voice_cloning_router
+from convert_text_to_speech import VOICE_DISPLAY_NAMES, is_tts_ready
+from tts_engine import get_tts_engine
+from audio_cache import get_audio_cache_stats
+from generate_description import compile_prompt_templates
+from anthropic_client import start_anthropic_client, close_anthropic_client
+from gpu_client import start_gpu_client, close_gpu_client
+from tts_router import get_tts_router
+from connection_manager import connection_manager
+from startup import startup_state, load_tts_in_background
+from tracing import render_metrics
 
 import os
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await start_anthropic_client()
+    await start_gpu_client()
+    get_tts_router().start()
+    templates = compile_prompt_templates(VOICE_DISPLAY_NAMES)
+    print(f"📝 Compiled {templates} prompt templates")
+    # Load the TTS model in the background so the UI and /health are served immediately
+    loader = asyncio.create_task(load_tts_in_background())
+    try:
+        yield
+    finally:
+        loader.cancel()
+        try:
+            await loader
+        except asyncio.CancelledError:
+            pass
+        await get_tts_router().stop()
+        await close_anthropic_client()
+        await close_gpu_client()
+        get_tts_engine().stop()
+
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware to allow WebSocket connections
 app.add_middleware(
@@ -22,6 +57,7 @@ app.add_middleware(
 )
 
 app.include_router(narrate_description_router)
+app.include_router(voice_cloning_router)
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
 app.mount("/templates", StaticFiles(directory="templates"), name="templates")
@@ -32,19 +68,46 @@ async def get_root(request: Request):
 
 @app.get("/health")
 async def health():
-    return {"ready": is_tts_ready()}
-
-# Pre-load TTS model and embeddings at startup
-print("Pre-loading XTTS model and voice embeddings...")
-try:
-    get_tts_model()
-    print("XTTS model pre-loaded!")
-    preload_all_embeddings()
-    print("All voice embeddings pre-loaded and ready!")
-    warm_up_tts()
-    print("XTTS warm-up complete!")
-except Exception as e:
-    print(f"Failed to pre-load: {e}")
+    return {
+        "ready": is_tts_ready(),
+        "startup": startup_state.snapshot(),
+        "audio_cache": get_audio_cache_stats(),
+        "tts_engine": get_tts_engine().stats(),
+        "gpt_prefix_cache": get_tts_engine().prefix_cache_stats(),
+        "tts_router": get_tts_router().stats(),
+        "connections": connection_manager.stats(),
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    engine = get_tts_engine().stats()
+    cache = get_audio_cache_stats()
+    router = get_tts_router().stats()
+    connections = connection_manager.stats()
+    gauges = [
+        ("narrator_tts_ready", "1 once the TTS engine can serve requests.", int(is_tts_ready())),
+        ("narrator_tts_queue_depth", "TTS jobs waiting for a worker.", engine["queue_depth"]),
+        ("narrator_tts_busy_workers", "TTS workers running a job.", engine["busy_workers"]),
+        ("narrator_tts_ready_workers", "TTS workers that have finished loading.", engine["ready_workers"]),
+        ("narrator_tts_rejected", "TTS jobs refused because the queue was full, since start.", engine["rejected"]),
+        ("narrator_tts_shed", "TTS jobs dropped after waiting past TTS_MAX_QUEUE_WAIT, since start.", engine["shed"]),
+        ("narrator_ws_connections", "Open /narrate WebSocket connections.", connections["connections"]),
+        ("narrator_ws_queued_messages", "Messages waiting in per-client send queues.", connections["queued_messages"]),
+        ("narrator_ws_slow_disconnects", "Clients disconnected for falling behind since start.", connections["slow_disconnects"]),
+    ]
+    if router["gpu_configured"]:
+        gauges += [
+            ("narrator_gpu_breaker_open", "1 while the GPU circuit breaker routes everything to CPU.", int(router["breaker"] == "open")),
+            ("narrator_gpu_in_flight", "Requests waiting on the GPU service.", router["gpu"]["in_flight"]),
+            ("narrator_gpu_error_rate", "GPU failure rate over the recent window.", router["gpu"]["error_rate"]),
+            ("narrator_tts_hedged", "Requests that raced the CPU against a slow GPU since start.", router["hedged"]),
+        ]
+    if cache.get("enabled"):
+        gauges += [
+            ("narrator_audio_cache_hit_rate", "Audio cache hit rate since start.", cache["hit_rate"]),
+            ("narrator_audio_cache_memory_bytes", "Bytes held in the in-memory audio cache.", cache["memory_bytes"]),
+        ]
+    return PlainTextResponse(render_metrics(gauges), media_type="text/plain; version=0.0.4")
 
 if __name__ == "__main__":
     import uvicorn
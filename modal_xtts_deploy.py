@@ -11,6 +11,33 @@ import os
 
 # Note: TTS and torch will be installed in Modal's container, not needed locally
 
+VOICE_EMBEDDINGS_DIR = "/root/voice_embeddings"
+# Coqui's model download directory, persisted in the tts_cache volume
+MODEL_CACHE_DIR = "/root/.local/share/tts"
+XTTS_MODEL_NAME = "tts_models/multilingual/multi-dataset/xtts_v2"
+# Single-file copy of the checkpoint with the large tensors in fp16, written once into the volume
+FAST_WEIGHTS_NAME = "model_fp16.pth"
+FAST_WEIGHTS_MIN_NUMEL = 4096
+
+# Containers kept running with no traffic (each one bills GPU time) and idle seconds before scale-down
+XTTS_MIN_CONTAINERS = int(os.getenv("XTTS_MIN_CONTAINERS", "0"))
+XTTS_SCALEDOWN_WINDOW = int(os.getenv("XTTS_SCALEDOWN_WINDOW", "100"))
+
+# Micro-batching: collect /v2 requests for up to TTS_BATCH_WINDOW_MS and run them together
+TTS_BATCH_WINDOW_MS = int(os.getenv("TTS_BATCH_WINDOW_MS", "25"))
+TTS_BATCH_MAX_SIZE = int(os.getenv("TTS_BATCH_MAX_SIZE", "8"))
+
+# XTTS inference() defaults, reused by the batched path so output matches
+XTTS_SAMPLING = dict(
+    temperature=0.75,
+    length_penalty=1.0,
+    repetition_penalty=10.0,
+    top_k=50,
+    top_p=0.85,
+    do_sample=True,
+    num_beams=1,
+)
+
 image = (
     modal.Image.debian_slim(python_version="3.11")
     .apt_install("git", "ffmpeg")
@@ -24,6 +51,11 @@ image = (
         "fastapi==0.110.0",
         "pydantic==2.5.0",
     )
+    .env({"COQUI_TOS_AGREED": "1"})
+    # Shared binary embedding format (numpy only)
+    .add_local_python_source("embedding_wire")
+    # Built-in voices, loaded onto the GPU at container start
+    .add_local_dir("voice_embeddings", remote_path=VOICE_EMBEDDINGS_DIR)
 )
 
 app = modal.App("xtts-tts-api")
@@ -31,34 +63,193 @@ app = modal.App("xtts-tts-api")
 # Persist model downloads between runs to avoid cold-start re-downloads
 tts_cache = modal.Volume.from_name("xtts-model-cache", create_if_missing=True)
 
+# Uploaded voice embeddings keyed by voice ID (content hash), shared by all containers
+voice_store = modal.Dict.from_name("xtts-voices", create_if_missing=True)
+
+def _ensure_fast_weights(model_dir):
+    """Path of the fp16 single-file checkpoint, converting model.pth on first use.
+
+    Tensors of FAST_WEIGHTS_MIN_NUMEL elements or more (the weight matrices,
+    nearly all of the bytes) are stored in fp16. Norms, biases and buffers
+    stay fp32. load_state_dict copies into the fp32 model, so inference still
+    runs in fp32 and only the read from the volume halves. Returns (path,
+    converted).
+    """
+    import torch
+
+    fast_path = os.path.join(model_dir, FAST_WEIGHTS_NAME)
+    if os.path.exists(fast_path):
+        return fast_path, False
+    checkpoint = torch.load(os.path.join(model_dir, "model.pth"), map_location="cpu")
+    state = checkpoint.get("model", checkpoint)
+    compact = {
+        key: value.half() if torch.is_floating_point(value) and value.numel() >= FAST_WEIGHTS_MIN_NUMEL else value
+        for key, value in state.items()
+    }
+    temp_path = fast_path + ".tmp"
+    torch.save({"model": compact}, temp_path)
+    os.replace(temp_path, fast_path)
+    print(f"Wrote {fast_path} ({os.path.getsize(fast_path) / 1024 ** 2:.0f} MB)")
+    return fast_path, True
+
+
+def _load_xtts_cpu():
+    """Build XTTS on the CPU from the cached files, skipping the TTS.api wrapper."""
+    from TTS.tts.configs.xtts_config import XttsConfig
+    from TTS.tts.models.xtts import Xtts
+    from TTS.utils.manage import ModelManager
+
+    # No-op when the files are already in the volume
+    model_dir, _, _ = ModelManager().download_model(XTTS_MODEL_NAME)
+    fast_path, converted = _ensure_fast_weights(model_dir)
+    config = XttsConfig()
+    config.load_json(os.path.join(model_dir, "config.json"))
+    model = Xtts.init_from_config(config)
+    model.load_checkpoint(config, checkpoint_dir=model_dir, checkpoint_path=fast_path, eval=True)
+    return model, converted
+
+
+class BatchScheduler:
+    """Collects concurrent requests for a short window and runs them as one batch.
+
+    run_batch receives a list of request dicts and must return one result per
+    request, in order. It runs on a worker thread so the container's event
+    loop keeps accepting requests while the GPU is busy.
+    """
+
+    def __init__(self, run_batch, window_ms=TTS_BATCH_WINDOW_MS, max_size=TTS_BATCH_MAX_SIZE):
+        import asyncio
+        self.run_batch = run_batch
+        self.window = window_ms / 1000
+        self.max_size = max_size
+        self._queue = asyncio.Queue()
+        self._worker = None
+        self.batches = 0
+        self.requests = 0
+
+    async def submit(self, request):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+        future = loop.create_future()
+        await self._queue.put((request, future))
+        return await future
+
+    async def _run(self):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            self.batches += 1
+            self.requests += len(batch)
+            try:
+                results = await asyncio.to_thread(self.run_batch, [request for request, _ in batch])
+            except Exception as e:
+                results = [{"error": str(e)}] * len(batch)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+
 @app.cls(
     image=image,
     gpu="T4",  # Cheapest GPU option on Modal's free tier
-    scaledown_window=100,  # Keep warm for 2 minutes
+    scaledown_window=XTTS_SCALEDOWN_WINDOW,
+    min_containers=XTTS_MIN_CONTAINERS,
+    # Restore the CPU-side model from a memory snapshot instead of rebuilding it
+    enable_memory_snapshot=True,
     timeout=300,
-    volumes={"/root/.local/share/tts": tts_cache},
+    volumes={MODEL_CACHE_DIR: tts_cache},
 )
+# Let one container accept several requests at once so the batch scheduler has something to batch
+@modal.concurrent(max_inputs=TTS_BATCH_MAX_SIZE * 2)
 class XTTSModel:
-    @modal.enter()
+    @modal.enter(snap=True)
     def load_model(self):
-        """Load XTTS model on container startup"""
-        # Import here (inside container, not locally)
+        """Build XTTS and the built-in voices on the CPU; this state is memory-snapshotted"""
+        import time
+
+        start = time.time()
+        print("Loading XTTS model...")
+        self.model, converted = _load_xtts_cpu()
+        print(f"XTTS model built on CPU in {time.time() - start:.1f}s")
+        # Voice ID -> (gpt_cond_latent, speaker_embedding); moved to the GPU in move_to_gpu
+        self.voices = {}
+        self.voice_ids_by_name = {}
+        self._preload_voices()
+        self.scheduler = None
+        if converted:
+            try:
+                # Persist the converted weights for future containers
+                tts_cache.commit()
+            except Exception:
+                pass
+
+    @modal.enter(snap=False)
+    def move_to_gpu(self):
+        """Runs on every container start, including snapshot restores"""
+        import time
+
+        start = time.time()
+        self.model.cuda()
+        self.voices = {
+            voice_id: (gpt_cond_latent.to("cuda"), speaker_embedding.to("cuda"))
+            for voice_id, (gpt_cond_latent, speaker_embedding) in self.voices.items()
+        }
+        print(f"XTTS model on GPU in {time.time() - start:.1f}s")
+        self._warm_up()
+
+    def _warm_up(self):
+        """One short inference per preloaded voice, so no user request pays for first-use setup"""
+        import time
+
+        start = time.time()
+        for voice_id, voice in self.voices.items():
+            try:
+                self._infer_single("Hello.", "en", voice)
+            except Exception as e:
+                print(f"  Warm-up failed for {voice_id[:12]}: {e}")
+        print(f"Warmed up {len(self.voices)} voices in {time.time() - start:.1f}s")
+
+    def _preload_voices(self):
+        """Load every built-in voice embedding once, keyed by content hash"""
         import torch
-        from TTS.api import TTS
-        import os
-        os.environ["COQUI_TOS_AGREED"] = "1"
-        
-        print("Loading XTTS model on GPU...")
-        self.tts = TTS("tts_models/multilingual/multi-dataset/xtts_v2").to("cuda")
-        print("XTTS model loaded!")
-        try:
-            # Persist downloaded model files for future runs
-            tts_cache.commit()
-        except Exception:
-            pass
+        from embedding_wire import embedding_fingerprint
+
+        if not os.path.isdir(VOICE_EMBEDDINGS_DIR):
+            print("No built-in voice embeddings found")
+            return
+        for gpt_file in sorted(os.listdir(VOICE_EMBEDDINGS_DIR)):
+            if not gpt_file.endswith("_gpt.pth"):
+                continue
+            safe_name = gpt_file[:-len("_gpt.pth")]
+            speaker_path = os.path.join(VOICE_EMBEDDINGS_DIR, f"{safe_name}_speaker.pth")
+            if not os.path.exists(speaker_path):
+                continue
+            try:
+                embedding = {
+                    "gpt_cond_latent": torch.load(os.path.join(VOICE_EMBEDDINGS_DIR, gpt_file), map_location="cpu"),
+                    "speaker_embedding": torch.load(speaker_path, map_location="cpu"),
+                }
+                voice_id = embedding_fingerprint(embedding)
+                self.voices[voice_id] = (embedding["gpt_cond_latent"], embedding["speaker_embedding"])
+                self.voice_ids_by_name[safe_name.replace("_", " ")] = voice_id
+            except Exception as e:
+                print(f"  Failed to preload {safe_name}: {e}")
+        print(f"Preloaded {len(self.voices)} voices")
     
     @modal.method()
-    def tts(self, text: str, language: str = "en", embedding: dict = None):
+    def tts(self, text: str, language: str = "en", embedding: dict = None, voice_name: str = None):
         """
         Generate speech from text using XTTS with optional voice embedding
         
@@ -66,6 +257,7 @@ class XTTSModel:
             text: Text to convert to speech
             language: Language code (default: "en")
             embedding: Dict with 'gpt_cond_latent' and 'speaker_embedding' (lists/tensors)
+            voice_name: Built-in voice to use instead of the embedding, if preloaded
         
         Returns:
             Base64 encoded audio bytes
@@ -75,23 +267,45 @@ class XTTSModel:
         import torchaudio
         
         try:
-            # Convert embedding lists back to tensors if needed
-            if embedding:
+            voice = None
+            if voice_name in self.voice_ids_by_name:
+                voice = self.voices[self.voice_ids_by_name[voice_name]]
+
+            if voice is not None:
+                # Built-in voice already resident on the GPU; ignore the uploaded lists
+                wav = self.model.inference(
+                    text=text,
+                    language=language,
+                    gpt_cond_latent=voice[0],
+                    speaker_embedding=voice[1]
+                )
+                wav = wav["wav"]
+            elif embedding:
+                # Convert embedding lists back to tensors if needed
                 import numpy as np
                 gpt_cond = torch.tensor(embedding['gpt_cond_latent']).to("cuda")
                 speaker_emb = torch.tensor(embedding['speaker_embedding']).to("cuda")
                 
                 # Use pre-computed embedding
-                wav = self.tts.synthesizer.tts_model.inference(
+                wav = self.model.inference(
                     text=text,
                     language=language,
                     gpt_cond_latent=gpt_cond,
                     speaker_embedding=speaker_emb
                 )
                 wav = wav["wav"]
+            elif self.voices:
+                # No voice given: use the first built-in voice
+                voice = next(iter(self.voices.values()))
+                wav = self.model.inference(
+                    text=text,
+                    language=language,
+                    gpt_cond_latent=voice[0],
+                    speaker_embedding=voice[1]
+                )
+                wav = wav["wav"]
             else:
-                # Use default voice
-                wav = self.tts.tts(text=text, language=language)
+                return {"error": "no voice available"}
             
             # Convert to bytes
             if not isinstance(wav, torch.Tensor):
@@ -110,13 +324,180 @@ class XTTSModel:
             return {"error": str(e)}
 
 
+    def _encode_wav(self, wav):
+        import torch
+        import torchaudio
+        if not isinstance(wav, torch.Tensor):
+            wav = torch.FloatTensor(wav)
+        if wav.dim() == 1:
+            wav = wav.unsqueeze(0)
+        buffer = io.BytesIO()
+        # 16-bit PCM: half the size of float WAV, and the app can re-encode it without decoding
+        torchaudio.save(buffer, wav.clamp(-1.0, 1.0).cpu(), 24000, format="wav", encoding="PCM_S", bits_per_sample=16)
+        return buffer.getvalue()
+
+    def _load_voice(self, voice_id):
+        """Return GPU tensors for a registered voice, fetching from the shared store on a miss."""
+        import torch
+        from embedding_wire import unpack_embedding
+
+        voice = self.voices.get(voice_id)
+        if voice is not None:
+            return voice
+        blob = voice_store.get(voice_id)
+        if blob is None:
+            return None
+        tensors = unpack_embedding(blob)
+        voice = (
+            torch.from_numpy(tensors["gpt_cond_latent"]).to("cuda"),
+            torch.from_numpy(tensors["speaker_embedding"]).to("cuda"),
+        )
+        self.voices[voice_id] = voice
+        return voice
+
+    @modal.method()
+    def register_voice(self, voice_id: str, blob: bytes):
+        """Validate and store a binary embedding (see embedding_wire) under voice_id."""
+        from embedding_wire import embedding_fingerprint, unpack_embedding
+        try:
+            tensors = unpack_embedding(blob)
+        except Exception as e:
+            return {"error": f"invalid embedding: {e}"}
+        # Voice IDs are content hashes; refuse uploads that don't match their ID
+        if embedding_fingerprint(tensors) != voice_id:
+            return {"error": "voice_id does not match embedding content"}
+        voice_store[voice_id] = blob
+        self.voices.pop(voice_id, None)
+        self._load_voice(voice_id)
+        return {"voice_id": voice_id}
+
+    @modal.method()
+    def warm(self):
+        """No-op that makes Modal start (and warm up) a container if none is running"""
+        return {"warm": True, "voices": len(self.voices)}
+
+    @modal.method()
+    def voice_info(self, voice_id: str = None):
+        """Report whether a voice ID is registered, or list all resident voices"""
+        names = {vid: name for name, vid in self.voice_ids_by_name.items()}
+        if voice_id is None:
+            return {
+                "voices": [{"voice_id": vid, "name": names.get(vid)} for vid in self.voices],
+            }
+        registered = voice_id in self.voices or voice_store.contains(voice_id)
+        return {"voice_id": voice_id, "registered": registered, "name": names.get(voice_id)}
+
+    @modal.method()
+    async def tts_voice(self, text: str, language: str = "en", voice_id: str = None):
+        """
+        Generate speech for a registered voice (micro-batched with concurrent requests)
+
+        Returns:
+            {"audio": raw WAV bytes} or {"error": "unknown_voice"}
+        """
+        if self.scheduler is None:
+            self.scheduler = BatchScheduler(self._run_batch)
+        return await self.scheduler.submit({"text": text, "language": language, "voice_id": voice_id})
+
+    def _run_batch(self, requests):
+        """Synthesise a batch of requests, grouping those that can share one GPT pass"""
+        import time
+        start = time.time()
+        model = self.model
+        results = [None] * len(requests)
+        groups = {}
+        for index, request in enumerate(requests):
+            voice = self._load_voice(request["voice_id"]) if request["voice_id"] else None
+            if voice is None:
+                results[index] = {"error": "unknown_voice"}
+                continue
+            text = request["text"].strip().lower()
+            tokens = model.tokenizer.encode(text, lang=request["language"])
+            # XTTS's GPT has no attention mask for ragged batches, so only equal-length
+            # token sequences can be generated together; voices can differ freely
+            key = (request["language"], len(tokens))
+            groups.setdefault(key, []).append((index, tokens, voice))
+
+        for (language, _), members in groups.items():
+            try:
+                if len(members) == 1:
+                    index, _, voice = members[0]
+                    wavs = [self._infer_single(requests[index]["text"], language, voice)]
+                else:
+                    wavs = self._infer_group(members)
+                for (index, _, _), wav in zip(members, wavs):
+                    results[index] = {"audio": self._encode_wav(wav)}
+            except Exception as e:
+                print(f"Batched inference failed ({len(members)} requests), running singly: {e}")
+                for index, _, voice in members:
+                    try:
+                        wav = self._infer_single(requests[index]["text"], language, voice)
+                        results[index] = {"audio": self._encode_wav(wav)}
+                    except Exception as single_error:
+                        results[index] = {"error": str(single_error)}
+
+        print(f"Batch of {len(requests)} in {len(groups)} group(s): {time.time() - start:.2f}s")
+        return results
+
+    def _infer_single(self, text, language, voice):
+        wav = self.model.inference(
+            text=text,
+            language=language,
+            gpt_cond_latent=voice[0],
+            speaker_embedding=voice[1],
+            **XTTS_SAMPLING
+        )
+        return wav["wav"]
+
+    def _infer_group(self, members):
+        """One batched GPT generate + latent pass for equal-length texts, then per-item decode"""
+        import torch
+
+        model = self.model
+        gpt = model.gpt
+        batch = len(members)
+        with torch.inference_mode():
+            text_tokens = torch.IntTensor([tokens for _, tokens, _ in members]).to("cuda")
+            cond_latents = torch.cat([voice[0] for _, _, voice in members], dim=0)
+            gpt_codes = gpt.generate(
+                cond_latents=cond_latents,
+                text_inputs=text_tokens,
+                input_tokens=None,
+                output_attentions=False,
+                **XTTS_SAMPLING
+            )
+            # Sequences finish at different points; HF pads the rest with the stop token
+            code_lengths = []
+            for row in gpt_codes:
+                stops = (row == gpt.stop_audio_token).nonzero()
+                code_lengths.append(int(stops[0]) + 1 if len(stops) else row.shape[-1])
+            expected_output_len = torch.tensor(
+                [length * gpt.code_stride_len for length in code_lengths], device=text_tokens.device
+            )
+            text_len = torch.tensor([text_tokens.shape[-1]] * batch, device=text_tokens.device)
+            gpt_latents = gpt(
+                text_tokens,
+                text_len,
+                gpt_codes,
+                expected_output_len,
+                cond_latents=cond_latents,
+                return_attentions=False,
+                return_latent=True,
+            )
+            wavs = []
+            for row, (_, _, voice) in enumerate(members):
+                latents = gpt_latents[row:row + 1, :code_lengths[row]]
+                wavs.append(model.hifigan_decoder(latents, g=voice[1]).cpu().squeeze())
+        return wavs
+
 @app.function(
     image=image,
 )
 @modal.asgi_app()
 def fastapi_app():
     """FastAPI app for TTS endpoint"""
-    from fastapi import FastAPI
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse, Response
     from pydantic import BaseModel
     
     class TTSRequest(BaseModel):
@@ -125,6 +506,11 @@ def fastapi_app():
         voice_name: str = None
         embedding: dict = None
     
+    class VoiceTTSRequest(BaseModel):
+        text: str
+        language: str = "en"
+        voice_id: str
+
     web_app = FastAPI()
     
     @web_app.post("/")
@@ -134,8 +520,50 @@ def fastapi_app():
         result = model.tts.remote(
             text=request.text,
             language=request.language,
-            embedding=request.embedding
+            embedding=request.embedding,
+            voice_name=request.voice_name
         )
         return result
+
+    @web_app.put("/v2/voices/{voice_id}")
+    async def register_voice_endpoint(voice_id: str, request: Request):
+        """Register a binary embedding so later requests only send the voice ID"""
+        blob = await request.body()
+        result = await XTTSModel().register_voice.remote.aio(voice_id, blob)
+        if "error" in result:
+            return JSONResponse(result, status_code=400)
+        return result
+
+    @web_app.post("/v2/warm")
+    async def warm_endpoint():
+        """Pre-warm trigger: the app calls this when a client connects"""
+        return await XTTSModel().warm.remote.aio()
+
+    @web_app.get("/v2/voices")
+    async def list_voices_endpoint():
+        """Voices resident on the GPU worker"""
+        return await XTTSModel().voice_info.remote.aio()
+
+    @web_app.get("/v2/voices/{voice_id}")
+    async def verify_voice_endpoint(voice_id: str):
+        """Check whether a voice ID is registered"""
+        result = await XTTSModel().voice_info.remote.aio(voice_id)
+        if not result["registered"]:
+            return JSONResponse({**result, "error": "unknown_voice"}, status_code=404)
+        return result
+
+    @web_app.post("/v2/tts")
+    async def tts_voice_endpoint(request: VoiceTTSRequest):
+        """Text + voice ID in, raw WAV bytes out"""
+        result = await XTTSModel().tts_voice.remote.aio(
+            text=request.text,
+            language=request.language,
+            voice_id=request.voice_id
+        )
+        if result.get("error") == "unknown_voice":
+            return JSONResponse(result, status_code=404)
+        if "error" in result:
+            return JSONResponse(result, status_code=500)
+        return Response(content=result["audio"], media_type="audio/wav")
     
     return web_app
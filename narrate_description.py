@@ -1,173 +1,451 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-import json
+from fastapi import APIRouter, WebSocket
 import asyncio
+import base64
+import binascii
 import time
 
-from generate_description import generate_description
-from convert_text_to_speech import convert_text_to_speech, get_voice_statuses, get_voice_asset_status, is_tts_ready
+from generate_description import DESCRIPTION_ERROR, generate_description
+from description_history import DescriptionHistory
+from text_segmenter import TextSegmenter
+from frame_dedup import FrameDeduplicator, dhash
+from image_processing import prepare_image_for_vision, upload_config
+from audio_protocol import retag_frame
+from audio_encoder import available_formats, negotiate_format
+from connection_manager import NARRATE_SUPERSEDE, connection_manager
+from tts_engine import PRIORITY_CONTINUOUS, PRIORITY_INTERACTIVE, TTSRejectedError
+from gpu_client import gpu_warming, prewarm_gpu
+from startup import startup_state
+from tracing import current_trace, record_stage, start_trace
+from convert_text_to_speech import convert_segments_to_speech, get_voice_statuses, get_voice_asset_status, is_tts_ready
 
 router = APIRouter()
 
-description_history = []
+class NarrationSession:
+    """Per-connection state for /narrate."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        # Latest utterance ID drawn from the output this session narrates to
+        self.utterance_id = 0
+        # Utterance whose audio is currently being produced, if any
+        self.active_utterance = None
+        self.deduplicator = FrameDeduplicator()
+        # What this client has already been told, fed back to Claude as context
+        self.history = DescriptionHistory()
+        self.task = None
+
+    @property
+    def output(self):
+        """Where this client's narrations go: the room it owns, if any, else itself."""
+        return connection_manager.output_for(self.connection)
+
+    @property
+    def audio_format(self):
+        return self.output.audio_format
+
+    async def cancel_current(self):
+        """Cancel the in-flight narration (if any) and wait for it to unwind.
+
+        Returns (cancelled, utterance), where utterance is the ID whose audio
+        was cut short, or None if no audio had been started.
+        """
+        task = self.task
+        self.task = None
+        if task is None or task.done():
+            return False, None
+        utterance = self.active_utterance
+        task.cancel()
+        try:
+            await task
+        except (asyncio.CancelledError, Exception):
+            pass
+        self.active_utterance = None
+        return True, utterance
+
+
+async def narrate_image(output, session, data_json):
+    """Describe one image and stream the narration to output (a connection or room).
+
+    Runs as its own task so a newer frame (or a disconnect) can cancel it:
+    cancellation stops the Claude stream, drops queued/in-flight TTS jobs and
+    skips encoding of anything not yet produced.
+    """
+    trace = current_trace()
+    if data_json.get("receiveSeconds") is not None:
+        record_stage("receive", data_json["receiveSeconds"], bytes=len(data_json.get("imageBytes") or b""))
+    decode_start = time.perf_counter()
+    # Binary uploads carry raw bytes; legacy clients send base64 inside the JSON
+    image_bytes = data_json.get("imageBytes")
+    if image_bytes is None and data_json.get("image"):
+        try:
+            image_bytes = base64.b64decode(data_json["image"])
+        except (binascii.Error, ValueError):
+            image_bytes = None
+    selected_voice_name = data_json.get("voiceName")
+    selected_voice_label = data_json.get("voiceLabel", selected_voice_name)
+    politeness_level = int(data_json.get("politenessLevel", 5))
+    # Frames from an automatic capture loop queue behind photos someone is waiting on
+    priority = PRIORITY_CONTINUOUS if data_json.get("mode") == "continuous" else PRIORITY_INTERACTIVE
+    
+    if not image_bytes:
+        trace.status = "error"
+        await output.send_json({
+            "type": "error",
+            "data": "No image data received."
+        })
+        return
+
+    total_start = time.time()
+
+    # Unchanged scene (e.g. a static camera in continuous mode): skip it or
+    # replay the last narration instead of another vision call and TTS run
+    frame_hash = None
+    # Cached frames are only valid for listeners that negotiated the same format
+    dedup_context = (selected_voice_name, politeness_level, session.audio_format)
+    if session.deduplicator.enabled and data_json.get("dedup", True):
+        try:
+            frame_hash = await asyncio.get_event_loop().run_in_executor(None, dhash, image_bytes)
+        except Exception as e:
+            print(f"⚠️  Frame hash failed: {e}")
+        if session.deduplicator.is_duplicate(frame_hash, dedup_context):
+            print(f"🔁 Scene unchanged ({session.deduplicator.duplicates} duplicates so far), mode: {session.deduplicator.mode}", flush=True)
+            record_stage("decode", time.perf_counter() - decode_start)
+            if session.deduplicator.mode == "skip" or not session.deduplicator.audio_frames:
+                trace.status = "skipped"
+                await output.send_json({
+                    "type": "frame_skipped",
+                    "message": "Scene unchanged.",
+                    "detail": "Skipping this frame."
+                })
+                return
+            trace.status = "replayed"
+            session.utterance_id = output.next_utterance()
+            await output.send_json({
+                "type": "text_chunk",
+                "data": session.deduplicator.description,
+                "pictureCount": data_json.get("pictureCount"),
+                "voiceName": selected_voice_name,
+                "voiceLabel": selected_voice_label,
+                "replayed": True
+            })
+            for frame in session.deduplicator.audio_frames:
+                await output.send_bytes(retag_frame(frame, session.utterance_id))
+            await output.send_json({
+                "type": "status",
+                "message": "Audio ready.",
+                "detail": "Scene unchanged, replaying the last narration."
+            })
+            return
+
+    # Downscale/re-encode to what the vision model needs before it leaves the server
+    try:
+        image_data, media_type = await asyncio.get_event_loop().run_in_executor(None, prepare_image_for_vision, image_bytes)
+    except Exception as e:
+        print(f"⚠️  Could not decode image: {e}")
+        trace.status = "error"
+        await output.send_json({
+            "type": "error",
+            "data": "Could not read the image."
+        })
+        return
+
+    record_stage("decode", time.perf_counter() - decode_start)
+
+    print(f"🖼️ Image data received, sending to {selected_voice_name} model for analysis with politeness level {politeness_level}.")
+    await output.send_json({
+        "type": "status",
+        "message": "Analysing image...",
+        "detail": "Working on the description.",
+        "traceId": trace.trace_id
+    })
+    
+    # Description generation and TTS run as a pipeline: each sentence is
+    # handed to the TTS engine as soon as Claude finishes streaming it.
+    desc_start = time.time()
+    desc_time = 0.0
+    full_description = ""
+    description_failed = False
+    segmenter = TextSegmenter()
+    segment_queue = asyncio.Queue()
+
+    async def produce_description():
+        nonlocal full_description, desc_time, description_failed
+        try:
+            async for description_chunk in generate_description(image_data, selected_voice_name, session.history.recent(), politeness_level, media_type=media_type):
+                if description_chunk == DESCRIPTION_ERROR:
+                    description_failed = True
+                if description_chunk:
+                    full_description += description_chunk
+                    await output.send_json({
+                        "type": "text_chunk", 
+                        "data": description_chunk, 
+                        "pictureCount": data_json.get("pictureCount"), 
+                        "voiceName": selected_voice_name,
+                        "voiceLabel": selected_voice_label
+                    })
+                    for segment in segmenter.feed(description_chunk):
+                        segment_queue.put_nowait(segment)
+            tail = segmenter.flush()
+            if tail:
+                segment_queue.put_nowait(tail)
+        finally:
+            segment_queue.put_nowait(None)
+            desc_time = time.time() - desc_start
+            print(f"⏱️  Description generation: {desc_time:.2f}s", flush=True)
+
+    async def description_segments():
+        while True:
+            segment = await segment_queue.get()
+            if segment is None:
+                return
+            yield segment
+
+    description_task = asyncio.create_task(produce_description())
+    try:
+        voice_status = get_voice_asset_status(selected_voice_name)
+        if voice_status == "missing":
+            await output.send_json({
+                "type": "status",
+                "message": "Voice samples missing.",
+                "detail": "Using default voice for this request."
+            })
+
+        tts_start = time.time()
+        start_time = time.time()
+        tts_mode = "CPU"
+
+        async def status_cb(mode, detail):
+            nonlocal tts_mode
+            tts_mode = mode
+            await output.send_json({
+                "type": "status",
+                "message": f"TTS: {mode}",
+                "detail": detail
+            })
+
+        def progress_message():
+            elapsed = int(time.time() - start_time)
+            return {
+                "type": "status",
+                "message": "Generating voice...",
+                "detail": f"Elapsed: {elapsed}s | Mode: {tts_mode}" + (" (GPU starting up)" if tts_mode == "GPU" and gpu_warming() else "")
+            }
+
+        # One shared 1 Hz ticker serves every narration in progress
+        progress = connection_manager.track_progress(output, progress_message)
+        session.utterance_id = output.next_utterance()
+        session.active_utterance = session.utterance_id
+        sent_frames = []
+        send_seconds = 0.0
+        try:
+            audio_chunks = convert_segments_to_speech(
+                description_segments(),
+                selected_voice_name,
+                status_cb=status_cb,
+                utterance=session.utterance_id,
+                priority=priority,
+                audio_format=session.audio_format
+            )
+            async for chunk in audio_chunks:
+                # Audio is flowing; the elapsed-time ticker is no longer useful
+                connection_manager.untrack_progress(progress)
+                send_start = time.perf_counter()
+                await output.send_bytes(chunk)
+                send_seconds += time.perf_counter() - send_start
+                if not sent_frames:
+                    record_stage("first_audio", time.time() - total_start)
+                sent_frames.append(chunk)
+        finally:
+            if sent_frames:
+                record_stage("send", send_seconds, frames=len(sent_frames))
+            session.active_utterance = None
+            connection_manager.untrack_progress(progress)
+        await description_task
+        tts_time = time.time() - tts_start
+        print(f"⏱️  TTS conversion (overlapped with description): {tts_time:.2f}s", flush=True)
+        
+        total_time = time.time() - total_start
+        print(f"⏱️  TOTAL PROCESSING TIME: {total_time:.2f}s (Description: {desc_time:.2f}s, TTS: {tts_time:.2f}s)", flush=True)
+        
+        if sent_frames:
+            await output.send_json({
+                "type": "status",
+                "message": "Audio ready.",
+                "detail": "Playing now."
+            })
+        else:
+            # Synthesis failures are logged and swallowed upstream; the client still needs an ending
+            trace.status = "error"
+            await output.send_json({
+                "type": "error",
+                "data": "Error processing audio"
+            })
+        # The error fallback is neither context for Claude nor a narration to replay
+        if full_description.strip() and not description_failed:
+            session.history.add(full_description)
+            if sent_frames:
+                session.deduplicator.remember(frame_hash, dedup_context, full_description.strip(), sent_frames)
+    except TTSRejectedError as e:
+        print(f"🚦 TTS busy: {e}")
+        trace.status = "busy"
+        await output.send_json({
+            "type": "error",
+            "data": "Server is busy, please try again in a moment."
+        })
+    except Exception as e:
+        print(f"Error processing audio: {e}")
+        trace.status = "error"
+        await output.send_json({
+            "type": "error",
+            "data": "Error processing audio"
+        })
+    finally:
+        if not description_task.done():
+            description_task.cancel()
+            try:
+                await description_task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+    total_time = time.time() - total_start
+    print(f"✅ Finished processing image data. Total time: {total_time:.2f}s", flush=True)
 
 @router.websocket_route("/narrate")
 async def websocket_narrate(websocket: WebSocket):
     await websocket.accept()
     print("WebSocket connection accepted.")
+    # Start a GPU container while the user is still pointing the camera
+    prewarm_gpu()
     print("connection open")
+    # Receiving and sending run in the connection's own tasks; this loop only dispatches
+    connection = connection_manager.connect(websocket)
 
-    try:
-        await websocket.send_text(json.dumps({
-            "type": "voice_status",
-            "data": get_voice_statuses()
-        }))
-        await websocket.send_text(json.dumps({
-            "type": "server_ready",
-            "ready": is_tts_ready()
-        }))
-        await websocket.send_text(json.dumps({
-            "type": "status",
-            "message": "Ready for a new image.",
-            "detail": "All voices have been checked for availability."
-        }))
-    except Exception:
-        pass
+    await connection.send_json({
+        "type": "voice_status",
+        "data": get_voice_statuses()
+    })
+    await connection.send_json({
+        "type": "server_ready",
+        "ready": is_tts_ready(),
+        "startup": startup_state.snapshot()
+    })
+    await connection.send_json({
+        "type": "upload_config",
+        "data": upload_config()
+    })
+    await connection.send_json({
+        "type": "status",
+        "message": "Ready for a new image.",
+        "detail": "All voices have been checked for availability."
+    })
     
+    # Push start-up progress (model loading, warm-up) to this client as it changes
+    async def on_startup_change(snapshot):
+        await connection.send_json({
+            "type": "server_ready",
+            "ready": snapshot["ready"],
+            "startup": snapshot
+        })
+        if snapshot["ready"]:
+            await connection.send_json({
+                "type": "voice_status",
+                "data": get_voice_statuses()
+            })
+
+    startup_state.subscribe(on_startup_change)
+    session = NarrationSession(connection)
+    # Observers open /narrate?room=<token> to hear the owner's narrations
+    if websocket.query_params.get("room"):
+        await connection_manager.join_room(connection, websocket.query_params["room"])
     try:
         while True:
+            kind, data_json = await connection.next_message()
             try:
-                data = await websocket.receive_text()
-                if data == "close":
+                if kind == "disconnect":
+                    print("Client disconnected")
+                    break
+                if kind == "close":
                     print("Closing WebSocket connection.")
-                    await websocket.close(code=1000)
                     break
 
-                data_json = json.loads(data)
-                image_data = data_json.get("image")
-                selected_voice_name = data_json.get("voiceName")
-                selected_voice_label = data_json.get("voiceLabel", selected_voice_name)
-                politeness_level = int(data_json.get("politenessLevel", 5))
-                
-                if not image_data:
-                    await websocket.send_text(json.dumps({
-                        "type": "error",
-                        "data": "No image data received."
-                    }))
+                if kind == "control":
+                    if data_json.get("type") == "audio_formats":
+                        connection.accepted_formats = data_json.get("accept")
+                        connection.audio_format = negotiate_format(connection.accepted_formats)
+                        await connection.send_json({
+                            "type": "audio_format",
+                            "format": connection.audio_format,
+                            "available": available_formats()
+                        })
+                    elif data_json.get("type") == "create_room":
+                        await connection_manager.create_room(connection)
+                    elif data_json.get("type") == "join_room":
+                        await connection_manager.join_room(connection, data_json.get("room"))
+                    elif data_json.get("type") == "leave_room":
+                        await connection_manager.leave_room(connection)
                     continue
 
-                total_start = time.time()
-                print(f"🖼️ Image data received, sending to {selected_voice_name} model for analysis with politeness level {politeness_level}.")
-                await websocket.send_text(json.dumps({
-                    "type": "status",
-                    "message": "Analysing image...",
-                    "detail": "Working on the description."
-                }))
-                
-                # Time description generation
-                desc_start = time.time()
-                full_description = ""
-                async for description_chunk in generate_description(image_data, selected_voice_name, description_history, politeness_level):
-                    if description_chunk:
-                        full_description += description_chunk
-                        await websocket.send_text(json.dumps({
-                            "type": "text_chunk", 
-                            "data": description_chunk, 
-                            "pictureCount": data_json.get("pictureCount"), 
-                            "voiceName": selected_voice_name,
-                            "voiceLabel": selected_voice_label
-                        }))
-                desc_time = time.time() - desc_start
-                print(f"⏱️  Description generation: {desc_time:.2f}s", flush=True)
-                
-                # Generate audio for complete description
-                if full_description.strip():
-                    try:
-                        voice_status = get_voice_asset_status(selected_voice_name)
-                        if voice_status == "missing":
-                            await websocket.send_text(json.dumps({
-                                "type": "status",
-                                "message": "Voice samples missing.",
-                                "detail": "Using default voice for this request."
-                            }))
-
-                        tts_start = time.time()
-                        start_time = time.time()
-                        tts_mode = "CPU"
-
-                        async def status_cb(mode, detail):
-                            nonlocal tts_mode
-                            tts_mode = mode
-                            await websocket.send_text(json.dumps({
-                                "type": "status",
-                                "message": f"TTS: {mode}",
-                                "detail": detail
-                            }))
-
-                        async def progress_updates():
-                            while True:
-                                elapsed = int(time.time() - start_time)
-                                await websocket.send_text(json.dumps({
-                                    "type": "status",
-                                    "message": "Generating voice...",
-                                    "detail": f"Elapsed: {elapsed}s | Mode: {tts_mode} (2–3 mins warm-up time, then good to go!)"
-                                }))
-                                await asyncio.sleep(1)
-
-                        progress_task = asyncio.create_task(progress_updates())
+                # Latest frame wins: a new image supersedes the narration still in progress
+                if session.task is not None and not session.task.done():
+                    if NARRATE_SUPERSEDE:
+                        cancelled, utterance = await session.cancel_current()
+                        if cancelled:
+                            print("⏭️  Superseded in-flight narration with a newer frame", flush=True)
+                        if utterance is not None:
+                            await session.output.send_json({
+                                "type": "superseded",
+                                "utterance": utterance & 0xFFFF
+                            })
+                    else:
                         try:
-                            audio_chunks = convert_text_to_speech(
-                                full_description.strip(),
-                                selected_voice_name,
-                                status_cb=status_cb
-                            )
-                            async for chunk in audio_chunks:
-                                await websocket.send_bytes(chunk)
-                        finally:
-                            progress_task.cancel()
-                            try:
-                                await progress_task
-                            except asyncio.CancelledError:
-                                pass
-                        tts_time = time.time() - tts_start
-                        print(f"⏱️  TTS conversion: {tts_time:.2f}s", flush=True)
-                        
-                        total_time = time.time() - total_start
-                        print(f"⏱️  TOTAL PROCESSING TIME: {total_time:.2f}s (Description: {desc_time:.2f}s, TTS: {tts_time:.2f}s)", flush=True)
-                        
-                        await websocket.send_text(json.dumps({
-                            "type": "status",
-                            "message": "Audio ready.",
-                            "detail": "Playing now."
-                        }))
-                        description_history.append(full_description.strip())
-                    except Exception as e:
-                        print(f"Error processing audio: {e}")
-                        await websocket.send_text(json.dumps({
-                            "type": "error",
-                            "data": "Error processing audio"
-                        }))
-
-                total_time = time.time() - total_start
-                print(f"✅ Finished processing image data. Total time: {total_time:.2f}s", flush=True)
-
-            except WebSocketDisconnect:
-                print("Client disconnected")
-                break
+                            await session.task
+                        except Exception:
+                            pass
+
+                session.task = asyncio.create_task(_run_narration(session, data_json))
+
             except Exception as e:
                 print(f"Error processing message: {e}")
-                try:
-                    await websocket.send_text(json.dumps({
-                        "type": "error",
-                        "data": "Error processing message"
-                    }))
-                except:
-                    break
+                await connection.send_json({
+                    "type": "error",
+                    "data": "Error processing message"
+                })
 
-    except Exception as e:
-        print(f"Error during WebSocket communication: {e}")
     finally:
+        startup_state.unsubscribe(on_startup_change)
+        # Nobody is listening any more; stop burning CPU on this connection's work
+        cancelled, _ = await session.cancel_current()
+        if cancelled:
+            print("✋ Cancelled narration for closed connection", flush=True)
+        await connection_manager.disconnect(connection)
         print("connection closed")
         try:
             await websocket.close(code=1000)
         except:
             pass
+
+
+async def _run_narration(session, data_json):
+    output = session.output
+    # Runs in its own task, so the trace is current for everything this narration does
+    trace = start_trace(
+        "narrate",
+        voice=data_json.get("voiceName"),
+        politeness=data_json.get("politenessLevel"),
+        picture=data_json.get("pictureCount"),
+        audio_format=session.audio_format,
+    )
+    try:
+        await narrate_image(output, session, data_json)
+    except asyncio.CancelledError:
+        trace.status = "cancelled"
+        raise
+    except Exception as e:
+        trace.status = "error"
+        print(f"Error processing message: {e}")
+        await output.send_json({
+            "type": "error",
+            "data": "Error processing message"
+        })
+    finally:
+        trace.finish()
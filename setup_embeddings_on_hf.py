@@ -1,45 +1,50 @@
 """
-Auto-run on first launch: Generate voice embeddings from Voice_Files
-Runs automatically when main.py detects Voice_Files folder
+Build voice embeddings from Voice_Files.
+
+Incremental and parallel:
+- Reference clips are decoded and resampled to 22.05 kHz in a process pool.
+  The decoded clips are cached under EMBEDDING_CLIP_CACHE_DIR, keyed by the
+  source file's content hash.
+- voice_embeddings/manifest.json records the source hashes and settings each
+  embedding was built from. Only voices whose sources changed (or that have
+  no embedding yet) are recomputed, and the XTTS model is only loaded if
+  there is something to compute.
+
+    python setup_embeddings_on_hf.py            # build new/changed voices
+    python setup_embeddings_on_hf.py --force    # rebuild every voice
 """
 
+import hashlib
+import json
 import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 # Auto-agree to Coqui license for non-commercial use (MUST be before TTS import)
 os.environ["COQUI_TOS_AGREED"] = "1"
 
-import torch
-import torchaudio
-import soundfile as sf
-import librosa
-from TTS.api import TTS
-
-def _safe_audio_load(path):
-    """Fallback loader to avoid torchcodec/ffmpeg dependency."""
-    if not os.path.isfile(path):
-        raise FileNotFoundError(f"Missing audio file: {path}")
-    ext = os.path.splitext(path)[1].lower()
-    if ext in [".wav", ".flac", ".ogg"]:
-        data, sr = sf.read(path, always_2d=True)
-        data = torch.from_numpy(data.T).float()
-        return data, sr
-    audio, sr = librosa.load(path, sr=None, mono=False)
-    if audio.ndim == 1:
-        audio = audio[None, :]
-    data = torch.from_numpy(audio).float()
-    return data, sr
-
-torchaudio.load = _safe_audio_load
-
-GENERATE_MISSING_ONLY = True
-
-print("\nLoading XTTS model...")
-from TTS.api import TTS
-tts = TTS("tts_models/multilingual/multi-dataset/xtts_v2")
-model = tts.synthesizer.tts_model
-print("Model loaded")
-
-os.makedirs("voice_embeddings", exist_ok=True)
+import numpy as np
+
+from embedding_pack import convert_pth_dir
+
+EMBEDDINGS_DIR = "voice_embeddings"
+MANIFEST_PATH = os.path.join(EMBEDDINGS_DIR, "manifest.json")
+# Decoded reference clips, reused across runs and voices
+CLIP_CACHE_DIR = os.getenv("EMBEDDING_CLIP_CACHE_DIR", "embedding_cache")
+BUILD_WORKERS = int(os.getenv("EMBEDDING_BUILD_WORKERS", str(os.cpu_count() or 2)))
+# XTTS computes its GPT conditioning at 22.05 kHz
+CLIP_SAMPLE_RATE = 22050
+MAX_REFERENCE_FILES = 3
+AUDIO_EXTENSIONS = ('.mp3', '.mp4', '.wav', '.m4a')
+
+# Anything here changes the embedding, so it is part of the manifest
+LATENT_SETTINGS = {
+    "gpt_cond_len": 30,
+    "gpt_cond_chunk_len": 4,
+    "max_ref_length": 60,
+    "sample_rate": CLIP_SAMPLE_RATE,
+}
 
 # Voice mapping
 voice_folders = {
@@ -54,60 +59,177 @@ voice_folders = {
     "Stephen Fry": "Voice_Files/Stephen Fry"
 }
 
-print(f"\nProcessing {len(voice_folders)} voices...")
 
-for voice_name, folder_path in voice_folders.items():
-    print(f"\n{voice_name}...", end=" ")
-    
-    safe_name = voice_name.replace(" ", "_")
-    gpt_path = f"voice_embeddings/{safe_name}_gpt.pth"
-    speaker_path = f"voice_embeddings/{safe_name}_speaker.pth"
-
-    if GENERATE_MISSING_ONLY and os.path.exists(gpt_path) and os.path.exists(speaker_path):
-        print("already exists")
-        continue
-
-    if not os.path.exists(folder_path):
-        print("folder not found")
-        continue
-    
-    audio_files = []
-    for ext in ['.mp3', '.mp4', '.wav', '.m4a']:
-        audio_files.extend([
-            os.path.join(folder_path, f) 
-            for f in os.listdir(folder_path) 
-            if f.lower().endswith(ext)
-        ])
-    
-    if not audio_files:
-        print("no audio files")
-        continue
-    
-    audio_files = audio_files[:3]
-    
+def reference_files(folder_path):
+    files = sorted(f for f in os.listdir(folder_path) if f.lower().endswith(AUDIO_EXTENSIONS))
+    return [os.path.join(folder_path, f) for f in files[:MAX_REFERENCE_FILES]]
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def clip_cache_path(content_hash):
+    return os.path.join(CLIP_CACHE_DIR, f"{content_hash}_{CLIP_SAMPLE_RATE}.npy")
+
+
+def decode_clip(path, content_hash):
+    """Decode one reference file to mono float32 at CLIP_SAMPLE_RATE (runs in the pool)."""
+    cache_path = clip_cache_path(content_hash)
+    if os.path.exists(cache_path):
+        return cache_path
+    import librosa
+
+    audio, _ = librosa.load(path, sr=CLIP_SAMPLE_RATE, mono=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp.npy"
+    np.save(tmp_path, audio.astype(np.float32))
+    os.replace(tmp_path, cache_path)
+    return cache_path
+
+
+def load_manifest():
     try:
-        gpt_cond_latent, speaker_embedding = model.get_conditioning_latents(
-            audio_path=audio_files,
-            gpt_cond_len=30,
-            gpt_cond_chunk_len=4,
-            max_ref_length=60
-        )
-        
-        torch.save(gpt_cond_latent, f"voice_embeddings/{safe_name}_gpt.pth")
-        torch.save(speaker_embedding, f"voice_embeddings/{safe_name}_speaker.pth")
-        
-        with open(f"voice_embeddings/{safe_name}_info.txt", "w") as f:
-            f.write(f"{voice_name}\n{len(audio_files)} files\n")
-        
-        print("done")
-        
-    except Exception as e:
-        print(f"error: {str(e)}")
-
-print("\n" + "=" * 50)
-print("COMPLETE!")
-embedding_count = len([f for f in os.listdir("voice_embeddings") if f.endswith("_gpt.pth")])
-print(f"{embedding_count} embeddings created")
-print("\nChange startup to: python main.py")
-print("=" * 50)
+        with open(MANIFEST_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"voices": {}}
+
+
+def save_manifest(manifest):
+    tmp_path = f"{MANIFEST_PATH}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+
+def embedding_paths(voice_name):
+    safe_name = voice_name.replace(" ", "_")
+    return (
+        os.path.join(EMBEDDINGS_DIR, f"{safe_name}_gpt.pth"),
+        os.path.join(EMBEDDINGS_DIR, f"{safe_name}_speaker.pth"),
+    )
+
+
+def plan_build(manifest, force=False):
+    """Return {voice name: {path: content hash}} for voices that need (re)computing."""
+    sources = {}
+    for voice_name, folder_path in voice_folders.items():
+        if not os.path.exists(folder_path):
+            print(f"{voice_name}: folder not found")
+            continue
+        files = reference_files(folder_path)
+        if not files:
+            print(f"{voice_name}: no audio files")
+            continue
+        sources[voice_name] = files
+
+    all_files = [path for files in sources.values() for path in files]
+    with ProcessPoolExecutor(max_workers=BUILD_WORKERS) as pool:
+        hashes = dict(zip(all_files, pool.map(hash_file, all_files)))
+
+    to_build = {}
+    for voice_name, files in sources.items():
+        file_hashes = {path: hashes[path] for path in files}
+        record = {
+            "files": {os.path.basename(path): digest for path, digest in file_hashes.items()},
+            "settings": LATENT_SETTINGS,
+        }
+        previous = manifest["voices"].get(voice_name)
+        has_embedding = all(os.path.exists(path) for path in embedding_paths(voice_name))
+
+        if not force and has_embedding and previous is None:
+            # Built before the manifest existed: adopt it rather than recompute
+            manifest["voices"][voice_name] = dict(record, built_at=None)
+            print(f"{voice_name}: existing embedding adopted into manifest")
+        elif not force and has_embedding and {k: previous.get(k) for k in record} == record:
+            print(f"{voice_name}: up to date")
+        else:
+            to_build[voice_name] = file_hashes
+    return to_build
+
+
+def _install_clip_loader():
+    """Make XTTS read reference audio from the decoded clip cache."""
+    import torch
+    import torchaudio
+
+    cached_clips = {}
+    original_load = torchaudio.load
+
+    def _cached_audio_load(path, *args, **kwargs):
+        if path in cached_clips:
+            audio = np.load(cached_clips[path])
+            return torch.from_numpy(audio)[None, :], CLIP_SAMPLE_RATE
+        return original_load(path, *args, **kwargs)
+
+    torchaudio.load = _cached_audio_load
+    return cached_clips
+
+
+def build_embeddings(force=False):
+    os.makedirs(EMBEDDINGS_DIR, exist_ok=True)
+    os.makedirs(CLIP_CACHE_DIR, exist_ok=True)
+    manifest = load_manifest()
+    started = time.time()
+
+    to_build = plan_build(manifest, force=force)
+    save_manifest(manifest)
+    if not to_build:
+        print("\nAll embeddings up to date")
+        return 0
+
+    jobs = [(path, digest) for file_hashes in to_build.values() for path, digest in file_hashes.items()]
+    print(f"\nDecoding {len(jobs)} reference clips with {BUILD_WORKERS} workers...")
+    with ProcessPoolExecutor(max_workers=BUILD_WORKERS) as pool:
+        decoded = dict(zip((path for path, _ in jobs), pool.map(decode_clip, *zip(*jobs))))
+    print(f"Decoded in {time.time() - started:.1f}s")
+
+    import torch
+
+    cached_clips = _install_clip_loader()
+    cached_clips.update(decoded)
+
+    print("\nLoading XTTS model...")
+    from TTS.api import TTS
+    model = TTS("tts_models/multilingual/multi-dataset/xtts_v2").synthesizer.tts_model
+    print("Model loaded")
+
+    built = 0
+    for voice_name, file_hashes in to_build.items():
+        print(f"\n{voice_name}...", end=" ")
+        try:
+            gpt_cond_latent, speaker_embedding = model.get_conditioning_latents(
+                audio_path=list(file_hashes),
+                gpt_cond_len=LATENT_SETTINGS["gpt_cond_len"],
+                gpt_cond_chunk_len=LATENT_SETTINGS["gpt_cond_chunk_len"],
+                max_ref_length=LATENT_SETTINGS["max_ref_length"],
+            )
+            gpt_path, speaker_path = embedding_paths(voice_name)
+            torch.save(gpt_cond_latent, gpt_path)
+            torch.save(speaker_embedding, speaker_path)
+            manifest["voices"][voice_name] = {
+                "files": {os.path.basename(path): digest for path, digest in file_hashes.items()},
+                "settings": LATENT_SETTINGS,
+                "built_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            }
+            save_manifest(manifest)
+            built += 1
+            print("done")
+        except Exception as e:
+            print(f"error: {str(e)}")
+
+    print(f"\nBuilt {built}/{len(to_build)} embeddings in {time.time() - started:.1f}s")
+    return built
+
 
+if __name__ == "__main__":
+    build_embeddings(force="--force" in sys.argv[1:])
+    print("\n" + "=" * 50)
+    print("COMPLETE!")
+    print(f"{len(load_manifest()['voices'])} voices in {MANIFEST_PATH}")
+    convert_pth_dir(EMBEDDINGS_DIR)
+    print("=" * 50)
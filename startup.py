@@ -0,0 +1,117 @@
+"""
+Background start-up of the TTS stack.
+
+The app starts serving the UI and /health immediately; voice embeddings and
+the XTTS model (or worker processes) load in a background task. Progress is
+kept in a StartupState that /health reports and that /narrate connections
+subscribe to, so clients hear about readiness changes as they happen.
+"""
+
+import asyncio
+import os
+import time
+
+from convert_text_to_speech import TTS_LOCAL, get_tts_model, is_tts_ready, preload_all_embeddings
+from tts_engine import get_tts_engine
+
+# Give up on worker processes that have not reported ready after this long
+TTS_STARTUP_TIMEOUT = float(os.getenv("TTS_STARTUP_TIMEOUT", "900"))
+
+
+class StartupState:
+    """Current start-up stage plus the listeners to notify when it changes."""
+
+    def __init__(self):
+        self.stage = "starting"
+        self.detail = "Starting server"
+        self.progress = 0.0
+        self.ready = False
+        self.error = None
+        self.started_at = time.time()
+        self.ready_at = None
+        self._listeners = set()
+
+    def snapshot(self):
+        return {
+            "ready": self.ready,
+            "stage": self.stage,
+            "detail": self.detail,
+            "progress": round(self.progress, 2),
+            "error": self.error,
+            "elapsed": round((self.ready_at or time.time()) - self.started_at, 1),
+        }
+
+    def subscribe(self, callback):
+        """Register an async callback(snapshot) for stage changes."""
+        self._listeners.add(callback)
+
+    def unsubscribe(self, callback):
+        self._listeners.discard(callback)
+
+    def update(self, stage, detail, progress, ready=None, error=None):
+        self.stage = stage
+        self.detail = detail
+        self.progress = progress
+        if ready is not None:
+            self.ready = ready
+            if ready:
+                self.ready_at = time.time()
+        self.error = error
+        print(f"🚀 Startup: {stage} ({progress:.0%}) - {detail}", flush=True)
+        snapshot = self.snapshot()
+        for callback in list(self._listeners):
+            asyncio.ensure_future(self._notify(callback, snapshot))
+
+    async def _notify(self, callback, snapshot):
+        try:
+            await callback(snapshot)
+        except Exception:
+            # A closed socket unsubscribes itself in its own finally block
+            pass
+
+
+startup_state = StartupState()
+
+
+async def load_tts_in_background():
+    """Load embeddings and the TTS engine without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    try:
+        engine = get_tts_engine()
+        startup_state.update("loading_embeddings", "Loading voice embeddings", 0.1)
+        await loop.run_in_executor(None, preload_all_embeddings)
+
+        if not TTS_LOCAL:
+            if is_tts_ready():
+                startup_state.update("ready", "Ready (GPU service only)", 1.0, ready=True)
+            else:
+                startup_state.update("failed", "TTS_LOCAL=0 needs a GPU service URL", 1.0, ready=False, error="No MODAL_API_URL or GPU_TTS_API_URL set")
+            return
+        if engine.uses_processes:
+            startup_state.update("starting_workers", f"Starting {engine.worker_count} TTS worker process(es)", 0.3)
+            engine.start()
+            # Workers load and warm their own models; wait for the first to report in
+            deadline = time.time() + TTS_STARTUP_TIMEOUT
+            while not is_tts_ready():
+                if engine.all_workers_failed:
+                    startup_state.update("failed", "TTS workers failed to load", 1.0, ready=False, error="Every TTS worker failed to load its model")
+                    return
+                if time.time() > deadline:
+                    startup_state.update("failed", "TTS workers did not start in time", 1.0, ready=False, error=f"No TTS worker ready after {TTS_STARTUP_TIMEOUT:.0f}s")
+                    return
+                await asyncio.sleep(0.5)
+        else:
+            startup_state.update("loading_model", "Loading XTTS model", 0.3)
+            await loop.run_in_executor(None, get_tts_model)
+            startup_state.update("warming_up", "Warming up XTTS", 0.8)
+            await loop.run_in_executor(None, engine.start)
+
+        if is_tts_ready():
+            startup_state.update("ready", "Ready", 1.0, ready=True)
+        else:
+            startup_state.update("degraded", "TTS warm-up failed; narration may be slow", 1.0, ready=False)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        print(f"Failed to pre-load: {e}")
+        startup_state.update("failed", "TTS failed to load", 1.0, ready=False, error=str(e))
@@ -48,6 +48,10 @@ const RECONNECT_DELAY = 2000;
 let serverStatus = 'offline';
 let serverReady = false;
 let pendingCapture = false;
+let serverStartup = null;
+// Replaced by the server's "upload_config" message on connect
+let uploadConfig = { binary: false, maxDimension: 1280, quality: 0.92, mimeTypes: ['image/jpeg'] };
+let supportsWebp = null;
 
 function stopCurrentVideoStream() {
     if (currentStream) {
@@ -92,9 +96,212 @@ getCameras();
 
 document.getElementById('toggle-camera-btn').addEventListener('click', switchCamera);
 
+// Ask the server for a room; anyone given its link hears this page's narrations
+document.getElementById('share-btn').addEventListener('click', () => {
+    if (ws && ws.readyState === WebSocket.OPEN) {
+        ws.send(JSON.stringify({ type: 'create_room' }));
+    }
+});
+
+function showRoomLink(room) {
+    const link = `${window.location.origin}${window.location.pathname}?room=${encodeURIComponent(room)}`;
+    const feedbackElement = document.getElementById('feedback');
+    const p = document.createElement('p');
+    p.innerHTML = `<strong>Share this link to let others listen:</strong> <a href="${link}">${link}</a>`;
+    feedbackElement.appendChild(p);
+    feedbackElement.scrollTop = feedbackElement.scrollHeight;
+    if (navigator.clipboard) {
+        navigator.clipboard.writeText(link).catch(() => {
+            // Clipboard access denied; the link is on the page
+        });
+    }
+}
+
+// Binary audio frames: kind (u8) | format (u8) | utterance (u16) | sequence (u32), little-endian
+const FRAME_HEADER_SIZE = 8;
+const FRAME_AUDIO = 1;
+const FRAME_END = 2;
+const FORMAT_MP3 = 1;
+const FORMAT_WAV = 2;
+const FORMAT_PCM16 = 3;
+const FORMAT_OPUS = 4;
+const PCM_SAMPLE_RATE = 24000;
+const OPUS_MIME_TYPE = 'audio/webm; codecs="opus"';
+
+let audioContext = null;
+let pcmPlayhead = 0;
+let pcmSources = [];
+const supersededUtterances = new Set();
+// Utterance -> MediaSource playback state for WebM/Opus streams
+const opusStreams = new Map();
+
+function getAudioContext() {
+    if (!audioContext) {
+        const AudioContextClass = window.AudioContext || window.webkitAudioContext;
+        if (!AudioContextClass) {
+            return null;
+        }
+        audioContext = new AudioContextClass();
+    }
+    if (audioContext.state === 'suspended') {
+        audioContext.resume();
+    }
+    return audioContext;
+}
+
+function playPcmChunk(payload, utterance) {
+    const context = getAudioContext();
+    if (!context) {
+        return;
+    }
+    const samples = new Int16Array(payload.slice(0));
+    const buffer = context.createBuffer(1, samples.length, PCM_SAMPLE_RATE);
+    const channel = buffer.getChannelData(0);
+    for (let i = 0; i < samples.length; i++) {
+        channel[i] = samples[i] / 32768;
+    }
+    const source = context.createBufferSource();
+    source.buffer = buffer;
+    source.connect(context.destination);
+    // Schedule back-to-back so consecutive chunks play without gaps
+    const startAt = Math.max(context.currentTime + 0.05, pcmPlayhead);
+    source.start(startAt);
+    pcmPlayhead = startAt + buffer.duration;
+    const entry = { source: source, utterance: utterance };
+    pcmSources.push(entry);
+    source.onended = () => {
+        pcmSources = pcmSources.filter(item => item !== entry);
+    };
+    hideLoadingPopup();
+}
+
+// Preference order sent to the server; it picks the first one it can encode
+function supportedAudioFormats() {
+    const formats = [];
+    if (window.MediaSource && MediaSource.isTypeSupported(OPUS_MIME_TYPE)) {
+        formats.push('opus');
+    }
+    formats.push('pcm16');
+    return formats;
+}
+
+function getOpusStream(utterance) {
+    let entry = opusStreams.get(utterance);
+    if (entry) {
+        return entry;
+    }
+    const mediaSource = new MediaSource();
+    const audio = new Audio();
+    audio.setAttribute('playsinline', '');
+    audio.setAttribute('webkit-playsinline', '');
+    entry = { audio: audio, mediaSource: mediaSource, sourceBuffer: null, pending: [], ended: false, url: URL.createObjectURL(mediaSource) };
+    opusStreams.set(utterance, entry);
+    mediaSource.addEventListener('sourceopen', () => {
+        entry.sourceBuffer = mediaSource.addSourceBuffer(OPUS_MIME_TYPE);
+        entry.sourceBuffer.addEventListener('updateend', () => flushOpusStream(entry));
+        flushOpusStream(entry);
+    });
+    audio.onplaying = () => {
+        hideLoadingPopup();
+    };
+    audio.onended = () => {
+        closeOpusStream(utterance);
+    };
+    audio.src = entry.url;
+    audio.play().catch(() => {
+        // Starts once enough data has been appended
+    });
+    return entry;
+}
+
+function flushOpusStream(entry) {
+    const sourceBuffer = entry.sourceBuffer;
+    if (!sourceBuffer || sourceBuffer.updating) {
+        return;
+    }
+    if (entry.pending.length > 0) {
+        sourceBuffer.appendBuffer(entry.pending.shift());
+        return;
+    }
+    if (entry.ended && entry.mediaSource.readyState === 'open') {
+        entry.mediaSource.endOfStream();
+    }
+}
+
+function playOpusChunk(payload, utterance) {
+    const entry = getOpusStream(utterance);
+    entry.pending.push(payload);
+    flushOpusStream(entry);
+}
+
+function endOpusStream(utterance) {
+    const entry = opusStreams.get(utterance);
+    if (entry) {
+        entry.ended = true;
+        flushOpusStream(entry);
+    }
+}
+
+function closeOpusStream(utterance) {
+    const entry = opusStreams.get(utterance);
+    if (!entry) {
+        return;
+    }
+    entry.audio.pause();
+    URL.revokeObjectURL(entry.url);
+    opusStreams.delete(utterance);
+}
+
+// The server cancelled this narration in favour of a newer frame: drop its audio
+function dropUtterance(utterance) {
+    supersededUtterances.add(utterance);
+    closeOpusStream(utterance);
+    audioQueue = audioQueue.filter(item => item.utterance !== utterance);
+    pcmSources.forEach(item => {
+        if (item.utterance === utterance) {
+            try {
+                item.source.stop();
+            } catch (error) {
+                // Already stopped
+            }
+        }
+    });
+    pcmSources = pcmSources.filter(item => item.utterance !== utterance);
+    if (pcmSources.length === 0 && audioContext) {
+        pcmPlayhead = audioContext.currentTime;
+    }
+}
+
 function playAudio(arrayBuffer) {
-    const blob = new Blob([arrayBuffer], { type: 'audio/mp3' });
-    audioQueue.push(blob);
+    if (arrayBuffer.byteLength < FRAME_HEADER_SIZE) {
+        return;
+    }
+    const header = new DataView(arrayBuffer, 0, FRAME_HEADER_SIZE);
+    const kind = header.getUint8(0);
+    const format = header.getUint8(1);
+    const utterance = header.getUint16(2, true);
+    if (supersededUtterances.has(utterance)) {
+        return;
+    }
+    if (kind === FRAME_END) {
+        endOpusStream(utterance);
+        return;
+    }
+    if (kind !== FRAME_AUDIO) {
+        return;
+    }
+    const payload = arrayBuffer.slice(FRAME_HEADER_SIZE);
+    if (format === FORMAT_PCM16) {
+        playPcmChunk(payload, utterance);
+        return;
+    }
+    if (format === FORMAT_OPUS) {
+        playOpusChunk(payload, utterance);
+        return;
+    }
+    const type = format === FORMAT_WAV ? 'audio/wav' : 'audio/mp3';
+    const blob = new Blob([payload], { type: type });
+    audioQueue.push({ blob: blob, utterance: utterance });
     if (!isPlaying) {
         playNextAudio();
     }
@@ -103,7 +310,7 @@ function playAudio(arrayBuffer) {
 function playNextAudio() {
     if (audioQueue.length > 0) {
         isPlaying = true;
-        const url = URL.createObjectURL(audioQueue.shift());
+        const url = URL.createObjectURL(audioQueue.shift().blob);
         const audio = new Audio();
         audio.setAttribute('playsinline', '');
         audio.setAttribute('webkit-playsinline', '');
@@ -199,43 +406,88 @@ function captureAndAnalyseImage() {
     }
 
     showLoadingPopup("Analysing image...", "Generating description with AI");
+    // Created inside the click handler so browsers allow audio playback
+    getAudioContext();
 
+    // Downscale to the server's advertised limit before encoding
+    const sourceWidth = cameraFeedElement.videoWidth;
+    const sourceHeight = cameraFeedElement.videoHeight;
+    const scale = Math.min(1, uploadConfig.maxDimension / Math.max(sourceWidth, sourceHeight, 1));
     const canvas = document.createElement('canvas');
-    canvas.width = cameraFeedElement.videoWidth;
-    canvas.height = cameraFeedElement.videoHeight;
+    canvas.width = Math.round(sourceWidth * scale);
+    canvas.height = Math.round(sourceHeight * scale);
     const ctx = canvas.getContext('2d');
     ctx.drawImage(cameraFeedElement, 0, 0, canvas.width, canvas.height);
-    const imageDataUrl = canvas.toDataURL('image/jpeg');
 
     pictureCount++;
     document.getElementById('picture-counter').textContent = `Pictures taken: ${pictureCount}`;
 
+    const message = {
+        voiceId: selectedVoiceId,
+        voiceName: selectedVoiceName,
+        voiceLabel: selectedVoiceLabel,
+        pictureCount: pictureCount,
+        politenessLevel: politenessLevel
+    };
+
+    if (!uploadConfig.binary) {
+        const imageDataUrl = canvas.toDataURL('image/jpeg', uploadConfig.quality);
+        addCapturedImage(imageDataUrl);
+        message.image = imageDataUrl.split(',')[1];
+        ws.send(JSON.stringify(message));
+        return;
+    }
+
+    const mimeType = pickUploadMimeType();
+    canvas.toBlob(blob => {
+        if (!blob || !ws || ws.readyState !== WebSocket.OPEN) {
+            return;
+        }
+        addCapturedImage(URL.createObjectURL(blob));
+        message.type = 'image_header';
+        message.mimeType = blob.type;
+        message.size = blob.size;
+        // Header frame followed by the raw image bytes
+        ws.send(JSON.stringify(message));
+        ws.send(blob);
+    }, mimeType, uploadConfig.quality);
+}
+
+function pickUploadMimeType() {
+    if (supportsWebp === null) {
+        const probe = document.createElement('canvas');
+        probe.width = probe.height = 1;
+        supportsWebp = probe.toDataURL('image/webp').startsWith('data:image/webp');
+    }
+    const preferred = uploadConfig.mimeTypes || ['image/jpeg'];
+    for (const type of preferred) {
+        if (type !== 'image/webp' || supportsWebp) {
+            return type;
+        }
+    }
+    return 'image/jpeg';
+}
+
+function addCapturedImage(src) {
     const capturedImagesContainer = document.getElementById('captured-images');
     const imgWrapper = document.createElement('div');
     imgWrapper.classList.add('image-wrapper');
     imgWrapper.setAttribute('data-picture-number', `Picture ${pictureCount}`);
 
     const imgElement = document.createElement('img');
-    imgElement.src = imageDataUrl;
+    imgElement.src = src;
     imgWrapper.appendChild(imgElement);
     capturedImagesContainer.appendChild(imgWrapper);
 
     capturedImagesContainer.scrollLeft = capturedImagesContainer.scrollWidth;
-
-    ws.send(JSON.stringify({
-        image: imageDataUrl.split(',')[1],
-        voiceId: selectedVoiceId,
-        voiceName: selectedVoiceName,
-        voiceLabel: selectedVoiceLabel,
-        pictureCount: pictureCount,
-        politenessLevel: politenessLevel
-    }));
 }
 
 function initWebSocket() {
     const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
     const host = window.location.host;
-    const wsUrl = `${protocol}//${host}/narrate`;
+    // ?room=<token> on the page URL listens to the narrations of that room's owner
+    const room = new URLSearchParams(window.location.search).get('room');
+    const wsUrl = `${protocol}//${host}/narrate` + (room ? `?room=${encodeURIComponent(room)}` : '');
 
     if (ws && ws.readyState === WebSocket.OPEN) {
         ws.close(1000, "Intentional close for reconnection");
@@ -247,6 +499,7 @@ function initWebSocket() {
     ws.onopen = () => {
         reconnectAttempts = 0;
         updateServerStatus('online');
+        ws.send(JSON.stringify({ type: 'audio_formats', accept: supportedAudioFormats() }));
         if (pendingCapture) {
             pendingCapture = false;
             captureAndAnalyseImage();
@@ -277,13 +530,26 @@ function initWebSocket() {
                     p.innerHTML = `<strong>Error: ${message.data}</strong>`;
                     p.classList.add('error');
                     feedbackElement.appendChild(p);
+                } else if (message.type === "upload_config") {
+                    uploadConfig = Object.assign({}, uploadConfig, message.data);
+                } else if (message.type === "room") {
+                    if (message.room && message.owner) {
+                        showRoomLink(message.room);
+                    }
+                } else if (message.type === "superseded") {
+                    dropUtterance(message.utterance);
+                } else if (message.type === "frame_skipped") {
+                    hideLoadingPopup();
+                    updateLoadingMessage(message.message, message.detail || "");
                 } else if (message.type === "status") {
                     updateLoadingMessage(message.message, message.detail || "");
                 } else if (message.type === "voice_status") {
                     updateVoiceStatusIndicators(message.data);
                 } else if (message.type === "server_ready") {
                     serverReady = message.ready === true;
+                    serverStartup = message.startup || null;
                     updateReadyState();
+                    updateServerStatus(serverStatus);
                 }
             } catch (error) {
                 console.error("Error parsing message:", error);
@@ -338,7 +604,13 @@ function updateServerStatus(status) {
         return;
     }
     dot.setAttribute('data-status', status);
-    if (status === 'online') {
+    const startupDone = serverStartup && (serverStartup.stage === 'failed' || serverStartup.stage === 'degraded');
+    if (status === 'online' && startupDone && !serverReady) {
+        label.textContent = `Server: Online (${serverStartup.detail})`;
+    } else if (status === 'online' && serverStartup && !serverReady) {
+        const percent = Math.round((serverStartup.progress || 0) * 100);
+        label.textContent = `Server: Warming up (${serverStartup.detail}, ${percent}%)`;
+    } else if (status === 'online') {
         label.textContent = 'Server: Online';
     } else if (status === 'connecting') {
         label.textContent = 'Server: Connecting...';
@@ -0,0 +1,56 @@
+"""
+Incremental sentence/clause segmentation for streamed description text.
+
+Claude streams the description a few tokens at a time; the segmenter buffers
+those tokens and releases a segment as soon as a sentence (or a long enough
+clause) is complete, so TTS can start on it while the rest is still arriving.
+"""
+
+import os
+import re
+
+# Clauses shorter than this are kept with the following text to avoid choppy prosody
+CLAUSE_MIN_CHARS = int(os.getenv("TTS_CLAUSE_MIN_CHARS", "40"))
+# Sentences shorter than this are merged into the next one
+SENTENCE_MIN_CHARS = int(os.getenv("TTS_SENTENCE_MIN_CHARS", "8"))
+
+_SENTENCE_BOUNDARY = re.compile(r'[.!?…]+["\')\]]*\s')
+_CLAUSE_BOUNDARY = re.compile(r'[,;:—–]\s')
+
+
+class TextSegmenter:
+    """Turns a stream of text fragments into speakable segments."""
+
+    def __init__(self, clause_min_chars=CLAUSE_MIN_CHARS, sentence_min_chars=SENTENCE_MIN_CHARS):
+        self.clause_min_chars = clause_min_chars
+        self.sentence_min_chars = sentence_min_chars
+        self._buffer = ""
+
+    def feed(self, fragment):
+        """Add a fragment and return any segments it completed."""
+        self._buffer += fragment
+        segments = []
+        while True:
+            cut = self._next_cut()
+            if cut is None:
+                break
+            segment = self._buffer[:cut].strip()
+            self._buffer = self._buffer[cut:]
+            if segment:
+                segments.append(segment)
+        return segments
+
+    def flush(self):
+        """Return whatever is left once the stream has finished."""
+        segment = self._buffer.strip()
+        self._buffer = ""
+        return segment or None
+
+    def _next_cut(self):
+        for match in _SENTENCE_BOUNDARY.finditer(self._buffer):
+            if len(self._buffer[:match.end()].strip()) >= self.sentence_min_chars:
+                return match.end()
+        for match in _CLAUSE_BOUNDARY.finditer(self._buffer):
+            if len(self._buffer[:match.end()].strip()) >= self.clause_min_chars:
+                return match.end()
+        return None
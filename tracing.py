@@ -0,0 +1,199 @@
+"""
+Per-request tracing and Prometheus metrics.
+
+Every narration gets a Trace with a short random ID. Code anywhere in the
+request's task tree (the Claude stream, the TTS engine, the encoder) calls
+record_stage(stage, seconds). The stage is observed in the
+narrator_stage_seconds histogram, and a span is added to the current trace
+if there is one. Stages:
+
+    receive             image header -> image bytes on the socket
+    decode              base64 decode, frame hash and vision downscale
+    vision_connect      request sent -> response headers from Claude
+    vision_first_token  request sent -> first streamed token
+    vision_complete     request sent -> end of the description stream
+    tts_queue_wait      time a TTS job waited for a worker
+    tts_inference       worker time for a TTS job
+    tts_gpu             round trip to the external GPU worker
+    first_audio         narration start -> first audio frame sent
+    encode              audio encoding for the utterance (summed)
+    send                WebSocket sends for the utterance (summed)
+    total               whole narration
+
+GET /metrics renders the histograms in the Prometheus text format.
+TRACE_LOG writes one JSON line per finished trace: "-" for stdout, or a
+file path.
+"""
+
+import bisect
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+
+TRACE_LOG = os.getenv("TRACE_LOG", "")
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_current_trace = contextvars.ContextVar("narrator_trace", default=None)
+_log_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if value != float("inf") else "+Inf"
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by label values."""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=STAGE_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0, 0.0]
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += 1
+            series[2] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: (list(counts), count, total) for key, (counts, count, total) in self._series.items()}
+        for key, (counts, count, total) in sorted(series.items()):
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter keyed by label values."""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(list(zip(self.labelnames, key)))} {value}")
+        return lines
+
+
+stage_seconds = Histogram("narrator_stage_seconds", "Latency of each narration pipeline stage.", ("stage",))
+narrations_total = Counter("narrator_narrations_total", "Narrations by outcome.", ("status",))
+prompt_tokens_total = Counter(
+    "narrator_prompt_tokens_total", "Claude input tokens by kind (uncached, cache_read, cache_write).", ("kind",)
+)
+
+
+class Trace:
+    """Spans recorded for one narration."""
+
+    def __init__(self, name, **attributes):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attributes = attributes
+        self.started = time.time()
+        self._started_perf = time.perf_counter()
+        self.spans = []
+        # Outcome label for narrator_narrations_total; callers overwrite it
+        self.status = "ok"
+
+    def add_span(self, stage, seconds, **attributes):
+        span = {"stage": stage, "offset": round(time.perf_counter() - self._started_perf - seconds, 4), "seconds": round(seconds, 4)}
+        if attributes:
+            span.update(attributes)
+        self.spans.append(span)
+
+    def finish(self, status=None):
+        status = status or self.status
+        total = time.perf_counter() - self._started_perf
+        record_stage("total", total)
+        narrations_total.inc(status=status)
+        if TRACE_LOG:
+            _write_trace_log({
+                "trace_id": self.trace_id,
+                "name": self.name,
+                "started": round(self.started, 3),
+                "status": status,
+                "seconds": round(total, 4),
+                "attributes": self.attributes,
+                "spans": self.spans,
+            })
+
+
+def _write_trace_log(record):
+    line = json.dumps(record, default=str)
+    with _log_lock:
+        if TRACE_LOG == "-":
+            print(line, file=sys.stdout, flush=True)
+            return
+        with open(TRACE_LOG, "a") as f:
+            f.write(line + "\n")
+
+
+def start_trace(name, **attributes):
+    """Start a trace and make it current for this task (and tasks it creates)."""
+    trace = Trace(name, **attributes)
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def record_stage(stage, seconds, **attributes):
+    """Observe a stage duration and add it to the current trace, if any."""
+    stage_seconds.observe(seconds, stage=stage)
+    trace = _current_trace.get()
+    if trace is not None and stage != "total":
+        trace.add_span(stage, seconds, **attributes)
+
+
+def render_metrics(gauges=()):
+    """Prometheus text exposition; gauges is an iterable of (name, help, value)."""
+    lines = stage_seconds.render() + narrations_total.render() + prompt_tokens_total.render()
+    for name, documentation, value in gauges:
+        lines += [f"# HELP {name} {documentation}", f"# TYPE {name} gauge", f"{name} {value}"]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,536 @@
+"""
+Local XTTS engine: a pool of inference workers behind a bounded priority queue.
+
+TTS_WORKERS=0 (default) runs inference on one dedicated thread against the
+in-process model, which keeps memory at a single XTTS instance on the HF free
+tier. TTS_WORKERS>=1 starts that many worker processes, each with its own
+XTTS instance pinned to TTS_TORCH_THREADS threads.
+
+Jobs beyond TTS_QUEUE_MAX are rejected up front (TTSQueueFullError) and jobs
+that waited longer than TTS_MAX_QUEUE_WAIT are shed when they reach the front
+of the queue, so a saturated box fails fast instead of piling up latency.
+
+Jobs produce messages:
+    ("chunk", pcm16 bytes)   streamed audio
+    ("wav", float32 array)   complete waveform
+    ("latents", voice name)  a "clone" job stored the voice's conditioning latents
+
+Worker processes also report their GPT prefix cache stats when they come up
+and after each job, since each keeps its own cache.
+"""
+
+import asyncio
+import heapq
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+from tracing import record_stage
+
+TTS_WORKERS = int(os.getenv("TTS_WORKERS", "0"))
+TTS_TORCH_THREADS = int(os.getenv("TTS_TORCH_THREADS", "2"))
+TTS_QUEUE_MAX = int(os.getenv("TTS_QUEUE_MAX", "16"))
+TTS_MAX_QUEUE_WAIT = float(os.getenv("TTS_MAX_QUEUE_WAIT", "60"))
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_CONTINUOUS = 5
+
+_STATS_WINDOW = 200
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class TTSRejectedError(Exception):
+    """The engine refused or dropped a job because it is saturated."""
+
+
+class TTSQueueFullError(TTSRejectedError):
+    pass
+
+
+class TTSJobShedError(TTSRejectedError):
+    pass
+
+
+class TTSJobError(Exception):
+    """Inference failed inside a worker."""
+
+
+class TTSJob:
+    def __init__(self, job_id, kind, text, voice_name, priority, loop):
+        self.id = job_id
+        self.kind = kind
+        self.text = text
+        self.voice_name = voice_name
+        self.priority = priority
+        self.loop = loop
+        self.results = asyncio.Queue()
+        self.enqueued_at = time.time()
+        self.started_at = None
+        self.cancelled = threading.Event()
+        self.finished = False
+
+    def deliver(self, message, payload=None):
+        self.loop.call_soon_threadsafe(self.results.put_nowait, (message, payload))
+
+
+def _cancel_criteria(should_stop):
+    """HF stopping criteria that ends GPT generation once the job is cancelled."""
+    from transformers import StoppingCriteria, StoppingCriteriaList
+
+    class _Cancelled(StoppingCriteria):
+        def __call__(self, input_ids, scores, **kwargs):
+            return should_stop()
+
+    return StoppingCriteriaList([_Cancelled()])
+
+
+def synthesise_job(kind, text, voice_name, emit, should_stop):
+    """Run one job against the XTTS model of the current process.
+
+    Shared by the in-process thread and the worker processes. should_stop is
+    polled between streamed chunks and inside GPT generation, so a cancelled
+    job stops within one decoding step rather than running to completion.
+    """
+    import numpy as np
+    from audio_encoder import pcm16_bytes
+    from convert_text_to_speech import (
+        DEFAULT_VOICE, TTS_STREAM_CHUNK_SIZE, compute_voice_latents, ensure_voice_prefix, get_tts_model,
+        get_voice_files, get_voice_folder, load_voice_embedding, split_sentences,
+    )
+
+    if should_stop():
+        return
+    tts = get_tts_model()
+    embedding = load_voice_embedding(voice_name)
+    if not embedding and get_voice_folder(voice_name) is None:
+        # voiceName comes from the client: never register a name that has no clips
+        print(f"  ⚠ Unknown voice {voice_name!r}, using {DEFAULT_VOICE}")
+        voice_name = DEFAULT_VOICE
+        embedding = load_voice_embedding(voice_name)
+    if not embedding:
+        # Extract the latents once; later requests for this voice reuse them
+        print("  ⚠ No embedding yet, computing conditioning latents")
+        embedding = compute_voice_latents(
+            voice_name, get_voice_files(voice_name), persist=get_voice_folder(voice_name) is not None
+        )
+    ensure_voice_prefix(voice_name, embedding)
+    inference_start = time.time()
+    stopping_criteria = _cancel_criteria(should_stop)
+
+    if kind == "stream":
+        model = tts.synthesizer.tts_model
+        for sentence in split_sentences(text):
+            sentence_start = time.time()
+            first = True
+            for chunk in model.inference_stream(
+                sentence,
+                "en",
+                embedding['gpt_cond_latent'],
+                embedding['speaker_embedding'],
+                stream_chunk_size=TTS_STREAM_CHUNK_SIZE,
+                enable_text_splitting=False,
+                stopping_criteria=stopping_criteria
+            ):
+                if should_stop():
+                    print("  ✋ Synthesis cancelled", flush=True)
+                    return
+                if first:
+                    print(f"  ⏱️  First chunk of sentence: {time.time() - sentence_start:.2f}s", flush=True)
+                    first = False
+                emit("chunk", pcm16_bytes(chunk))
+        print(f"  ⏱️  TTS Inference (streamed): {time.time() - inference_start:.2f}s", flush=True)
+        return
+
+    # Use synthesizer directly with pre-computed embeddings
+    wav = tts.synthesizer.tts_model.inference(
+        text=text,
+        language="en",
+        gpt_cond_latent=embedding['gpt_cond_latent'],
+        speaker_embedding=embedding['speaker_embedding'],
+        stopping_criteria=stopping_criteria
+    )
+    wav = wav["wav"]
+    if should_stop():
+        print("  ✋ Synthesis cancelled", flush=True)
+        return
+    print(f"  ⏱️  TTS Inference: {time.time() - inference_start:.2f}s", flush=True)
+    if hasattr(wav, "detach"):
+        wav = wav.detach().cpu().numpy()
+    emit("wav", np.asarray(wav, dtype=np.float32).reshape(-1))
+
+
+def clone_voice_job(voice_name, audio_paths, emit):
+    """Compute a voice's conditioning latents and add them to the embedding store."""
+    from convert_text_to_speech import compute_voice_latents
+
+    compute_voice_latents(voice_name, audio_paths)
+    emit("latents", voice_name)
+
+
+def run_job(kind, text, voice_name, emit, should_stop):
+    """Dispatch a job by kind; for "clone" jobs text is the list of reference clips."""
+    if kind == "clone":
+        clone_voice_job(voice_name, text, emit)
+        return
+    import torch
+
+    # No autograd bookkeeping anywhere in synthesis, including the vocoder
+    with torch.inference_mode():
+        synthesise_job(kind, text, voice_name, emit, should_stop)
+
+
+def _worker_main(index, inbox, outbox, cancel_event, threads):
+    """Entry point of a worker process: load XTTS, warm up, then serve jobs."""
+    os.environ["TTS_TORCH_THREADS"] = str(threads)
+    from convert_text_to_speech import (
+        get_prefix_cache_stats, get_tts_model, is_tts_ready, preload_all_embeddings, warm_up_tts,
+    )
+
+    try:
+        get_tts_model()
+        preload_all_embeddings()
+        warm_up_tts()
+    except Exception as e:
+        print(f"TTS worker {index} failed to start: {e}", flush=True)
+        outbox.put(("failed", None, str(e)))
+        return
+    if not is_tts_ready():
+        # warm_up_tts logs and swallows its own errors
+        outbox.put(("failed", None, "warm-up failed"))
+        return
+    outbox.put(("ready", None, get_prefix_cache_stats()))
+
+    while True:
+        message = inbox.get()
+        if message[0] == "stop":
+            return
+        _, job_id, kind, text, voice_name = message
+
+        def emit(name, payload):
+            outbox.put((name, job_id, payload))
+
+        try:
+            run_job(kind, text, voice_name, emit, cancel_event.is_set)
+        except Exception as e:
+            outbox.put(("error", job_id, str(e)))
+            continue
+        finally:
+            outbox.put(("stats", None, get_prefix_cache_stats()))
+        outbox.put(("done", job_id, None))
+
+
+class _ProcessWorker:
+    """A worker process plus the dispatcher thread that feeds it."""
+
+    def __init__(self, engine, index):
+        self.engine = engine
+        self.index = index
+        self.ready = False
+        self.failed = False
+        self.busy = False
+        self.prefix_cache_stats = None
+        self._context = multiprocessing.get_context("spawn")
+        self._spawn()
+        self._thread = threading.Thread(target=self._dispatch, name=f"tts-worker-{index}", daemon=True)
+        self._thread.start()
+
+    def _spawn(self):
+        self.inbox = self._context.Queue()
+        self.outbox = self._context.Queue()
+        self.cancel_event = self._context.Event()
+        self.process = self._context.Process(
+            target=_worker_main,
+            args=(self.index, self.inbox, self.outbox, self.cancel_event, TTS_TORCH_THREADS),
+            daemon=True,
+        )
+        self.process.start()
+        self.ready = False
+
+    def _receive(self, job=None):
+        """Next message from the worker, respawning it if it died.
+
+        While a job is running, polls often enough to forward its
+        cancellation to the worker promptly.
+        """
+        while True:
+            if job is not None and job.cancelled.is_set():
+                self.cancel_event.set()
+            try:
+                return self.outbox.get(timeout=0.25 if job is not None else 5)
+            except queue.Empty:
+                if not self.process.is_alive():
+                    print(f"⚠️  TTS worker {self.index} died, restarting", flush=True)
+                    if self.ready:
+                        self.engine._worker_lost()
+                    self._spawn()
+                    return ("died", None, None)
+
+    def _dispatch(self):
+        while True:
+            while not self.ready:
+                message = self._receive()
+                if message[0] == "failed":
+                    # No model to serve with; leave the jobs to the other workers
+                    print(f"⚠️  TTS worker {self.index} failed to load: {message[2]}", flush=True)
+                    self.failed = True
+                    self.engine._worker_failed()
+                    return
+                if message[0] == "ready":
+                    self.ready = True
+                    self.prefix_cache_stats = message[2]
+                    print(f"TTS worker {self.index} ready", flush=True)
+                    self.engine._worker_ready()
+
+            job = self.engine._next_job()
+            if job is None:
+                self.inbox.put(("stop",))
+                return
+            self.busy = True
+            self.cancel_event.clear()
+            self.inbox.put(("job", job.id, job.kind, job.text, job.voice_name))
+            while True:
+                name, job_id, payload = self._receive(job)
+                if name == "died":
+                    job.deliver("error", "TTS worker crashed")
+                    break
+                if name == "stats":
+                    self.prefix_cache_stats = payload
+                    continue
+                if job_id != job.id:
+                    continue
+                if name in ("done", "error"):
+                    job.deliver(name, payload)
+                    break
+                if not job.cancelled.is_set():
+                    job.deliver(name, payload)
+            self.busy = False
+            self.engine._job_finished(job)
+
+
+class TTSEngine:
+    """Bounded priority queue in front of one or more XTTS workers."""
+
+    def __init__(self, workers=TTS_WORKERS, max_queue=TTS_QUEUE_MAX, max_wait=TTS_MAX_QUEUE_WAIT):
+        self.worker_count = workers
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._pending = []
+        self._condition = threading.Condition()
+        self._ids = itertools.count()
+        self._workers = []
+        self._threads = []
+        self._ready_workers = 0
+        self.failed_workers = 0
+        self._started = False
+        self._stopping = False
+        self.in_flight = 0
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.shed = 0
+        self.failed = 0
+        self._wait_times = deque(maxlen=_STATS_WINDOW)
+        self._run_times = deque(maxlen=_STATS_WINDOW)
+
+    @property
+    def uses_processes(self):
+        return self.worker_count > 0
+
+    @property
+    def ready(self):
+        return self._started and self._ready_workers > 0
+
+    @property
+    def all_workers_failed(self):
+        """True once every worker process has failed to load its model."""
+        return self._started and self.uses_processes and self.failed_workers >= self.worker_count
+
+    def start(self):
+        """Start the workers. In-process mode loads and warms the model in the caller."""
+        if self._started:
+            return
+        self._started = True
+        if self.uses_processes:
+            print(f"Starting {self.worker_count} TTS worker process(es), {TTS_TORCH_THREADS} threads each")
+            self._workers = [_ProcessWorker(self, index) for index in range(self.worker_count)]
+            return
+        from convert_text_to_speech import get_tts_model, warm_up_tts, is_tts_ready
+        get_tts_model()
+        warm_up_tts()
+        thread = threading.Thread(target=self._run_in_process, name="tts-inference", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        if is_tts_ready():
+            self._worker_ready()
+
+    def stop(self):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+
+    # -- queue ------------------------------------------------------------
+
+    def _enqueue(self, kind, text, voice_name, priority, loop):
+        # Jobs submitted before start() simply wait until the workers come up
+        if self.all_workers_failed:
+            # No dispatcher is left to run (or shed) the job; it would wait forever
+            raise TTSJobError("Every TTS worker failed to load its model")
+        with self._condition:
+            if len(self._pending) >= self.max_queue:
+                self.rejected += 1
+                raise TTSQueueFullError(f"TTS queue full ({self.max_queue} waiting)")
+            job = TTSJob(next(self._ids), kind, text, voice_name, priority, loop)
+            heapq.heappush(self._pending, (priority, job.id, job))
+            self.submitted += 1
+            self._condition.notify()
+        return job
+
+    def _next_job(self):
+        """Block until a runnable job is available (None when stopping)."""
+        with self._condition:
+            while True:
+                while not self._pending and not self._stopping:
+                    self._condition.wait()
+                if self._stopping:
+                    return None
+                _, _, job = heapq.heappop(self._pending)
+                if job.cancelled.is_set():
+                    continue
+                waited = time.time() - job.enqueued_at
+                if waited > self.max_wait:
+                    self.shed += 1
+                    job.deliver("shed", f"Waited {waited:.0f}s in the TTS queue")
+                    continue
+                self._wait_times.append(waited)
+                job.started_at = time.time()
+                self.in_flight += 1
+                return job
+
+    def _job_finished(self, job):
+        with self._condition:
+            self.in_flight -= 1
+            self._run_times.append(time.time() - job.started_at)
+
+    def _worker_ready(self):
+        with self._condition:
+            self._ready_workers += 1
+
+    def _worker_failed(self):
+        with self._condition:
+            self.failed_workers += 1
+
+    def _worker_lost(self):
+        with self._condition:
+            self._ready_workers -= 1
+
+    def _cancel(self, job):
+        job.cancelled.set()
+        with self._condition:
+            for index, (_, _, pending) in enumerate(self._pending):
+                if pending is job:
+                    self._pending.pop(index)
+                    heapq.heapify(self._pending)
+                    break
+
+    def _run_in_process(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            try:
+                run_job(job.kind, job.text, job.voice_name, job.deliver, job.cancelled.is_set)
+                job.deliver("done")
+            except Exception as e:
+                job.deliver("error", str(e))
+            finally:
+                self._job_finished(job)
+
+    # -- public API -------------------------------------------------------
+
+    async def run(self, kind, text, voice_name, priority=PRIORITY_INTERACTIVE):
+        """Queue a job and yield its (message, payload) results.
+
+        kind is "stream" (PCM16 chunks), "full" (one waveform) or "clone"
+        (text is a list of reference clips; yields "latents"). Raises
+        TTSQueueFullError/TTSJobShedError when saturated and TTSJobError if
+        inference fails or no worker could load the model.
+        """
+        job = self._enqueue(kind, text, voice_name, priority, asyncio.get_running_loop())
+        outcome = "cancelled"
+        try:
+            while True:
+                message, payload = await job.results.get()
+                if message == "done":
+                    job.finished = True
+                    outcome = "done"
+                    self.completed += 1
+                    return
+                if message == "shed":
+                    job.finished = True
+                    outcome = "shed"
+                    raise TTSJobShedError(payload)
+                if message == "error":
+                    job.finished = True
+                    outcome = "error"
+                    self.failed += 1
+                    raise TTSJobError(payload)
+                yield message, payload
+        finally:
+            if not job.finished:
+                self._cancel(job)
+            # Every outcome counts; shed and cancelled jobs are the long waits
+            started_at = job.started_at or time.time()
+            record_stage("tts_queue_wait", started_at - job.enqueued_at, outcome=outcome)
+            if job.started_at is not None:
+                record_stage("tts_inference", time.time() - job.started_at, kind=job.kind, outcome=outcome)
+
+    def prefix_cache_stats(self):
+        """GPT prefix cache stats; with worker processes, one entry per worker."""
+        if not self.uses_processes:
+            from convert_text_to_speech import get_prefix_cache_stats
+            return get_prefix_cache_stats()
+        return {"per_worker": [worker.prefix_cache_stats for worker in self._workers]}
+
+    def stats(self):
+        with self._condition:
+            waits = list(self._wait_times)
+            runs = list(self._run_times)
+            busy = sum(1 for worker in self._workers if worker.busy) if self._workers else self.in_flight
+            return {
+                "mode": "processes" if self.uses_processes else "in-process",
+                "workers": max(self.worker_count, 1),
+                "ready_workers": self._ready_workers,
+                "failed_workers": self.failed_workers,
+                "busy_workers": busy,
+                "queue_depth": len(self._pending),
+                "max_queue": self.max_queue,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "shed": self.shed,
+                "failed": self.failed,
+                "wait_avg": round(sum(waits) / len(waits), 3) if waits else 0.0,
+                "wait_p95": round(_percentile(waits, 0.95), 3),
+                "run_avg": round(sum(runs) / len(runs), 3) if runs else 0.0,
+            }
+
+
+_engine = None
+
+
+def get_tts_engine():
+    global _engine
+    if _engine is None:
+        _engine = TTSEngine()
+    return _engine
@@ -0,0 +1,195 @@
+"""
+Routing between the external GPU service and the local CPU engine.
+
+The router tracks each backend's recent latency (seconds per character of
+text), error rate and in-flight requests, and sends each request to the one
+expected to finish first:
+
+- Circuit breaker: GPU_BREAKER_FAILURES consecutive GPU failures open the
+  breaker, and requests go straight to the CPU engine. While it is open, a
+  background probe checks the endpoint every GPU_PROBE_INTERVAL seconds,
+  starting GPU_BREAKER_COOLDOWN seconds after it opened. The first
+  successful probe closes it. A healthy endpoint is never probed, because
+  probing would keep a scale-to-zero GPU container awake.
+- Hedging: if the GPU hasn't answered within the hedge deadline, the CPU
+  engine starts on the same text. Whichever produces audio first wins and
+  the other is cancelled. The deadline is GPU_HEDGE_FACTOR x the GPU's p95
+  latency, clamped to [GPU_HEDGE_MIN, GPU_HEDGE_AFTER]. GPU_HEDGE_AFTER=0
+  disables hedging. A GPU that loses the race counts as a failure, so a
+  hung endpoint still trips the breaker.
+- Queue depth: the GPU's expected time grows with its in-flight requests
+  beyond GPU_TTS_CONCURRENCY. The CPU's grows with the local engine's
+  queued and running jobs per worker.
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+
+from gpu_client import get_gpu_api_url, probe_gpu
+
+GPU_BREAKER_FAILURES = int(os.getenv("GPU_BREAKER_FAILURES", "3"))
+GPU_BREAKER_COOLDOWN = float(os.getenv("GPU_BREAKER_COOLDOWN", "30"))
+GPU_PROBE_INTERVAL = float(os.getenv("GPU_PROBE_INTERVAL", "15"))
+GPU_HEDGE_AFTER = float(os.getenv("GPU_HEDGE_AFTER", "8"))
+GPU_HEDGE_MIN = float(os.getenv("GPU_HEDGE_MIN", "2"))
+GPU_HEDGE_FACTOR = float(os.getenv("GPU_HEDGE_FACTOR", "2"))
+GPU_TTS_CONCURRENCY = int(os.getenv("GPU_TTS_CONCURRENCY", "8"))
+# Assumed CPU speed until the local engine has served a request (XTTS on 2 vCPUs)
+CPU_SECONDS_PER_CHAR_PRIOR = float(os.getenv("CPU_SECONDS_PER_CHAR_PRIOR", "0.25"))
+
+_WINDOW = 50
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+class BackendHealth:
+    """Sliding window of one backend's outcomes."""
+
+    def __init__(self, name):
+        self.name = name
+        self.in_flight = 0
+        self._per_char = deque(maxlen=_WINDOW)
+        self._latencies = deque(maxlen=_WINDOW)
+        self._outcomes = deque(maxlen=_WINDOW)
+
+    def observe(self, seconds, chars, ok):
+        self._outcomes.append(ok)
+        if ok:
+            self._latencies.append(seconds)
+            self._per_char.append(seconds / max(chars, 1))
+
+    def seconds_per_char(self):
+        return _percentile(self._per_char, 0.5) if self._per_char else None
+
+    def p95(self):
+        return _percentile(self._latencies, 0.95) if self._latencies else None
+
+    def error_rate(self):
+        return sum(1 for ok in self._outcomes if not ok) / len(self._outcomes) if self._outcomes else 0.0
+
+    def stats(self):
+        p95 = self.p95()
+        per_char = self.seconds_per_char()
+        return {
+            "in_flight": self.in_flight,
+            "requests": len(self._outcomes),
+            "error_rate": round(self.error_rate(), 3),
+            "latency_p95": round(p95, 3) if p95 is not None else None,
+            "seconds_per_char": round(per_char, 4) if per_char is not None else None,
+        }
+
+
+class TTSRouter:
+    def __init__(self):
+        self.gpu = BackendHealth("gpu")
+        self.cpu = BackendHealth("cpu")
+        self.state = "closed"
+        self.opened_at = None
+        self.consecutive_failures = 0
+        self.breaker_trips = 0
+        self.hedged = 0
+        self.hedge_wins = {"gpu": 0, "cpu": 0}
+        self._probe_task = None
+
+    def gpu_available(self):
+        return get_gpu_api_url() is not None and self.state == "closed"
+
+    def record_gpu(self, seconds, chars, ok):
+        self.gpu.observe(seconds, chars, ok)
+        if ok:
+            self.consecutive_failures = 0
+            return
+        self.consecutive_failures += 1
+        if self.state == "closed" and self.consecutive_failures >= GPU_BREAKER_FAILURES:
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self.breaker_trips += 1
+            print(f"🔌 GPU circuit breaker open after {self.consecutive_failures} failures; routing to CPU", flush=True)
+
+    def record_cpu(self, seconds, chars, ok):
+        self.cpu.observe(seconds, chars, ok)
+
+    def hedge_delay(self):
+        """Seconds to wait on the GPU before racing the CPU, or None to never hedge."""
+        if GPU_HEDGE_AFTER <= 0:
+            return None
+        p95 = self.gpu.p95()
+        if p95 is None:
+            return GPU_HEDGE_AFTER
+        return min(GPU_HEDGE_AFTER, max(GPU_HEDGE_MIN, p95 * GPU_HEDGE_FACTOR))
+
+    def choose(self, chars, cpu_load):
+        """Pick "gpu" or "cpu" for a request of chars characters.
+
+        cpu_load is the local engine's (queued + running) jobs per worker.
+        """
+        if not self.gpu_available():
+            return "cpu"
+        gpu_per_char = self.gpu.seconds_per_char()
+        if gpu_per_char is None:
+            return "gpu"
+        gpu_expected = gpu_per_char * chars * (1 + self.gpu.in_flight // max(GPU_TTS_CONCURRENCY, 1))
+        cpu_per_char = self.cpu.seconds_per_char() or CPU_SECONDS_PER_CHAR_PRIOR
+        cpu_expected = cpu_per_char * chars * (1 + cpu_load)
+        return "gpu" if gpu_expected <= cpu_expected else "cpu"
+
+    async def _probe_loop(self):
+        while True:
+            await asyncio.sleep(GPU_PROBE_INTERVAL)
+            api_url = get_gpu_api_url()
+            if self.state != "open" or api_url is None:
+                continue
+            if time.monotonic() - self.opened_at < GPU_BREAKER_COOLDOWN:
+                continue
+            try:
+                healthy = await probe_gpu(api_url)
+            except Exception as e:
+                # A dead probe task would leave the breaker open for good
+                print(f"⚠️  GPU probe error: {e}", flush=True)
+                continue
+            if healthy:
+                self.state = "closed"
+                self.consecutive_failures = 0
+                print("🔌 GPU probe succeeded; circuit breaker closed", flush=True)
+
+    def start(self):
+        if self._probe_task is None and get_gpu_api_url():
+            self._probe_task = asyncio.create_task(self._probe_loop())
+
+    async def stop(self):
+        task = self._probe_task
+        self._probe_task = None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self):
+        return {
+            "gpu_configured": get_gpu_api_url() is not None,
+            "breaker": self.state,
+            "breaker_trips": self.breaker_trips,
+            "consecutive_failures": self.consecutive_failures,
+            "hedge_delay": self.hedge_delay(),
+            "hedged": self.hedged,
+            "hedge_wins": dict(self.hedge_wins),
+            "gpu": self.gpu.stats(),
+            "cpu": self.cpu.stats(),
+        }
+
+
+_router = None
+
+
+def get_tts_router():
+    global _router
+    if _router is None:
+        _router = TTSRouter()
+    return _router
@@ -0,0 +1,98 @@
+"""
+Runtime voice cloning.
+
+POST /voices takes a name and up to VOICE_UPLOAD_MAX_FILES reference clips.
+The clips are saved under CUSTOM_VOICES_DIR, and a "clone" job on the TTS
+engine extracts their conditioning latents once and writes them to the
+embedding store. The voice is usable as soon as the request returns, and
+narrations with it never re-read the reference audio.
+"""
+
+import asyncio
+import os
+import re
+import shutil
+
+from fastapi import APIRouter, File, Form, HTTPException, UploadFile
+
+from convert_text_to_speech import (
+    TTS_LOCAL, custom_voice_folder, get_voice_asset_status, get_voice_fingerprint, get_voice_statuses,
+    register_voice_embedding,
+)
+from generate_description import compile_prompt_templates
+from tts_engine import PRIORITY_CONTINUOUS, TTSJobError, TTSRejectedError, get_tts_engine
+
+router = APIRouter()
+
+VOICE_UPLOAD_MAX_FILES = int(os.getenv("VOICE_UPLOAD_MAX_FILES", "3"))
+# Per clip; XTTS only uses the first max_ref_length seconds anyway
+VOICE_UPLOAD_MAX_BYTES = int(os.getenv("VOICE_UPLOAD_MAX_BYTES", str(10 * 1024 * 1024)))
+
+_VOICE_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9 \-]{0,39}$")
+_AUDIO_EXTENSIONS = ('.mp3', '.mp4', '.wav', '.m4a')
+
+# Names with a clone job in flight, so two uploads can't race for one name
+_cloning = set()
+
+
+def _write_clip(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+@router.get("/voices")
+async def list_voices():
+    return {"voices": get_voice_statuses()}
+
+
+@router.post("/voices", status_code=201)
+async def upload_voice(name: str = Form(...), files: list[UploadFile] = File(...)):
+    name = " ".join(name.split())
+    if not TTS_LOCAL:
+        raise HTTPException(503, "Voice cloning needs the local TTS model (TTS_LOCAL=0)")
+    if not _VOICE_NAME.match(name):
+        raise HTTPException(400, "Voice names are 1-40 letters, digits, spaces or hyphens")
+    if name in _cloning or get_voice_asset_status(name) == "ready":
+        raise HTTPException(409, f"Voice '{name}' already exists")
+    if not 1 <= len(files) <= VOICE_UPLOAD_MAX_FILES:
+        raise HTTPException(400, f"Upload between 1 and {VOICE_UPLOAD_MAX_FILES} reference clips")
+
+    clips = []
+    for index, upload in enumerate(files):
+        extension = os.path.splitext(upload.filename or "")[1].lower()
+        if extension not in _AUDIO_EXTENSIONS:
+            raise HTTPException(415, f"Unsupported clip type '{extension}' (use {', '.join(_AUDIO_EXTENSIONS)})")
+        data = await upload.read(VOICE_UPLOAD_MAX_BYTES + 1)
+        if len(data) > VOICE_UPLOAD_MAX_BYTES:
+            raise HTTPException(413, f"Clips are limited to {VOICE_UPLOAD_MAX_BYTES // (1024 * 1024)} MB each")
+        clips.append((f"clip_{index}{extension}", data))
+
+    _cloning.add(name)
+    folder = custom_voice_folder(name)
+    loop = asyncio.get_running_loop()
+    try:
+        os.makedirs(folder, exist_ok=True)
+        paths = []
+        for filename, data in clips:
+            path = os.path.join(folder, filename)
+            await loop.run_in_executor(None, _write_clip, path, data)
+            paths.append(path)
+
+        print(f"🎙️  Cloning voice '{name}' from {len(paths)} clip(s)", flush=True)
+        try:
+            async for _ in get_tts_engine().run("clone", paths, name, priority=PRIORITY_CONTINUOUS):
+                pass
+        except TTSRejectedError as e:
+            shutil.rmtree(folder, ignore_errors=True)
+            raise HTTPException(503, f"Server is busy, try again shortly ({e})")
+        except TTSJobError as e:
+            shutil.rmtree(folder, ignore_errors=True)
+            raise HTTPException(422, f"Could not extract a voice from the clips: {e}")
+
+        # Worker processes wrote the latents to disk; load them into this process too
+        await loop.run_in_executor(None, register_voice_embedding, name)
+        compile_prompt_templates([name])
+    finally:
+        _cloning.discard(name)
+
+    return {"voice": name, "status": get_voice_asset_status(name), "fingerprint": get_voice_fingerprint(name)}
@@ -0,0 +1,96 @@
+"""
+Optional CPU speed-ups for the local XTTS model.
+
+TTS_CPU_MODE selects how the GPT decoder runs on CPU:
+    fp32   the stock model (default)
+    int8   dynamic int8 quantization of the GPT-2 transformer blocks
+
+TTS_CPU_COMPILE=1 additionally runs the HiFi-GAN vocoder through
+torch.compile. A compile that fails (no C++ toolchain, unsupported op) is
+caught by a probe inference, and the stock vocoder is kept.
+
+XTTS's GPT-2 blocks use transformers' Conv1D (a transposed Linear), which
+dynamic quantization does not recognise. They are rewritten as nn.Linear
+first. The conditioning encoders and the speaker encoder stay fp32, because
+they compute voice latents that are saved to disk for good. Compare the
+modes with `python benchmarks/microbench.py cpu`.
+"""
+
+import os
+import time
+
+import torch
+from torch import nn
+
+TTS_CPU_MODE = os.getenv("TTS_CPU_MODE", "fp32").lower()
+TTS_CPU_COMPILE = os.getenv("TTS_CPU_COMPILE", "0") == "1"
+CPU_MODES = ("fp32", "int8")
+
+
+def _conv1d_to_linear(module):
+    """Replace transformers Conv1D layers under module with equivalent nn.Linear."""
+    from transformers.pytorch_utils import Conv1D
+
+    replaced = 0
+    for name, child in module.named_children():
+        if isinstance(child, Conv1D):
+            in_features, out_features = child.weight.shape
+            linear = nn.Linear(in_features, out_features, bias=child.bias is not None)
+            with torch.no_grad():
+                linear.weight.copy_(child.weight.t())
+                if child.bias is not None:
+                    linear.bias.copy_(child.bias)
+            setattr(module, name, linear)
+            replaced += 1
+        else:
+            replaced += _conv1d_to_linear(child)
+    return replaced
+
+
+def quantize_gpt(xtts):
+    """Dynamic int8 quantization of the GPT transformer's linear layers, in place."""
+    transformer = xtts.gpt.gpt
+    converted = _conv1d_to_linear(transformer)
+    torch.ao.quantization.quantize_dynamic(transformer, {nn.Linear}, dtype=torch.qint8, inplace=True)
+    return converted
+
+
+def _probe_vocoder(xtts, decoder):
+    # Shapes match what Xtts.inference feeds the decoder: GPT latents and a speaker embedding
+    latents = torch.zeros(1, 16, xtts.args.gpt_n_model_channels)
+    speaker = torch.zeros(1, 512, 1)
+    with torch.inference_mode():
+        decoder(latents, g=speaker)
+
+
+def compile_vocoder(xtts):
+    """torch.compile the HiFi-GAN decoder; keeps the original if compilation fails."""
+    original = xtts.hifigan_decoder
+    try:
+        compiled = torch.compile(original, dynamic=True)
+        start = time.time()
+        _probe_vocoder(xtts, compiled)
+        xtts.hifigan_decoder = compiled
+        print(f"  ⚙️  HiFi-GAN compiled in {time.time() - start:.1f}s", flush=True)
+        return True
+    except Exception as e:
+        xtts.hifigan_decoder = original
+        print(f"  ⚠ torch.compile unavailable for HiFi-GAN, using eager mode: {e}", flush=True)
+        return False
+
+
+def optimize_xtts_for_cpu(xtts, mode=None, compile_vocoder_too=None):
+    """Apply the configured CPU optimizations to a loaded Xtts model."""
+    mode = (mode or TTS_CPU_MODE).lower()
+    compile_vocoder_too = TTS_CPU_COMPILE if compile_vocoder_too is None else compile_vocoder_too
+    if mode not in CPU_MODES:
+        print(f"  ⚠ Unknown TTS_CPU_MODE {mode!r}, using fp32", flush=True)
+        mode = "fp32"
+    xtts.eval()
+    if mode == "int8":
+        start = time.time()
+        converted = quantize_gpt(xtts)
+        print(f"  ⚙️  GPT quantized to int8 ({converted} layers) in {time.time() - start:.1f}s", flush=True)
+    if compile_vocoder_too:
+        compile_vocoder(xtts)
+    return mode
@@ -0,0 +1,146 @@
+"""
+Per-voice key/value cache for the conditioning prefix of XTTS's GPT.
+
+Every XTTS generation feeds the GPT [conditioning latents | text | start
+token]. XTTS has no learned position embeddings (positions are added to the
+text and audio embeddings only). So the transformer's keys and values for
+the 32 conditioning positions depend on nothing but the voice. This module
+computes them once per voice and reuses them. The first generation step
+then only encodes the text and the start token.
+
+The cache wraps gpt_inference.transformer, so only generation is affected.
+The full-mode latent pass (GPT.forward) still runs the whole sequence. An
+entry is used only when the request's prefix matches the entry's latents
+exactly, so a re-cloned voice just misses until its entry is rebuilt.
+Entries are evicted least recently used once they exceed
+TTS_PREFIX_CACHE_MB. They take about 2 x layers x 32 x 1024 floats, around
+8 MB per voice in fp32.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+import torch
+from torch import nn
+
+TTS_PREFIX_CACHE = os.getenv("TTS_PREFIX_CACHE", "1") == "1"
+TTS_PREFIX_CACHE_MB = float(os.getenv("TTS_PREFIX_CACHE_MB", "128"))
+
+
+def _past_nbytes(past_key_values):
+    return sum(tensor.numel() * tensor.element_size() for layer in past_key_values for tensor in layer)
+
+
+class VoicePrefixCache:
+    """LRU of voice name -> (conditioning latents, past key/values, bytes)."""
+
+    def __init__(self, transformer, budget_bytes):
+        self.transformer = transformer
+        self.budget_bytes = budget_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _device(self):
+        return next(self.transformer.parameters()).device
+
+    def _matches(self, entry, cond_latent):
+        cached = entry[0]
+        return cached.shape == cond_latent.shape and torch.equal(cached, cond_latent.to(cached.device, cached.dtype))
+
+    def ensure(self, voice_name, cond_latent):
+        """Build the voice's entry unless an up-to-date one exists."""
+        with self._lock:
+            entry = self._entries.get(voice_name)
+            if entry is not None and self._matches(entry, cond_latent):
+                self._entries.move_to_end(voice_name)
+                return False
+        cond_latent = cond_latent.to(self._device())
+        with torch.inference_mode():
+            outputs = self.transformer(inputs_embeds=cond_latent, use_cache=True, return_dict=True)
+        past = tuple(tuple(tensor for tensor in layer) for layer in outputs.past_key_values)
+        nbytes = _past_nbytes(past) + cond_latent.numel() * cond_latent.element_size()
+        with self._lock:
+            previous = self._entries.pop(voice_name, None)
+            if previous is not None:
+                self.bytes -= previous[2]
+            self._entries[voice_name] = (cond_latent, past, nbytes)
+            self.bytes += nbytes
+            while self.bytes > self.budget_bytes and len(self._entries) > 1:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+        return True
+
+    def lookup(self, inputs_embeds):
+        """Cached (prefix length, past key/values) for a generation prefix, or None."""
+        if inputs_embeds.shape[0] != 1:
+            return None
+        with self._lock:
+            for voice_name in reversed(self._entries):
+                entry = self._entries[voice_name]
+                length = entry[0].shape[1]
+                if inputs_embeds.shape[1] > length and self._matches(entry, inputs_embeds[:, :length]):
+                    self._entries.move_to_end(voice_name)
+                    self.hits += 1
+                    return length, entry[1]
+            self.misses += 1
+        return None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "voices": len(self._entries),
+                "bytes": self.bytes,
+                "budget_bytes": self.budget_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class PrefixCachedTransformer(nn.Module):
+    """Stands in for gpt_inference.transformer and skips cached voice prefixes."""
+
+    def __init__(self, transformer, cache):
+        super().__init__()
+        self.transformer = transformer
+        self.cache = cache
+
+    def __getattr__(self, name):
+        try:
+            return super().__getattr__(name)
+        except AttributeError:
+            return getattr(super().__getattr__("transformer"), name)
+
+    def forward(self, inputs_embeds=None, past_key_values=None, attention_mask=None, **kwargs):
+        # Only the first generation step (whole prefix, no past yet) can use the cache
+        if past_key_values is None and inputs_embeds is not None and kwargs.get("use_cache") is not False:
+            cached = self.cache.lookup(inputs_embeds)
+            if cached is not None:
+                length, past_key_values = cached
+                inputs_embeds = inputs_embeds[:, length:]
+                # Per-position inputs must shrink with the embeddings; the mask still covers the past
+                for key in ("position_ids", "token_type_ids"):
+                    if kwargs.get(key) is not None:
+                        kwargs[key] = kwargs[key][:, length:]
+        return self.transformer(
+            inputs_embeds=inputs_embeds, past_key_values=past_key_values, attention_mask=attention_mask, **kwargs
+        )
+
+
+def install_prefix_cache(xtts, budget_mb=None):
+    """Wrap the model's generation transformer; returns the cache, or None if unsupported."""
+    gpt_inference = getattr(xtts.gpt, "gpt_inference", None)
+    if gpt_inference is None:
+        return None
+    if isinstance(gpt_inference.transformer, PrefixCachedTransformer):
+        return gpt_inference.transformer.cache
+    budget_mb = TTS_PREFIX_CACHE_MB if budget_mb is None else budget_mb
+    cache = VoicePrefixCache(gpt_inference.transformer, int(budget_mb * 1024 * 1024))
+    gpt_inference.transformer = PrefixCachedTransformer(gpt_inference.transformer, cache)
+    return cache